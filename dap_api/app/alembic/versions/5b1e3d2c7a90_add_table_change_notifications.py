@@ -0,0 +1,57 @@
+"""Add table change notifications
+
+Revision ID: 5b1e3d2c7a90
+Revises: 9e9c67334499
+Create Date: 2026-10-17 10:12:41.318205
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '5b1e3d2c7a90'
+down_revision = '9e9c67334499'
+branch_labels = None
+depends_on = None
+
+tables = ['disaster_areas', 'custom_speeds', 'disaster_types', 'providers']
+
+
+def upgrade():
+    # publishes changed rows on the table_changes channel, see app.db.change_listener
+    op.execute("""
+        CREATE OR REPLACE FUNCTION notify_table_change() RETURNS trigger AS $$
+        DECLARE
+            row_id integer;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                row_id := OLD.id;
+            ELSIF TG_OP IN ('INSERT', 'UPDATE') THEN
+                row_id := NEW.id;
+            END IF;
+            PERFORM pg_notify('table_changes', json_build_object(
+                'table', TG_TABLE_NAME,
+                'id', row_id,
+                'origin', current_setting('application_name', true)
+            )::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    for table in tables:
+        op.execute(f"""
+            CREATE TRIGGER {table}_notify_change
+            AFTER INSERT OR UPDATE OR DELETE ON {table}
+            FOR EACH ROW EXECUTE FUNCTION notify_table_change();
+        """)
+        op.execute(f"""
+            CREATE TRIGGER {table}_notify_truncate
+            AFTER TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_table_change();
+        """)
+
+
+def downgrade():
+    for table in tables:
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_notify_truncate ON {table};")
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_notify_change ON {table};")
+    op.execute("DROP FUNCTION IF EXISTS notify_table_change();")
@@ -1,6 +1,7 @@
 from fastapi import APIRouter
 
-from app.api.api_v1.endpoints import users, providers, disaster_types, disaster_sub_types, disaster_areas, custom_speeds, ors_connector
+from app.api.api_v1.endpoints import users, providers, disaster_types, disaster_sub_types, disaster_areas, custom_speeds, ors_connector, \
+    routing_jobs
 
 api_router = APIRouter()
 api_router.include_router(users.router, prefix="/collections/users", tags=["users"])
@@ -11,4 +12,6 @@ api_router.include_router(disaster_sub_types.router, prefix="/collections/disast
 api_router.include_router(disaster_areas.router, prefix="/collections/disaster_areas", tags=["disaster areas"])
 api_router.include_router(custom_speeds.router, prefix="/collections/custom_speeds", tags=["custom speeds"])
 
+# included first, its paths would otherwise match the routing paths
+api_router.include_router(routing_jobs.router, prefix="/routing/jobs", tags=["HeiGIT services"])
 api_router.include_router(ors_connector.router, prefix="/routing", tags=["HeiGIT services"])
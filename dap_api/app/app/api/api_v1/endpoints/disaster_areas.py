@@ -1,14 +1,42 @@
-from typing import Any, Optional
+from typing import Any, Callable, Iterator, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Path, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic.error_wrappers import ErrorWrapper
 from sqlalchemy.orm import Session
 from starlette import status
+from starlette.concurrency import run_in_threadpool
 
 from app import schemas, crud, models
 from app.api import deps
+from app.backend.area_ingest import SEQUENCE_MEDIA_TYPES, read_feature_sequence, parse_feature_collection, \
+    ingest_disaster_areas
+from app.backend.cache import cache_key
+from app.backend.geoutil import validity_reason, tile_bounds
+from app.backend.serialization import feature_collection_chunks, feature_sequence_chunks
+from app.backend.tile_cache import TileCache
+from app.config import settings
+from app.db.change_tracker import change_tracker
+from app.schemas.disaster_area import Polygon, MultiPolygon
+from app.crud.crud_disaster_area import InvalidGeometryError
 
 router = APIRouter()
+tile_cache = TileCache(
+    max_bytes=settings.DISASTER_AREA_TILE_CACHE_MAX_BYTES,
+    disk_max_bytes=settings.DISASTER_AREA_TILE_CACHE_DISK_MAX_BYTES,
+    disk_dir=settings.DISASTER_AREA_TILE_CACHE_DIR,
+    ttl=settings.DISASTER_AREA_TILE_CACHE_TTL
+) if settings.DISASTER_AREA_TILE_CACHE_ENABLED else None
+# tile extent and buffer in screen space
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+
+
+@router.on_event("shutdown")
+def close_tile_cache():
+    if tile_cache is not None:
+        tile_cache.close()
 
 
 @router.get(
@@ -30,9 +58,10 @@ def read_collection_metadata(
 
 @router.get(
     "/items",
-    response_model=schemas.DisasterAreaCollection,
+    response_model=schemas.DisasterAreaPage,
     summary="Read Disaster Areas",
     responses={
+        200: {"content": {"application/geo+json": {}, "application/geo+json-seq": {}}},
         400: {"model": schemas.BadRequestResponse, "description": """
 Bad Request
 
@@ -45,14 +74,23 @@ Error `code`:
     }
 )
 def read_disaster_areas(
+        request: Request,
         db: Session = Depends(deps.get_db),
         bbox: Optional[list] = Depends(deps.get_valid_bbox),
         date_time: str = Depends(deps.date_time_or_interval),
         d_type_id: Optional[int] = Query(None, gt=0),
-        c: dict = Depends(deps.common_multi_query_params)
+        c: dict = Depends(deps.common_multi_query_params),
+        after: Optional[int] = Depends(deps.page_cursor),
+        stream: Optional[schemas.FeatureStreamFormat] = Query(
+            None,
+            description="Streams all matching areas after the cursor, ignoring `skip` and `limit`, as "
+                        "FeatureCollection (`geojson`) or GeoJSON text sequence (`geojson-seq`)"
+        ),
+        session_factory: Callable[[], Session] = Depends(deps.get_session_factory)
 ) -> Any:
     """
-    Retrieve disaster areas.
+    Retrieve disaster areas, ordered by id. Follow the `next` link of a page to retrieve the next one, it is
+    present as long as the page is full.
     """
     skip, limit = c.values()
     if d_type_id is not None:
@@ -62,9 +100,103 @@ def read_disaster_areas(
                 "code": 3404,
                 "message": "A disaster type with this id does not exists."
             })
-    return crud.disaster_area.get_multi_as_feature_collection(
-        db, skip=skip, limit=limit, bbox=bbox, d_type_id=d_type_id, date_time=date_time
+    if stream is not None:
+        filters = dict(bbox=bbox, d_type_id=d_type_id, date_time=date_time, after=after)
+        if stream == schemas.FeatureStreamFormat.sequence:
+            return StreamingResponse(stream_features(session_factory, feature_sequence_chunks, filters),
+                                     media_type="application/geo+json-seq")
+        return StreamingResponse(stream_features(session_factory, feature_collection_chunks, filters),
+                                 media_type="application/geo+json")
+    collection = crud.disaster_area.get_multi_as_feature_collection(
+        db, skip=skip, limit=limit, bbox=bbox, d_type_id=d_type_id, date_time=date_time, after=after
     )
+    links = []
+    if len(collection.features) == limit:
+        next_url = request.url.remove_query_params("skip") \
+            .include_query_params(cursor=deps.encode_cursor(collection.features[-1].id))
+        links.append({"rel": "next", "type": "application/geo+json", "href": str(next_url)})
+    return schemas.DisasterAreaPage(features=collection.features, bbox=collection.bbox, links=links)
+
+
+def stream_features(session_factory: Callable[[], Session],
+                    encode: Callable[[Iterator[dict]], Iterator[bytes]], filters: dict) -> Iterator[bytes]:
+    """
+    Encodes the features matching the filters while they are read, with a session of its own that lasts
+    as long as the response
+    """
+    db = session_factory()
+    try:
+        yield from encode(crud.disaster_area.iter_features(db, **filters))
+    finally:
+        db.close()
+
+
+@router.get(
+    "/tiles/cache",
+    summary="Read vector tile cache statistics"
+)
+def read_tile_cache_stats(
+        admin: models.User = Depends(deps.check_admin_auth)
+) -> Any:
+    """
+    Get size and hit/miss counters of the vector tile cache.
+    """
+    if tile_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **tile_cache.stats()}
+
+
+@router.get(
+    "/tiles/{z}/{x}/{y}",
+    summary="Read Disaster Area Vector Tile",
+    response_class=Response,
+    responses={
+        200: {"content": {"application/vnd.mapbox-vector-tile": {}}},
+        400: {"model": schemas.BadRequestResponse, "description": """
+Bad Request
+
+An additional error code + message is provided.
+
+Error `code`:
+- `3404`: Disaster type does not exist
+"""
+              },
+        404: {"model": schemas.HttpErrorResponse, "description": "Tile does not exist"}
+    }
+)
+def read_disaster_area_tile(
+        z: int = Path(..., ge=0, le=24),
+        x: int = Path(..., ge=0),
+        y: int = Path(..., ge=0),
+        db: Session = Depends(deps.get_db),
+        date_time: str = Depends(deps.date_time_or_interval),
+        d_type_id: Optional[int] = Query(None, gt=0)
+) -> Any:
+    """
+    Get the disaster areas within a web mercator tile as Mapbox Vector Tile. The tile has a single layer
+    `disaster_areas` with the properties of the areas, their ids are the feature ids.
+    """
+    if x >= 2 ** z or y >= 2 ** z:
+        raise HTTPException(
+            status_code=404,
+            detail=f"The tile {z}/{x}/{y} does not exist"
+        )
+    if d_type_id is not None:
+        disaster_type = crud.disaster_type.get(db, id=d_type_id)
+        if not disaster_type:
+            return JSONResponse(status_code=400, content={
+                "code": 3404,
+                "message": "A disaster type with this id does not exists."
+            })
+    key = cache_key("tile", z, x, y, d_type_id, date_time)
+    tile = tile_cache.get(db, key) if tile_cache is not None else None
+    if tile is None:
+        stamp = change_tracker.stamp(models.DisasterArea.__tablename__)
+        tile, area_ids = crud.disaster_area.get_tile(db, z, x, y, d_type_id=d_type_id, date_time=date_time,
+                                                     extent=TILE_EXTENT, buffer=TILE_BUFFER)
+        if tile_cache is not None:
+            tile_cache.set(key, tile, tile_bounds(z, x, y, TILE_BUFFER / TILE_EXTENT), area_ids, stamp)
+    return Response(tile, media_type="application/vnd.mapbox-vector-tile")
 
 
 @router.post(
@@ -94,6 +226,7 @@ def create_disaster_area(
     """
     Create new disaster area.
     """
+    check_geometry(disaster_area_in.geometry)
     provider = crud.provider.get(db, id=disaster_area_in.properties.provider_id)
     if not provider:
         return JSONResponse(status_code=400, content={
@@ -118,8 +251,60 @@ def create_disaster_area(
             "code": 5409,
             "message": "A disaster area with this name already exists in the system."
         })
-    db_entry = crud.disaster_area.create(db, obj_in=disaster_area_in)
-    return crud.disaster_area.get_as_feature(db, db_entry.id)
+    try:
+        return crud.disaster_area.create_as_feature(db, obj_in=disaster_area_in)
+    except InvalidGeometryError as e:
+        raise RequestValidationError([ErrorWrapper(e, loc=("body", "geometry"))])
+
+
+@router.post(
+    "/items/bulk",
+    response_model=schemas.DisasterAreaIngestReport,
+    summary="Create Disaster Areas in bulk",
+    responses={
+        400: {"model": schemas.HttpErrorResponse, "description": "Upload is no FeatureCollection or feature "
+                                                                 "sequence, or has too many features"}
+    },
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/geo+json": {"schema": {"type": "object"}},
+                "application/geo+json-seq": {"schema": {"type": "string"}}
+            }
+        }
+    }
+)
+async def create_disaster_areas(
+        request: Request,
+        db: Session = Depends(deps.get_db),
+        user: models.User = Depends(deps.check_auth_header)
+) -> Any:
+    """
+    Create many disaster areas at once, from a GeoJSON FeatureCollection or a GeoJSON text sequence
+    (`application/geo+json-seq`, one feature per line). Features are validated like for a single area and the
+    valid ones are created in a single transaction. The result of every feature is reported by its position
+    in the upload, rejected features get the `code` and `message` of the error:
+    - `2403`: Not allowed to publish data for the provider
+    - `2404`: Provider does not exist
+    - `3404`: Disaster type does not exist
+    - `4404`: Disaster sub type does not exist
+    - `5409`: Disaster area name already in use
+    - `5422`: Invalid feature or geometry
+    """
+    max_features = settings.DISASTER_AREA_INGEST_MAX_FEATURES
+    media_type = request.headers.get("content-type", "").split(";")[0].strip()
+    try:
+        if media_type in SEQUENCE_MEDIA_TYPES:
+            features = await read_feature_sequence(request.stream(), max_features)
+        else:
+            features = parse_feature_collection(await request.body(), max_features)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    return await run_in_threadpool(ingest_disaster_areas, db, features, user)
 
 
 @router.get(
@@ -163,6 +348,7 @@ def update_disaster_area_by_id(
     """
     Update a specific disaster area by id.
     """
+    check_geometry(disaster_area_in.geometry)
     disaster_area = crud.disaster_area.get(db, id=disaster_area_id)
     if not disaster_area:
         raise HTTPException(
@@ -176,8 +362,10 @@ def update_disaster_area_by_id(
             detail="You are not allowed to edit data for this provider. "
                    f"Please contact them at {provider.email}",
         )
-    disaster_area = crud.disaster_area.update(db, db_obj=disaster_area, obj_in=disaster_area_in)
-    return crud.disaster_area.get_as_feature(db, disaster_area.id)
+    try:
+        return crud.disaster_area.update_as_feature(db, id=disaster_area_id, obj_in=disaster_area_in)
+    except InvalidGeometryError as e:
+        raise RequestValidationError([ErrorWrapper(e, loc=("body", "geometry"))])
 
 
 @router.delete(
@@ -212,3 +400,16 @@ def delete_disaster_area_by_id(
     area_feature = crud.disaster_area.get_as_feature(db, disaster_area.id)
     crud.disaster_area.remove(db, id=disaster_area_id)
     return area_feature
+
+
+def check_geometry(geometry: Polygon | MultiPolygon | None) -> None:
+    """
+    Validates an uploaded geometry before any query is sent. The endpoints are executed in the threadpool,
+    so the event loop is not blocked. Without in-process validation, the geometry is validated by PostGIS on write.
+    @raise RequestValidationError: if the geometry is not valid
+    """
+    if geometry is None or not settings.DISASTER_AREA_VALIDATION_IN_PROCESS:
+        return
+    reason = validity_reason(geometry.dict())
+    if reason != "Valid Geometry":
+        raise RequestValidationError([ErrorWrapper(InvalidGeometryError(reason), loc=("body", "geometry"))])
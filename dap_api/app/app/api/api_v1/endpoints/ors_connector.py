@@ -1,18 +1,68 @@
-from typing import Any
+from typing import Any, Callable
 
 from fastapi import APIRouter, Depends, Response, Body, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import conlist
 from sqlalchemy.orm import Session
 from starlette import status
 
+from app import models
 from app.api import deps
+from app.backend.cache import ResponseCache
 from app.backend.ors_processor import ORSProcessor
+from app.backend.spatial_index import DisasterAreaIndex
 from app.config import settings
 from app.schemas import PathOptions, OrsResponseType, PathOptionsValidation, BadRequestResponse
 from app.schemas.ors_request import ORSDirections, ORSIsochrones
 from app.schemas.utils import ISO_EXAMPLES, DIR_EXAMPLES, BASE_EXAMPLE
 
 router = APIRouter()
-ors_processor = ORSProcessor(settings.ORS_BACKEND_URL)
+ors_processor = ORSProcessor(
+    settings.ORS_BACKEND_URL,
+    cache=ResponseCache(
+        max_entries=settings.ORS_CACHE_MAX_ENTRIES,
+        max_bytes=settings.ORS_CACHE_MAX_BYTES,
+        ttl=settings.ORS_CACHE_TTL
+    ) if settings.ORS_CACHE_ENABLED else None,
+    area_index=DisasterAreaIndex(
+        max_age=settings.DISASTER_AREA_INDEX_MAX_AGE
+    ) if settings.DISASTER_AREA_INDEX_ENABLED else None
+)
+
+
+@router.on_event("shutdown")
+async def close_relay_clients():
+    await ors_processor.close()
+
+
+@router.get(
+    "/cache",
+    summary="Read relay cache statistics"
+)
+def read_cache_stats(
+        admin: models.User = Depends(deps.check_admin_auth)
+) -> Any:
+    """
+    Get size and hit/miss counters of the relay response cache.
+    """
+    if ors_processor.cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **ors_processor.cache.stats()}
+
+
+@router.get(
+    "/area_index",
+    summary="Read disaster area index statistics"
+)
+def read_area_index_stats(
+        admin: models.User = Depends(deps.check_admin_auth)
+) -> Any:
+    """
+    Get size, estimated memory footprint and staleness of the in-memory disaster area index.
+    """
+    if ors_processor.area_index is None:
+        return {"enabled": False}
+    return {"enabled": True, **ors_processor.area_index.stats()}
 
 
 @router.get(
@@ -30,7 +80,7 @@ Error `code`:
               }
     }
 )
-def ors_get(
+async def ors_get(
         path_options: PathOptionsValidation = Depends(),
         api_key: str = Depends(deps.ors_api_key_param),
         start: str = Depends(deps.ors_start_param),
@@ -49,7 +99,7 @@ def ors_get(
         ],
         "user_speed_limits": user_speed_limits
     })
-    return process_ors_request(request, api_key, db, path_options, ors_response_type=OrsResponseType("geojson"))
+    return await process_ors_request(request, api_key, db, path_options, ors_response_type=OrsResponseType("geojson"))
 
 
 @router.post(
@@ -67,7 +117,7 @@ Error `code`:
               }
     }
 )
-def ors_post(
+async def ors_post(
         request: ORSIsochrones | ORSDirections = Body(
             None,
             examples=BASE_EXAMPLE | ISO_EXAMPLES | DIR_EXAMPLES
@@ -77,7 +127,46 @@ def ors_post(
         db: Session = Depends(deps.get_db)
 ) -> Any:
     response_type = OrsResponseType("geojson") if path_options.ors_api == "isochrones" else OrsResponseType("json")
-    return process_ors_request(request, authorization, db, path_options, ors_response_type=response_type)
+    return await process_ors_request(request, authorization, db, path_options, ors_response_type=response_type)
+
+
+# registered before the response type route, which would match the same path
+@router.post(
+    "/{portal_mode}/{ors_api}/{ors_profile}/batch",
+    summary="Query ORS with a batch of requests",
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {"application/x-ndjson": {}}, "description": """
+Newline delimited JSON, one object per request of the batch in the order the requests complete:
+- `index`: position of the request in the batch
+- `status_code`: status code of the request
+- `body`: response of the request, GPX responses as string
+"""
+              }
+    }
+)
+async def ors_post_batch(
+        requests: conlist(ORSIsochrones | ORSDirections, min_items=1, max_items=settings.ORS_BATCH_MAX_ITEMS) = Body(
+            ...
+        ),
+        path_options: PathOptionsValidation = Depends(),
+        authorization: str = Depends(deps.ors_auth_header),
+        db: Session = Depends(deps.get_db),
+        session_factory: Callable[[], Session] = Depends(deps.get_session_factory),
+        ors_response_type: OrsResponseType = None
+) -> Any:
+    """
+    Relay a batch of requests. Disaster areas are looked up once for the whole batch and the requests are relayed
+    concurrently. Per request errors are reported with the status code of the request.
+    """
+    if ors_response_type is None:
+        ors_response_type = OrsResponseType("geojson") if path_options.ors_api == "isochrones" \
+            else OrsResponseType("json")
+    path_options = PathOptions(**path_options.dict(), ors_response_type=ors_response_type)
+    return StreamingResponse(
+        ors_processor.handle_ors_batch(db, requests, path_options, authorization, session_factory=session_factory),
+        media_type="application/x-ndjson"
+    )
 
 
 @router.post(
@@ -95,7 +184,7 @@ Error `code`:
               }
     }
 )
-def ors_post_response_type(
+async def ors_post_response_type(
         request: ORSIsochrones | ORSDirections = Body(
             None,
             examples=BASE_EXAMPLE | ISO_EXAMPLES | DIR_EXAMPLES
@@ -105,11 +194,11 @@ def ors_post_response_type(
         path_options: PathOptionsValidation = Depends(),
         ors_response_type: OrsResponseType = "geojson"
 ) -> Any:
-    return process_ors_request(request,
-                               ors_authorization, db, path_options, ors_response_type)
+    return await process_ors_request(request,
+                                     ors_authorization, db, path_options, ors_response_type)
 
 
-def process_ors_request(
+async def process_ors_request(
         request: ORSIsochrones | ORSDirections,
         header_authorization: str,
         db: Session,
@@ -127,5 +216,7 @@ def process_ors_request(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Your request body (isochrones) doesn't match the ors_api ({path_options.ors_api})"
         )
-    result = ors_processor.handle_ors_request(db, request, path_options, header_authorization)
-    return Response(result.body, status_code=result.status_code, media_type=result.media_type)
+    result = await ors_processor.handle_ors_request(db, request, path_options, header_authorization)
+    if isinstance(result, Response):
+        return result
+    return Response(result.body, status_code=result.status_code, media_type=result.media_type, headers=result.headers)
@@ -0,0 +1,180 @@
+from typing import Any, Callable
+
+from fastapi import APIRouter, Depends, Response, Body, HTTPException
+from pydantic import conlist
+from sqlalchemy.orm import Session
+from starlette import status
+from starlette.concurrency import run_in_threadpool
+
+from app import crud, schemas
+from app.api import deps
+from app.api.api_v1.endpoints.ors_connector import ors_processor
+from app.backend.jobs import JobRunner
+from app.backend.ors_processor import matches_api, response_body
+from app.backend.serialization import dumps
+from app.config import settings
+from app.schemas import PathOptions, OrsResponseType, PathOptionsValidation
+from app.schemas.ors_request import ORSDirections, ORSIsochrones
+from app.schemas.utils import ISO_EXAMPLES, DIR_EXAMPLES, BASE_EXAMPLE
+
+router = APIRouter()
+job_runner = JobRunner(workers=settings.ROUTING_JOB_WORKERS)
+
+
+@router.on_event("shutdown")
+async def close_job_runner():
+    await job_runner.close()
+
+
+@router.post(
+    "/{portal_mode}/{ors_api}/{ors_profile}",
+    response_model=schemas.RoutingJob,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Submit ORS job",
+    responses={
+        400: {"model": schemas.HttpErrorResponse, "description": "Request body doesn't match the ors_api"}
+    }
+)
+async def create_routing_job(
+        response: Response,
+        request: ORSIsochrones | ORSDirections = Body(
+            None,
+            examples=BASE_EXAMPLE | ISO_EXAMPLES | DIR_EXAMPLES
+        ),
+        path_options: PathOptionsValidation = Depends(),
+        authorization: str = Depends(deps.ors_auth_header),
+        db: Session = Depends(deps.get_db),
+        session_factory: Callable[[], Session] = Depends(deps.get_session_factory),
+        ors_response_type: OrsResponseType = None
+) -> Any:
+    """
+    Submit a routing request to be processed in the background, e.g. for `generate_difference` requests which take
+    longer than a request may last. Poll the returned job for its status and fetch the result once it succeeded.
+    """
+    path_options = job_path_options(path_options, ors_response_type)
+    if not matches_api(request, path_options):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Your request body doesn't match the ors_api ({path_options.ors_api.value})"
+        )
+
+    async def work(job_db: Session):
+        try:
+            result = await ors_processor.handle_ors_request(job_db, request, path_options, authorization)
+        except HTTPException as e:
+            return e.status_code, dumps({"detail": e.detail}), "application/json"
+        return result.status_code, await response_body(result), result.media_type
+
+    job = await run_in_threadpool(store_job, db, path_options, dumps(request.dict(by_alias=True)).decode())
+    job_runner.submit(job.id, work, session_factory)
+    response.headers["Location"] = f"{settings.API_V1_STR}/routing/jobs/{job.id}"
+    return job
+
+
+@router.post(
+    "/{portal_mode}/{ors_api}/{ors_profile}/batch",
+    response_model=schemas.RoutingJob,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Submit ORS batch job"
+)
+async def create_routing_batch_job(
+        response: Response,
+        requests: conlist(ORSIsochrones | ORSDirections, min_items=1, max_items=settings.ORS_BATCH_MAX_ITEMS) = Body(
+            ...
+        ),
+        path_options: PathOptionsValidation = Depends(),
+        authorization: str = Depends(deps.ors_auth_header),
+        db: Session = Depends(deps.get_db),
+        session_factory: Callable[[], Session] = Depends(deps.get_session_factory),
+        ors_response_type: OrsResponseType = None
+) -> Any:
+    """
+    Submit a batch of routing requests to be processed in the background. The result is the newline delimited JSON
+    of the batch endpoint, ordered by completion.
+    """
+    path_options = job_path_options(path_options, ors_response_type)
+
+    async def work(job_db: Session):
+        lines = [line async for line in ors_processor.handle_ors_batch(job_db, requests, path_options, authorization,
+                                                                       session_factory=session_factory)]
+        return 200, b"".join(lines), "application/x-ndjson"
+
+    request = dumps([r.dict(by_alias=True) for r in requests]).decode()
+    job = await run_in_threadpool(store_job, db, path_options, request)
+    job_runner.submit(job.id, work, session_factory)
+    response.headers["Location"] = f"{settings.API_V1_STR}/routing/jobs/{job.id}"
+    return job
+
+
+@router.get(
+    "/{job_id}",
+    response_model=schemas.RoutingJob,
+    summary="Read ORS job",
+    responses={
+        404: {"model": schemas.HttpErrorResponse, "description": "Item not found"}
+    }
+)
+def read_routing_job(
+        job_id: str,
+        db: Session = Depends(deps.get_db)
+) -> Any:
+    """
+    Get the status of a routing job.
+    """
+    return get_job_or_404(db, job_id)
+
+
+@router.get(
+    "/{job_id}/result",
+    summary="Read ORS job result",
+    responses={
+        404: {"model": schemas.HttpErrorResponse, "description": "Item not found"},
+        409: {"model": schemas.HttpErrorResponse, "description": "Job has not succeeded"}
+    }
+)
+def read_routing_job_result(
+        job_id: str,
+        db: Session = Depends(deps.get_db)
+) -> Any:
+    """
+    Get the result of a succeeded routing job, with the status code and content type of the ORS response.
+    """
+    job = get_job_or_404(db, job_id)
+    if job.status != schemas.JobStatus.succeeded:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"The routing job has not succeeded, its status is {job.status}"
+        )
+    return Response(job.result, status_code=job.status_code, media_type=job.media_type)
+
+
+def job_path_options(path_options: PathOptionsValidation, ors_response_type: OrsResponseType | None) -> PathOptions:
+    if ors_response_type is None:
+        ors_response_type = OrsResponseType("geojson") if path_options.ors_api == "isochrones" \
+            else OrsResponseType("json")
+    return PathOptions(**path_options.dict(), ors_response_type=ors_response_type)
+
+
+def store_job(db: Session, path_options: PathOptions, request: str) -> schemas.RoutingJob:
+    """
+    Stores a new job, expired jobs are removed
+    """
+    crud.routing_job.remove_expired(db, max_age=settings.ROUTING_JOB_TTL)
+    job = crud.routing_job.create(db, obj_in=schemas.RoutingJobCreate(
+        portal_mode=path_options.portal_mode.value,
+        ors_api=path_options.ors_api.value,
+        ors_profile=path_options.ors_profile.value,
+        ors_response_type=path_options.ors_response_type.value,
+        request=request
+    ))
+    return schemas.RoutingJob.from_orm(job)
+
+
+def get_job_or_404(db: Session, job_id: str):
+    job = crud.routing_job.get(db, id=job_id)
+    if not job:
+        raise HTTPException(
+            status_code=404,
+            detail="The routing job with this id does not exist in the system",
+        )
+    return job
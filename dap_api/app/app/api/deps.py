@@ -1,6 +1,7 @@
 """
 Reusable dependencies that are injected into different endpoints
 """
+import base64
 from typing import List, Optional
 
 from dateutil.parser import isoparse
@@ -26,6 +27,13 @@ def get_db():  # pragma: no cover
         db.close()
 
 
+def get_session_factory():  # pragma: no cover
+    """
+    Returns the factory of db sessions for work that outlives or runs beside the session of the request
+    """
+    return SessionLocal
+
+
 def get_valid_bbox(bbox: Optional[List[str]] = Query(
     **bbox_parameter
 )
@@ -51,6 +59,36 @@ def common_multi_query_params(
     return {"skip": skip, "limit": limit}
 
 
+def encode_cursor(last_id: int) -> str:
+    """
+    Encodes the position after the item with this id as opaque cursor
+    """
+    return base64.urlsafe_b64encode(f"id:{last_id}".encode()).decode().rstrip("=")
+
+
+def page_cursor(cursor: Optional[str] = Query(
+    None,
+    description="Continues a listing after the last item of the previous page. Use the `next` link of a page "
+                "instead of composing it."
+)) -> Optional[int]:
+    """
+    Decodes a cursor of encode_cursor
+    @return: id of the last item of the previous page
+    """
+    if cursor is None:
+        return None
+    try:
+        key, last_id = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split(":")
+        if key != "id":
+            raise ValueError(key)
+        return int(last_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=422,
+            detail=[ErrorDetailObject(loc=["query", "cursor"], msg="Invalid cursor").dict()]
+        )
+
+
 def ors_api_key_param(api_key: str = Query(None)):
     if not api_key:
         raise HTTPException(status_code=400, detail="Openrouteservice api key missing in api_key parameter")
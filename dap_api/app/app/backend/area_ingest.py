@@ -0,0 +1,151 @@
+"""
+Bulk ingestion of disaster areas
+
+An upload is either a GeoJSON FeatureCollection or a GeoJSON text sequence with one feature per line. All
+features are checked with set based queries before the valid ones are created in a single transaction, see
+CRUDDisasterArea.create_bulk. The result of every feature is reported by its position in the upload.
+"""
+from typing import Any, AsyncIterator, Dict, List
+
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from app import crud, models, schemas
+from app.backend.geoutil import validity_reasons
+from app.backend.serialization import loads
+from app.config import settings
+
+# media types of GeoJSON text sequences (RFC 8142) and newline delimited features
+SEQUENCE_MEDIA_TYPES = {"application/geo+json-seq", "application/json-seq", "application/x-ndjson"}
+RECORD_SEPARATOR = b"\x1e"
+
+
+def parse_feature_collection(body: bytes, max_features: int) -> List[Any]:
+    """
+    Reads the features of a FeatureCollection
+    @param body: GeoJSON document
+    @param max_features: maximum number of features
+    @return: features, not validated yet
+    @raise ValueError: if the document is no FeatureCollection or has too many features
+    """
+    collection = loads(body)
+    if not isinstance(collection, dict) or not isinstance(collection.get("features"), list):
+        raise ValueError("A FeatureCollection with a features array is required")
+    features = collection["features"]
+    if len(features) > max_features:
+        raise ValueError(f"An upload can contain at most {max_features} features")
+    return features
+
+
+async def read_feature_sequence(chunks: AsyncIterator[bytes], max_features: int) -> List[Any]:
+    """
+    Reads the features of a GeoJSON text sequence while it is received. Features are separated by new lines
+    and may be preceded by a record separator.
+    @param chunks: received body
+    @param max_features: maximum number of features
+    @return: features, not validated yet
+    @raise ValueError: if a line is no JSON document or the sequence has too many features
+    """
+    features = []
+    buffer = b""
+
+    def add(line: bytes):
+        line = line.strip().lstrip(RECORD_SEPARATOR).strip()
+        if not line:
+            return
+        if len(features) == max_features:
+            raise ValueError(f"An upload can contain at most {max_features} features")
+        try:
+            features.append(loads(line))
+        except ValueError as e:
+            raise ValueError(f"Feature {len(features)} is no valid JSON: {e}")
+
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            add(line)
+    add(buffer)
+    return features
+
+
+def validation_message(e: ValidationError) -> str:
+    error = e.errors()[0]
+    loc = ".".join(str(part) for part in error["loc"])
+    return f"{loc}: {error['msg']}" if loc else error["msg"]
+
+
+def ingest_disaster_areas(db: Session, features: List[Any], user: models.User) -> schemas.DisasterAreaIngestReport:
+    """
+    Creates the valid features of an upload. Features are rejected with the error codes of the single
+    create endpoint, extended by `2403` for providers the user may not publish for, `4404` for unknown
+    disaster sub types and `5422` for invalid features or geometries.
+    @param db: db session
+    @param features: uploaded features
+    @param user: uploading user
+    @return: result of every feature
+    """
+    errors: Dict[int, schemas.DisasterAreaIngestResult] = {}
+    areas: Dict[int, schemas.DisasterAreaCreate] = {}
+
+    def reject(i: int, code: int, message: str):
+        name = areas.pop(i).properties.name if i in areas else None
+        errors[i] = schemas.DisasterAreaIngestResult(index=i, name=name, code=code, message=message)
+
+    for i, feature in enumerate(features):
+        try:
+            areas[i] = schemas.DisasterAreaCreate.parse_obj(feature)
+        except ValidationError as e:
+            reject(i, 5422, validation_message(e))
+
+    if settings.DISASTER_AREA_VALIDATION_IN_PROCESS:
+        indexes = list(areas)
+        batch_size = settings.DISASTER_AREA_INGEST_BATCH_SIZE
+        for start in range(0, len(indexes), batch_size):
+            batch = indexes[start:start + batch_size]
+            reasons = validity_reasons([areas[i].geometry.dict() for i in batch])
+            for i, reason in zip(batch, reasons):
+                if reason != "Valid Geometry":
+                    reject(i, 5422, f"Geometry not valid: {reason}")
+
+    properties = [a.properties for a in areas.values()]
+    providers = {p.id: p for p in crud.provider.get_multi_by_ids(db, (p.provider_id for p in properties))}
+    d_types = {t.id for t in crud.disaster_type.get_multi_by_ids(db, (p.d_type_id for p in properties))}
+    ds_types = {t.id for t in crud.disaster_sub_type.get_multi_by_ids(
+        db, (p.ds_type_id for p in properties if p.ds_type_id is not None)
+    )}
+    for i, area in list(areas.items()):
+        provider = providers.get(area.properties.provider_id)
+        if provider is None:
+            reject(i, 2404, "A provider with the given provider_id does not exist.")
+        elif not (user.is_admin or user.id == provider.owner_id):
+            reject(i, 2403, "You are not allowed to publish data for this provider. "
+                            f"Please contact them at {provider.email}")
+        elif area.properties.d_type_id not in d_types:
+            reject(i, 3404, "A disaster type with this id does not exists.")
+        elif area.properties.ds_type_id is not None and area.properties.ds_type_id not in ds_types:
+            reject(i, 4404, "A disaster sub type with this id does not exists.")
+
+    existing = crud.disaster_area.get_existing_names(db, (a.properties.name for a in areas.values()))
+    names = set()
+    for i, area in list(areas.items()):
+        if area.properties.name in existing or area.properties.name in names:
+            reject(i, 5409, "A disaster area with this name already exists in the system.")
+        names.add(area.properties.name)
+
+    created, invalid = crud.disaster_area.create_bulk(db, objs_in=areas)
+    for i in list(areas):
+        if i in invalid:
+            reject(i, 5422, f"Geometry not valid: {invalid[i]}")
+        elif i not in created:
+            reject(i, 5409, "A disaster area with this name already exists in the system.")
+
+    results = [
+        errors.get(i) or schemas.DisasterAreaIngestResult(index=i, id=created[i], name=areas[i].properties.name)
+        for i in range(len(features))
+    ]
+    return schemas.DisasterAreaIngestReport(
+        created=len(created),
+        failed=len(errors),
+        results=results
+    )
@@ -1,19 +1,135 @@
+import asyncio
+import time
+from typing import Dict, Tuple
+
+import httpx
 from fastapi import HTTPException
 
-import requests
+from app.backend.serialization import dumps
+from app.config import settings
 
 
 class BaseProcessor:
     def __init__(self, base_path: str):
         self.base_path = base_path
+        self.timeout = httpx.Timeout(settings.ORS_READ_TIMEOUT, connect=settings.ORS_CONNECT_TIMEOUT)
+        self.limits = httpx.Limits(
+            max_connections=settings.ORS_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.ORS_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.ORS_KEEPALIVE_EXPIRY
+        )
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def get_client(self, base_path: str = None) -> httpx.AsyncClient:
+        """
+        Returns the pooled client of a backend. Each backend gets its own connection pool,
+        so connections are kept alive between requests and the connection limits apply per backend.
+        @param base_path: base url of the backend, defaults to the base path of the processor
+        @return: async http client
+        """
+        if not base_path:
+            base_path = self.base_path
+        client = self._clients.get(base_path)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+            self._clients[base_path] = client
+        return client
 
-    def relay_request_post(self, path: str, header: dict, body: dict, base_path: str = None) -> requests.Response:
+    async def relay_request_post(self, path: str, header: dict, body: dict, base_path: str = None) -> httpx.Response:
         if not base_path:
             base_path = self.base_path
         try:
-            return requests.post(url=base_path + path, headers=header, json=body)
-        except requests.exceptions.ConnectionError as e:
+            return await self.get_client(base_path).post(url=base_path + path, content=dumps(body),
+                                                         headers={"Content-Type": "application/json", **header})
+        except httpx.TimeoutException as e:
+            raise HTTPException(
+                status_code=504,
+                detail=f"Request to backend timed out: {e!r}"
+            )
+        except httpx.TransportError as e:
             raise HTTPException(
                 status_code=500,
                 detail=f"Connection to backend failed: {e}"
             )
+
+    async def relay_request_stream(self, path: str, header: dict, body: dict,
+                                   base_path: str = None) -> httpx.Response:
+        """
+        Relays a request to the backend and returns as soon as the response headers arrived.
+        The body is read by iterating the response, which has to be closed afterwards.
+        @param path: path of the backend endpoint
+        @param header: request headers
+        @param body: request body
+        @param base_path: base url of the backend, defaults to the base path of the processor
+        @return: open streaming response
+        """
+        if not base_path:
+            base_path = self.base_path
+        client = self.get_client(base_path)
+        request = client.build_request("POST", url=base_path + path, content=dumps(body),
+                                       headers={"Content-Type": "application/json", **header})
+        try:
+            return await client.send(request, stream=True)
+        except httpx.TimeoutException as e:
+            raise HTTPException(
+                status_code=504,
+                detail=f"Request to backend timed out: {e!r}"
+            )
+        except httpx.TransportError as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Connection to backend failed: {e}"
+            )
+
+    async def relay_requests_post(self, calls: Dict[str, Tuple[str, dict, dict]], base_path: str = None,
+                                  timings: Dict[str, float] = None) -> Dict[str, httpx.Response]:
+        """
+        Relays independent requests to the backend concurrently.
+        The requests share their cancellation: as soon as one of them fails or returns an error status,
+        the remaining ones are cancelled.
+        @param calls: path, header and body of each request by name
+        @param base_path: base url of the backend
+        @param timings: if passed, the duration of each finished request is added in milliseconds by name
+        @return: responses by name. Requests cancelled due to an error response are missing.
+        """
+        if timings is None:
+            timings = {}
+
+        async def timed_relay(name: str, path: str, header: dict, body: dict) -> httpx.Response:
+            start = time.perf_counter()
+            response = await self.relay_request_post(path, header, body, base_path=base_path)
+            timings[name] = round((time.perf_counter() - start) * 1000, 1)
+            return response
+
+        tasks = {asyncio.create_task(timed_relay(name, *call)): name for name, call in calls.items()}
+        responses = {}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    response = task.result()  # raises if the request failed
+                    responses[tasks[task]] = response
+                    if response.status_code != 200:
+                        return responses
+        finally:
+            for task in pending:
+                task.cancel()
+        return responses
+
+    async def close(self) -> None:
+        """
+        Closes the connection pools of all backends
+        """
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+
+def server_timing_header(timings: Dict[str, float]) -> Dict[str, str]:
+    """
+    Returns a Server-Timing header for timings in milliseconds by name
+    """
+    if not timings:
+        return {}
+    return {"Server-Timing": ", ".join(f"{name};dur={duration}" for name, duration in timings.items())}
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from app.db.change_tracker import ChangeTracker, change_tracker
+
+
+class CacheEntry(NamedTuple):
+    value: Any
+    size: int
+    stamp: Dict[str, int]
+    expires: float
+
+
+class ResponseCache:
+    """
+    LRU cache with time-to-live and byte budget.
+    Entries are stamped with the versions of the tables they were computed from. Entries whose tables
+    changed are dropped as soon as the change tracker reports the change, and are never returned.
+    """
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 64 * 1024 * 1024, ttl: float = 300,
+                 tracker: ChangeTracker = change_tracker):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.tracker = tracker
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.size = 0
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._tracked_tables = set()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires < time.monotonic() or not self.tracker.is_current(entry.stamp):
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def set(self, key: str, value: Any, size: int, stamp: Dict[str, int]) -> None:
+        """
+        Adds an entry to the cache
+        @param key: cache key
+        @param value: cached value
+        @param size: size of the value in bytes
+        @param stamp: table versions taken before the value was computed
+        """
+        if size > self.max_bytes or not self.tracker.is_current(stamp):
+            return
+        for table in stamp:
+            self._track(table)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = CacheEntry(value, size, stamp, time.monotonic() + self.ttl)
+            self.size += size
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, table: str, ids: Optional[List[Any]] = None) -> None:
+        """
+        Drops all entries computed from a table. Responses can't be related to single rows,
+        so the ids of changed rows are ignored.
+        """
+        with self._lock:
+            keys = [k for k, e in self._entries.items() if table in e.stamp]
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self.size -= entry.size
+
+    def _track(self, table: str) -> None:
+        if table not in self._tracked_tables:
+            self._tracked_tables.add(table)
+            self.tracker.subscribe(table, self.invalidate)
+
+
+def cache_key(*parts: Any) -> str:
+    """
+    Returns a content hash for JSON serializable parts. Dict keys are sorted, so equal content
+    always results in the same key.
+    """
+    content = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
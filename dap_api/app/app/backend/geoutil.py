@@ -1,13 +1,33 @@
 import json
+import math
 from typing import List
 
 import geopy
 import geopy.distance
+import numpy as np
+import shapely
 from geoalchemy2 import func
+from shapely.geometry import mapping, shape
+from sqlalchemy import Integer, String, column, select, values
 from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
 from sqlalchemy.sql.functions import Function
 
+from app.logger import logger
 from app.schemas import OrsApi, OrsResponseType
+from app.schemas.disaster_area import LookupGeometry
+
+# number of decimal digits of elevations in encoded polylines of ORS
+ELEVATION_PRECISION = 2
+# WGS84 ellipsoid semi-major axis in meters and flattening
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+# mean earth radius in meters
+EARTH_RADIUS = 6371008.8
+# maximum length in meters of the pieces lookup geometries are split into to measure distances locally
+LOOKUP_SEGMENT_LENGTH = 5000
+# validity reason of GeoJSON geometries that GEOS can not read
+UNREADABLE_GEOMETRY = "Invalid GeoJSON geometry"
 
 
 def point_from_point_bearing_distance(lon: float, lat: float, bearing: float, distance: float) -> (float, float):
@@ -77,6 +97,26 @@ def restrict_latitude(lat: float) -> float | int:
     return int(lat) if float(lat).is_integer() else lat
 
 
+def tile_bounds(z: int, x: int, y: int, buffer: float = 0) -> List[float]:
+    """
+    Bounds of a web mercator (XYZ) tile in WGS84
+    @param z: zoom level
+    @param x: column of the tile
+    @param y: row of the tile, counted from the north
+    @param buffer: buffer around the tile as fraction of the tile size
+    @return: west, south, east, north
+    """
+    n = 2 ** z
+
+    def lon(tx: float) -> float:
+        return max(-180.0, min(180.0, tx / n * 360 - 180))
+
+    def lat(ty: float) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return [lon(x - buffer), lat(y + 1 + buffer), lon(x + 1 + buffer), lat(y - buffer)]
+
+
 def buffer_bbox(bbox: List[float | int], p: float = 0, d: float = 0) -> List[float | int]:
     """
     buffer bbox length and width by percentage and/or distance in terms of coordinate units.
@@ -104,18 +144,86 @@ def bbox_from_radius(lon: float, lat: float, radius: float) -> List[float | int]
     @param radius: of the circle in meters for which the bbox should be calculated
     @return: calculated bbox
     """
-    lon1, _ = point_from_point_bearing_distance(lon, lat, 270, radius)
-    _, lat1 = point_from_point_bearing_distance(lon, lat, 180, radius)
-    lon2, _ = point_from_point_bearing_distance(lon, lat, 90, radius)
-    _, lat2 = point_from_point_bearing_distance(lon, lat, 0, radius)
+    min_lon, min_lat, max_lon, max_lat = bboxes_from_radius([lon], [lat], radius)[0].tolist()
     return [
-        restrict_longitude(min(lon1, lon2)),
-        restrict_latitude(min(lat1, lat2)),
-        restrict_longitude(max(lon1, lon2)),
-        restrict_latitude(max(lat1, lat2))
+        restrict_longitude(min_lon),
+        restrict_latitude(min_lat),
+        restrict_longitude(max_lon),
+        restrict_latitude(max_lat)
     ]
 
 
+def destinations(lon: np.ndarray, lat: np.ndarray, bearing: np.ndarray, distance: np.ndarray) -> np.ndarray:
+    """
+    vectorized direct geodesic problem on the WGS84 ellipsoid (Vincenty), the arguments are broadcast.
+    Agrees with the geodesics of geopy to far below the 7 digit precision used for coordinates.
+    @param lon: start longitudes
+    @param lat: start latitudes
+    @param bearing: in degree
+    @param distance: in meters
+    @return: array of (lon, lat) destination points, longitudes within -180 to 180
+    """
+    a, f = WGS84_A, WGS84_F
+    b = a * (1 - f)
+    lon, lat, alpha1 = (np.radians(np.asarray(x, dtype=float)) for x in (lon, lat, bearing))
+    lon, lat, alpha1, distance = np.broadcast_arrays(lon, lat, alpha1, np.asarray(distance, dtype=float))
+    sin_alpha1, cos_alpha1 = np.sin(alpha1), np.cos(alpha1)
+    tan_u1 = (1 - f) * np.tan(lat)
+    cos_u1 = 1 / np.sqrt(1 + tan_u1 ** 2)
+    sin_u1 = tan_u1 * cos_u1
+    sigma1 = np.arctan2(tan_u1, cos_alpha1)
+    sin_alpha = cos_u1 * sin_alpha1
+    cos_sq_alpha = 1 - sin_alpha ** 2
+    u_sq = cos_sq_alpha * (a ** 2 - b ** 2) / b ** 2
+    big_a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    big_b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    sigma = distance / (b * big_a)
+    for _ in range(100):
+        cos_2sigma_m = np.cos(2 * sigma1 + sigma)
+        sin_sigma, cos_sigma = np.sin(sigma), np.cos(sigma)
+        delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) -
+            big_b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+        previous, sigma = sigma, distance / (b * big_a) + delta_sigma
+        if np.all(np.abs(sigma - previous) < 1e-12):
+            break
+    cos_2sigma_m = np.cos(2 * sigma1 + sigma)
+    sin_sigma, cos_sigma = np.sin(sigma), np.cos(sigma)
+    x = sin_u1 * sin_sigma - cos_u1 * cos_sigma * cos_alpha1
+    lat2 = np.arctan2(sin_u1 * cos_sigma + cos_u1 * sin_sigma * cos_alpha1,
+                      (1 - f) * np.sqrt(sin_alpha ** 2 + x ** 2))
+    lambda_ = np.arctan2(sin_sigma * sin_alpha1, cos_u1 * cos_sigma - sin_u1 * sin_sigma * cos_alpha1)
+    c = f / 16 * cos_sq_alpha * (4 + f * (4 - 3 * cos_sq_alpha))
+    big_l = lambda_ - (1 - c) * f * sin_alpha * (
+        sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+    lon2 = np.degrees(lon + big_l)
+    lon2 = np.where(np.abs(lon2) > 180, (lon2 + 180) % 360 - 180, lon2)
+    return np.stack([lon2, np.degrees(lat2)], axis=-1)
+
+
+def bboxes_from_radius(lons: np.ndarray | List[float], lats: np.ndarray | List[float],
+                       radius: np.ndarray | List[float] | float) -> np.ndarray:
+    """
+    calculate the bboxes for circles around points with radius in one vectorized pass,
+    batch equivalent of bbox_from_radius
+    @param lons: center longitudes
+    @param lats: center latitudes
+    @param radius: of the circles in meters, single value or one per point
+    @return: array of bboxes
+    """
+    lons, lats, radius = np.broadcast_arrays(np.asarray(lons, dtype=float), np.asarray(lats, dtype=float),
+                                             np.asarray(radius, dtype=float))
+    # destinations to the west, south, east and north of every point
+    points = destinations(lons[:, None], lats[:, None], np.array([270, 180, 90, 0]), radius[:, None])
+    lon1, lat1, lon2, lat2 = points[:, 0, 0], points[:, 1, 1], points[:, 2, 0], points[:, 3, 1]
+    return np.stack([
+        np.minimum(lon1, lon2),
+        np.clip(np.minimum(lat1, lat2), -90, 90),
+        np.maximum(lon1, lon2),
+        np.clip(np.maximum(lat1, lat2), -90, 90)
+    ], axis=-1).round(7).reshape(-1, 4)
+
+
 def meters_travelled(seconds: float, speed: float) -> int:
     """
     return meters travelled in x seconds for a specific speed in kmh
@@ -126,6 +234,205 @@ def meters_travelled(seconds: float, speed: float) -> int:
     return round(seconds * speed / 3600 * 1000)
 
 
+def meters_per_degree(lat: float) -> (float, float):
+    """
+    return the length of a degree of longitude and latitude in meters at a latitude (WGS84)
+    @param lat: latitude
+    @return: (lon, lat) meters per degree
+    """
+    phi = math.radians(lat)
+    lon_m = 111412.84 * math.cos(phi) - 93.5 * math.cos(3 * phi)
+    lat_m = 111132.92 - 559.82 * math.cos(2 * phi) + 1.175 * math.cos(4 * phi)
+    return max(lon_m, 0), lat_m
+
+
+def lookup_bbox(lookup: LookupGeometry) -> List[float]:
+    """
+    calculate a bbox containing every point within the lookup distance of the lookup geometry.
+    The bbox is slightly larger than necessary, so it can be used to prefilter candidates.
+    @param lookup: lookup geometry
+    @return: bbox
+    """
+    return distance_bbox(lookup_vertices(lookup), lookup.distance)
+
+
+def distance_bbox(coordinates: np.ndarray, distance: float) -> List[float]:
+    """
+    calculate a bbox containing every point within a distance of the coordinates, see lookup_bbox
+    @param coordinates: (lon, lat) coordinates
+    @param distance: distance in meters
+    @return: bbox
+    """
+    lons, lats = coordinates[:, 0], coordinates[:, 1]
+    lat_d = distance / 110574 * 1.01
+    max_lat = min(max(abs(min(lats) - lat_d), abs(max(lats) + lat_d)), 90)
+    lon_m, _ = meters_per_degree(max_lat)
+    lon_d = distance / lon_m * 1.01 if lon_m > 0 else 360
+    return [
+        max(min(lons) - lon_d, -180),
+        max(min(lats) - lat_d, -90),
+        min(max(lons) + lon_d, 180),
+        min(max(lats) + lat_d, 90)
+    ]
+
+
+def lookup_vertices(lookup: LookupGeometry, max_length: float = LOOKUP_SEGMENT_LENGTH) -> np.ndarray:
+    """
+    return the coordinates of the lookup geometry with vertices added along the great circle arcs between them,
+    so no segment is longer than max_length. Segments of geographies are great circle arcs in PostGIS, which
+    depart from straight lines in WGS84 by kilometers over a few hundred kilometers.
+    @param lookup: lookup geometry
+    @param max_length: maximum segment length in meters
+    @return: array of (lon, lat) coordinates
+    """
+    coordinates = np.array(lookup.coordinates, dtype=float)[:, :2]
+    if len(coordinates) == 1:
+        return coordinates
+    lon, lat = np.radians(coordinates).T
+    xyz = np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+    starts, ends = xyz[:-1], xyz[1:]
+    angles = np.arccos(np.clip(np.einsum("ij,ij->i", starts, ends), -1, 1))
+    counts = np.maximum(np.ceil(angles * EARTH_RADIUS / max_length), 1).astype(int)
+    vertices = [xyz[:1]]
+    for start, end, angle, count in zip(starts, ends, angles, counts):
+        if angle == 0:
+            vertices.append(end[np.newaxis])
+            continue
+        t = np.arange(1, count + 1)[:, np.newaxis] / count
+        vertices.append((np.sin((1 - t) * angle) * start + np.sin(t * angle) * end) / np.sin(angle))
+    x, y, z = np.concatenate(vertices).T
+    return np.column_stack([np.degrees(np.arctan2(y, x)), np.degrees(np.arcsin(np.clip(z, -1, 1)))])
+
+
+def within_lookup_distance(geoms: np.ndarray, lookup: LookupGeometry) -> np.ndarray:
+    """
+    check which geometries are within the lookup distance of the lookup geometry.
+    The lookup geometry is split into pieces of at most LOOKUP_SEGMENT_LENGTH along its great circle arcs, and
+    the distance to each piece is calculated in an equirectangular projection centered on the piece. The error
+    depends on the lookup distance and the piece length only, and is below a few meters for lookup distances
+    of up to some kilometers. Edges of the geometries are straight lines in WGS84, as in the spatial index.
+    @param geoms: array of WGS84 geometries
+    @param lookup: lookup geometry
+    @return: boolean array
+    """
+    within = np.zeros(len(geoms), dtype=bool)
+    if not len(geoms):
+        return within
+    vertices = lookup_vertices(lookup)
+    pieces = vertices[np.newaxis] if len(vertices) == 1 else np.stack([vertices[:-1], vertices[1:]], axis=1)
+    tree = shapely.STRtree(geoms)
+    for piece in pieces:
+        candidates = tree.query(shapely.box(*distance_bbox(piece, lookup.distance)))
+        candidates = candidates[~within[candidates]]
+        if not len(candidates):
+            continue
+        origin = piece.mean(axis=0)
+        scale = np.array(meters_per_degree(origin[1]))
+
+        def project(c: np.ndarray) -> np.ndarray:
+            return (c - origin) * scale
+
+        line = shapely.points(piece[0]) if len(piece) == 1 else shapely.linestrings(piece)
+        distances = shapely.distance(shapely.transform(geoms[candidates], project), shapely.transform(line, project))
+        within[candidates] = distances <= lookup.distance
+    return within
+
+
+def select_within_lookup(geoms: List[shapely.Geometry], bbox: List[float] = None,
+                         near: List[LookupGeometry] = None) -> List[shapely.Geometry]:
+    """
+    select the geometries a lookup with the bbox and lookup geometries returns, used to split the result of a
+    combined lookup among the lookups it covers
+    @param geoms: WGS84 geometries
+    @param bbox: lookup bbox
+    @param near: lookup geometries
+    @return: selected geometries in their original order
+    """
+    if not geoms:
+        return []
+    geoms = np.array(geoms, dtype=object)
+    mask = np.ones(len(geoms), dtype=bool)
+    if bbox:
+        mask &= shapely.intersects(geoms, shapely.box(*bbox))
+    if near:
+        within = np.zeros(len(geoms), dtype=bool)
+        for lookup in near:
+            within |= within_lookup_distance(geoms, lookup)
+        mask &= within
+    return list(geoms[mask])
+
+
+def lookup_window(bbox: List[float] = None, near: List[LookupGeometry] = None) -> shapely.Geometry | None:
+    """
+    return the area in which disaster areas were looked up
+    @param bbox: lookup bbox
+    @param near: lookup geometries
+    @return: window geometry, None if the lookup was not restricted
+    """
+    if near:
+        return shapely.union_all([shapely.box(*lookup_bbox(g)) for g in near])
+    if bbox:
+        return shapely.box(*bbox)
+    return None
+
+
+def simplify_to_budget(geom: shapely.Geometry, vertex_budget: int, tolerance: float = 1e-5,
+                       max_distance: float = 100) -> shapely.Geometry:
+    """
+    simplify a geometry with preserved topology until its number of vertices is within the budget.
+    The tolerance is doubled until the budget is met or the vertices would move by more than max_distance.
+    If the budget can not be met, the geometry simplified by max_distance is returned and a warning is logged.
+    @param geom: geometry to simplify
+    @param vertex_budget: maximum number of vertices
+    @param tolerance: initial simplification tolerance in degrees
+    @param max_distance: maximum distance in meters the vertices may move
+    @return: simplified geometry
+    """
+    if shapely.get_num_coordinates(geom) <= vertex_budget:
+        return geom
+    # the longest degree within the latitudes of the geometry, so no vertex moves by more than max_distance
+    meters = max(max(meters_per_degree(lat)) for lat in (geom.bounds[1], geom.bounds[3]))
+    max_tolerance = max_distance / meters
+    tolerance = min(tolerance, max_tolerance)
+    while True:
+        simplified = shapely.simplify(geom, tolerance, preserve_topology=True)
+        if shapely.get_num_coordinates(simplified) <= vertex_budget:
+            return simplified
+        if tolerance >= max_tolerance:
+            break
+        tolerance = min(tolerance * 2, max_tolerance)
+    logger.warning(f"Geometry simplified by {max_distance} m still has {shapely.get_num_coordinates(simplified)} "
+                   f"vertices, the budget is {vertex_budget}")
+    return simplified
+
+
+def avoid_polygon_coordinates(geometries: List[shapely.Geometry], window: shapely.Geometry | None,
+                              vertex_budget: int, precision: int = 6,
+                              max_distance: float = 100) -> List[List[List[List[float]]]]:
+    """
+    prepare disaster area geometries as avoid polygons. Overlapping areas are merged, clipped to the lookup
+    window, reduced to the coordinate precision and simplified to meet the vertex budget.
+    @param geometries: Polygon or MultiPolygon geometries
+    @param window: lookup window to clip to
+    @param vertex_budget: maximum number of vertices
+    @param precision: number of decimal digits of the coordinates
+    @param max_distance: maximum distance in meters the simplification may move vertices
+    @return: MultiPolygon coordinates
+    """
+    if not geometries:
+        return []
+    merged = shapely.union_all(geometries)
+    if window is not None:
+        merged = shapely.intersection(merged, window)
+    merged = shapely.set_precision(merged, 10 ** -precision)
+    merged = simplify_to_budget(merged, vertex_budget, max_distance=max_distance)
+    polygons = [p for p in shapely.get_parts(shapely.get_parts(merged)) if p.geom_type == "Polygon" and not p.is_empty]
+    return [
+        [np.round(shapely.get_coordinates(ring), precision).tolist() for ring in [p.exterior, *p.interiors]]
+        for p in polygons
+    ]
+
+
 def build_diff_query(avoid_item: dict, item: dict, ors_api: OrsApi, ors_res_type: OrsResponseType) -> Function:
     """
     build the sql query to calculate the geometric difference between
@@ -139,17 +446,77 @@ def build_diff_query(avoid_item: dict, item: dict, ors_api: OrsApi, ors_res_type
     """
     geom_no_avoid = get_geom_from_item(item, ors_res_type)
     geom = get_geom_from_item(avoid_item, ors_res_type)
+    return diff_output(geom, geom_no_avoid, ors_api, ors_res_type)
+
+
+def build_batch_diff_query(avoid_items: List[dict], items: List[dict], ors_api: OrsApi,
+                           ors_res_type: OrsResponseType, elevation: bool = False) -> Select:
+    """
+    build a single sql query to calculate the geometric differences of all pairs of corresponding
+    isochrone or route items. The pairs are passed as VALUES list, so all differences cost one round trip.
+    Each row holds the difference as GeoJSON or WKB, ordered like the passed items. Route differences in the json
+    format are returned as WKB to be encoded with encoded_difference, since ST_AsEncodedPolyline can not encode
+    differences of several parts.
+    PostGIS can not read encoded polylines with elevation, these are decoded in-process and passed as WKB.
+    @param avoid_items: items of the ors response with avoid areas
+    @param items: corresponding items of the ors response without avoid areas
+    @param ors_api: ors service
+    @param ors_res_type: response format
+    @param elevation: whether encoded polylines include elevation
+    @return: sqlalchemy select
+    """
+    wkb = ors_res_type == 'json' and elevation
+
+    def raw(item: dict) -> str:
+        if wkb:
+            return shapely.to_wkb(shape_from_item(item, ors_res_type, elevation), hex=True)
+        return json.dumps(item.get('geometry')) if ors_res_type == 'geojson' else item.get('geometry')
+
+    pairs = values(
+        column("n", Integer), column("geom", String), column("geom_no_avoid", String), name="pairs"
+    ).data([(n, raw(avoid_item), raw(item)) for n, (avoid_item, item) in enumerate(zip(avoid_items, items))])
+    if wkb:
+        geom = func.ST_GeomFromWKB(func.decode(pairs.c.geom, "hex"))
+        geom_no_avoid = func.ST_GeomFromWKB(func.decode(pairs.c.geom_no_avoid, "hex"))
+    else:
+        geom = geom_from_value(pairs.c.geom, ors_res_type)
+        geom_no_avoid = geom_from_value(pairs.c.geom_no_avoid, ors_res_type)
+    if ors_res_type == 'json':
+        return select(func.ST_AsBinary(diff_geometry(geom, geom_no_avoid, ors_api))).order_by(pairs.c.n)
+    return select(diff_output(geom, geom_no_avoid, ors_api, ors_res_type)).order_by(pairs.c.n)
+
+
+def diff_output(geom, geom_no_avoid, ors_api: OrsApi, ors_res_type: OrsResponseType) -> Function:
+    """
+    build the sql function for the valid difference of two geometries in the response format
+    @param geom: geometry of the item with avoid areas
+    @param geom_no_avoid: geometry of the item without avoid areas
+    @param ors_api: ors service
+    @param ors_res_type: response format
+    @return: GeoJSON or encoded polyline function
+    """
+    m_valid = diff_geometry(geom, geom_no_avoid, ors_api)
+    query = func.ST_AsGeoJson(m_valid, 7, 1)
+    if ors_res_type == 'json':
+        query = func.ST_AsEncodedPolyline(m_valid)
+    return query
+
+
+def diff_geometry(geom, geom_no_avoid, ors_api: OrsApi) -> Function:
+    """
+    build the sql function for the valid difference of two geometries
+    @param geom: geometry of the item with avoid areas
+    @param geom_no_avoid: geometry of the item without avoid areas
+    @param ors_api: ors service
+    @return: geometry function
+    """
     difference = None
     # the difference needs to be calculated with the larger/longer geometry as base geometry (first argument)
     if ors_api == "isochrones":
         difference = func.ST_Difference(geom_no_avoid, geom)
     elif ors_api == "directions":
         difference = func.ST_Difference(geom, geom_no_avoid)
-    m_valid = func.ST_MakeValid(difference)
-    query = func.ST_AsGeoJson(m_valid, 7, 1)
-    if ors_res_type == 'json':
-        query = func.ST_AsEncodedPolyline(m_valid)
-    return query
+    return func.ST_MakeValid(difference)
 
 
 def get_bbox_for_encoded_polyline(db: Session, item: dict) -> float | int:
@@ -174,10 +541,199 @@ def get_geom_from_item(item: dict, ors_res_type: OrsResponseType) -> Function:
     """
     geom = item.get('geometry')
     if ors_res_type == 'geojson':
-        geom = func.ST_GeomFromGeoJSON(json.dumps(geom))
+        geom = json.dumps(geom)
+    return geom_from_value(geom, ors_res_type)
+
+
+def geom_from_value(value, ors_res_type: OrsResponseType) -> Function:
+    """
+    Returns the PostGIS geometry of a raw ORS geometry value or column
+    @param value: GeoJSON string or encoded polyline, or a column holding them
+    @param ors_res_type: response format
+    @return: geoalchemy function for PostGIS geometry
+    """
+    if ors_res_type == 'geojson':
+        return func.ST_GeomFromGeoJSON(value)
     elif ors_res_type == 'json':
-        geom = func.ST_LineFromEncodedPolyline(geom)
-    return geom
+        return func.ST_LineFromEncodedPolyline(value)
+    return value
+
+
+def polyline_factors(elevation: bool, precision: int) -> np.ndarray:
+    """
+    Returns the factors of the encoded values of a polyline point (lat, lon and optionally elevation)
+    @param elevation: whether the points include elevation
+    @param precision: number of decimal digits of the encoded coordinates
+    @return: factor per encoded value
+    """
+    factors = [10 ** precision] * 2
+    if elevation:
+        factors.append(10 ** ELEVATION_PRECISION)
+    return np.array(factors)
+
+
+def decode_polyline(encoded: str, elevation: bool = False, precision: int = 5) -> np.ndarray:
+    """
+    decode an encoded polyline (Google polyline algorithm) in one vectorized pass.
+    ORS appends the elevation in centimeters to each point if elevation is requested.
+    @param encoded: encoded polyline
+    @param elevation: whether the points include elevation
+    @param precision: number of decimal digits of the encoded coordinates
+    @return: array of [lon, lat] or [lon, lat, elevation] coordinates
+    """
+    factors = polyline_factors(elevation, precision)
+    chunks = np.frombuffer(encoded.encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    if not len(chunks):
+        return np.empty((0, len(factors)))
+    # the last 5-bit chunk of each value has no continuation bit
+    last = chunks < 0x20
+    starts = np.flatnonzero(np.concatenate(([True], last[:-1])))
+    value_index = np.concatenate(([0], np.cumsum(last)[:-1]))
+    shifts = (np.arange(len(chunks)) - starts[value_index]) * 5
+    values = np.add.reduceat((chunks & 0x1f) << shifts, starts)
+    deltas = (values >> 1) ^ -(values & 1)
+    coordinates = np.cumsum(deltas.reshape(-1, len(factors)), axis=0) / factors
+    coordinates[:, [0, 1]] = coordinates[:, [1, 0]]
+    return coordinates
+
+
+def encode_polyline(coordinates: np.ndarray | List[List[float]], elevation: bool = False, precision: int = 5) -> str:
+    """
+    encode coordinates as encoded polyline (Google polyline algorithm) in one vectorized pass
+    @param coordinates: [lon, lat] or [lon, lat, elevation] coordinates
+    @param elevation: whether to encode the elevation
+    @param precision: number of decimal digits of the encoded coordinates
+    @return: encoded polyline
+    """
+    factors = polyline_factors(elevation, precision)
+    coordinates = np.asarray(coordinates, dtype=float)
+    if not coordinates.size:
+        return ""
+    ordered = coordinates[:, [1, 0, 2][:len(factors)]]
+    deltas = np.diff(np.round(ordered * factors).astype(np.int64), axis=0, prepend=0).ravel()
+    values = (deltas << 1) ^ (deltas >> 63)
+    # split into 5-bit chunks, all but the last chunk of a value have the continuation bit set
+    offsets = np.arange(7)
+    n_chunks = 1 + ((values[:, None] >> (5 * offsets[1:])) > 0).sum(axis=1)
+    chunks = (values[:, None] >> (5 * offsets)) & 0x1f
+    chunks |= (offsets < n_chunks[:, None] - 1) * 0x20
+    return (chunks[offsets < n_chunks[:, None]] + 63).astype(np.uint8).tobytes().decode("ascii")
+
+
+def polyline_bbox(encoded: str, elevation: bool = False, precision: int = 5) -> List[float]:
+    """
+    Returns the bbox of an encoded polyline without a database round trip
+    @param encoded: encoded polyline
+    @param elevation: whether the points include elevation
+    @param precision: number of decimal digits of the encoded coordinates
+    @return: [min lon, min lat, (min elevation), max lon, max lat, (max elevation)]
+    """
+    coordinates = decode_polyline(encoded, elevation, precision)
+    return [*coordinates.min(axis=0).tolist(), *coordinates.max(axis=0).tolist()]
+
+
+def shape_from_item(item: dict, ors_res_type: OrsResponseType, elevation: bool = False) -> shapely.Geometry:
+    """
+    In-process equivalent of get_geom_from_item
+    @param item: single route or isochrone item
+    @param ors_res_type: response format
+    @param elevation: whether encoded polylines include elevation
+    @return: shapely geometry of the ors response
+    """
+    geom = item.get('geometry')
+    if ors_res_type == 'json':
+        return shapely.linestrings(decode_polyline(geom, elevation))
+    # shapely.from_geojson only reads 2D coordinates before GEOS 3.12
+    return shape(geom)
+
+
+def validity_reason(geometry: dict) -> str:
+    """
+    Checks a GeoJSON geometry with GEOS, like ST_IsValidReason in PostGIS
+    @param geometry: GeoJSON geometry
+    @return: "Valid Geometry" or the reason and location of the invalidity, e.g. "Self-intersection[0.5 0.5]"
+    """
+    return validity_reasons([geometry])[0]
+
+
+def validity_reasons(geometries: List[dict]) -> List[str]:
+    """
+    Checks GeoJSON geometries with GEOS in a single vectorized call, see validity_reason.
+    Geometries GEOS can not read are reported instead of failing the whole call.
+    @param geometries: GeoJSON geometries
+    @return: reason for each geometry
+    """
+    if not geometries:
+        return []
+    shapes = shapely.from_geojson([json.dumps(g) for g in geometries], on_invalid="ignore")
+    return [reason or UNREADABLE_GEOMETRY for reason in shapely.is_valid_reason(shapes).tolist()]
+
+
+def geojson_with_bbox(geom: shapely.Geometry, precision: int = 7) -> dict:
+    """
+    GeoJSON geometry with rounded coordinates and bbox, as returned by ST_AsGeoJson(geom, precision, 1).
+    The coordinates are taken from the geometry mapping, as shapely.to_geojson drops Z before GEOS 3.12.
+    @param geom: shapely geometry
+    @param precision: number of decimal digits
+    @return: GeoJSON geometry
+    """
+    def rounded(value):
+        if isinstance(value, float):
+            return round(value, precision)
+        return [rounded(v) for v in value]
+
+    def rounded_geometry(geometry: dict) -> dict:
+        if "geometries" in geometry:
+            return {"type": geometry["type"], "geometries": [rounded_geometry(g) for g in geometry["geometries"]]}
+        return {"type": geometry["type"], "coordinates": rounded(geometry["coordinates"])}
+
+    geojson = rounded_geometry(mapping(geom))
+    coordinates = shapely.get_coordinates(geom, include_z=shapely.has_z(geom))
+    geojson["bbox"] = rounded([*coordinates.min(axis=0).tolist(), *coordinates.max(axis=0).tolist()])
+    return geojson
+
+
+def item_differences(avoid_items: List[dict], items: List[dict], ors_api: OrsApi,
+                     ors_res_type: OrsResponseType, elevation: bool = False) -> List[dict | str | List[str] | None]:
+    """
+    In-process equivalent of build_diff_query for all item pairs in one vectorized pass.
+    Route differences of several parts are returned as MultiLineString in the geojson format and as list of
+    encoded polylines in the json format, see encoded_difference.
+    @param avoid_items: items of the ors response with avoid areas
+    @param items: corresponding items of the ors response without avoid areas
+    @param ors_api: ors service
+    @param ors_res_type: response format
+    @param elevation: whether encoded polylines include elevation
+    @return: difference per pair as GeoJSON geometry or encoded polyline(s), None if there is no difference
+    """
+    geoms = np.array([shape_from_item(i, ors_res_type, elevation) for i in avoid_items], dtype=object)
+    geoms_no_avoid = np.array([shape_from_item(i, ors_res_type, elevation) for i in items], dtype=object)
+    # the difference needs to be calculated with the larger/longer geometry as base geometry (first argument)
+    if ors_api == "isochrones":
+        differences = shapely.difference(geoms_no_avoid, geoms)
+    else:
+        differences = shapely.difference(geoms, geoms_no_avoid)
+    differences = shapely.make_valid(differences)
+    if ors_res_type == 'json':
+        return [encoded_difference(d, elevation) for d in differences]
+    return [None if shapely.is_empty(d) else geojson_with_bbox(d) for d in differences]
+
+
+def encoded_difference(geom: shapely.Geometry, elevation: bool = False) -> str | List[str] | None:
+    """
+    encode the difference of two routes as encoded polyline. An encoded polyline holds a single line, so the
+    parts are merged where they touch and every remaining part is encoded on its own. Concatenating the parts
+    would add straight segments across the gaps that are not part of any route.
+    @param geom: route difference
+    @param elevation: whether to encode the elevation
+    @return: encoded polyline, list of encoded polylines if the difference has several parts,
+    None if there is no difference
+    """
+    lines = [p for p in shapely.get_parts(shapely.line_merge(geom)) if p.geom_type == "LineString" and not p.is_empty]
+    if not lines:
+        return None
+    encoded = [encode_polyline(shapely.get_coordinates(line, include_z=elevation), elevation) for line in lines]
+    return encoded[0] if len(encoded) == 1 else encoded
 
 
 def get_overall_bbox(bboxes: List[List[float]]) -> List[float]:
@@ -0,0 +1,92 @@
+"""
+Background execution of routing jobs
+
+Jobs are executed by the process that accepted them, at most a fixed number at a time. Their state and
+results are stored in the database, so every process can report them.
+"""
+import asyncio
+from typing import Awaitable, Callable, Set, Tuple
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app import crud
+from app.logger import logger
+from app.schemas import JobStatus
+
+# executes a job with a db session, returns the status code, body and media type of the result
+JobWork = Callable[[Session], Awaitable[Tuple[int, bytes, str]]]
+
+
+class JobRunner:
+    def __init__(self, workers: int = 4):
+        """
+        @param workers: maximum number of jobs executed at the same time
+        """
+        self.workers = workers
+        self._semaphore = asyncio.Semaphore(workers)
+        self._tasks: Set[asyncio.Task] = set()
+
+    def submit(self, job_id: str, work: JobWork, session_factory: Callable[[], Session]) -> None:
+        """
+        Queues a stored job for execution
+        @param job_id: id of the job
+        @param work: executes the job
+        @param session_factory: creates the db session of the job
+        """
+        task = asyncio.ensure_future(self.run(job_id, work, session_factory))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def run(self, job_id: str, work: JobWork, session_factory: Callable[[], Session]) -> None:
+        db = None
+        try:
+            async with self._semaphore:
+                db = session_factory()
+                job = await run_in_threadpool(crud.routing_job.get, db, job_id)
+                if job is None:
+                    return
+                await run_in_threadpool(crud.routing_job.start, db, db_obj=job)
+                try:
+                    status_code, result, media_type = await work(db)
+                except Exception as e:
+                    logger.error(f"Routing job {job_id} failed: {e!r}")
+                    await run_in_threadpool(crud.routing_job.fail, db, db_obj=job, error=str(e) or repr(e))
+                    return
+                await run_in_threadpool(crud.routing_job.finish, db, db_obj=job, status_code=status_code,
+                                        result=result, media_type=media_type)
+        except asyncio.CancelledError:
+            # jobs are interrupted while queued or running, clients would otherwise poll them until they expire
+            if db is None:
+                db = session_factory()
+            await run_in_threadpool(interrupt, db, job_id)
+            raise
+        finally:
+            if db is not None:
+                db.close()
+
+    async def close(self) -> None:
+        """
+        Interrupts the jobs of this process
+        """
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "jobs": len(self._tasks)
+        }
+
+
+def interrupt(db: Session, job_id: str) -> None:
+    """
+    Fails a job that was not finished yet
+    @param db: db session
+    @param job_id: id of the job
+    """
+    job = crud.routing_job.get(db, job_id)
+    if job is not None and job.status in (JobStatus.pending.value, JobStatus.running.value):
+        crud.routing_job.fail(db, db_obj=job, error="Job was interrupted")
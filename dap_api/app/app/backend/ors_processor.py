@@ -1,31 +1,111 @@
-import json
+import asyncio
+import time
+from collections import defaultdict
+from typing import AsyncIterator, Callable, Dict, List
 
-from fastapi.responses import JSONResponse
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+import shapely
+from shapely.geometry import mapping, shape
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from app import crud
-from app.backend.base import BaseProcessor
-from app.backend.geoutil import buffer_bbox, meters_travelled, bbox_from_radius, build_diff_query, \
-    get_overall_bbox, get_bbox_for_encoded_polyline
+from app.backend.base import BaseProcessor, server_timing_header
+from app.backend.cache import ResponseCache, cache_key
+from app.backend.serialization import dumps, loads
+from app.backend.streaming import JSONSplicer
+from app.backend.spatial_index import DisasterAreaIndex
+from app.backend.geoutil import buffer_bbox, meters_travelled, bboxes_from_radius, build_batch_diff_query, \
+    get_overall_bbox, point_distance, avoid_polygon_coordinates, lookup_window, \
+    item_differences, polyline_bbox, select_within_lookup, encoded_difference
 from app.schemas import PathOptions, ORSResponse
-from app.schemas.ors_request import ORSIsochrones, ORSDirections
+from app.schemas.disaster_area import DisasterAreaCollection, LookupGeometry
+from app.config import settings
+from app.logger import logger
+from app.db.change_tracker import change_tracker
+from app.schemas.ors_request import AreasResponseMode, ORSIsochrones, ORSDirections
+
+# corridor width of directions lookups as share of the segment length, and its minimum in meters
+CORRIDOR_WIDTH = 0.15
+CORRIDOR_MIN_DISTANCE = 1000
+# areas per lookup, the default limit of the area lookups
+AREA_LOOKUP_LIMIT = 100
 
 
 class ORSProcessor(BaseProcessor):
-    def handle_ors_request(self, db: Session, request: ORSDirections | ORSIsochrones, options: PathOptions,
-                           header_authorization: str = "") -> ORSResponse | JSONResponse:
+    def __init__(self, base_path: str, cache: ResponseCache = None, area_index: DisasterAreaIndex = None):
+        super().__init__(base_path)
+        self.cache = cache
+        self.area_index = area_index
+
+    async def handle_ors_request(self, db: Session, request: ORSDirections | ORSIsochrones, options: PathOptions,
+                                 header_authorization: str = "", candidate_geometries: List[shapely.Geometry] = None
+                                 ) -> ORSResponse | JSONResponse | StreamingResponse:
+        """
+        Relays a request to ORS, adding disaster areas as avoid polygons in avoid_areas mode
+        @param candidate_geometries: disaster area geometries looked up in advance, used instead of a lookup
+        unless the areas are returned. Responses built from them are not cached.
+        """
+        endpoint = f"/{options.ors_api}/{options.ors_profile}/{options.ors_response_type}"
+        # responses are cached by request content and only valid as long as the data used to build them is unchanged
+        key = stamp = None
+        if self.cache is not None and not request.portal_options.debug:
+            key = cache_key(request.dict(by_alias=True), options.portal_mode, endpoint,
+                            request.portal_options.ors_server, header_authorization)
+            stamp = change_tracker.stamp(*used_tables(request, options))
+            cached_response = self.cache.get(key)
+            if cached_response is not None:
+                return cached_response.copy(update={"headers": {**cached_response.headers, "X-Cache": "HIT"}})
+            if candidate_geometries is not None:
+                # the areas of a batch lookup are not guaranteed to match the lookup of the request alone
+                key = None
+
         # process request
         disaster_areas = {}
-        lookup_bbox = self.get_bounding_box(request, options.ors_api, options.ors_profile)
+        # avoid polygons of the request itself, kept in the response metadata when the disaster areas are stripped
+        avoid_stripping = None
+        lookup_geometries = self.get_lookup_geometries(request, options.ors_api, options.ors_profile)
+        lookup_bbox = None if lookup_geometries else self.get_bounding_box(request, options.ors_api,
+                                                                           options.ors_profile)
         if options.portal_mode.value == "avoid_areas":
-            disaster_areas = crud.disaster_area.get_multi_as_feature_collection(
+            # the in-process index answers the lookup without querying the database
+            area_source = self.area_index if self.area_index is not None else crud.disaster_area
+            lookup = dict(
                 db=db,
                 bbox=lookup_bbox,
+                near=lookup_geometries,
                 date_time=request.portal_options.disaster_area_filter.date_time,
                 d_type_id=request.portal_options.disaster_area_filter.d_type_id
             )
-            coordinates_to_add = [f.geometry.coordinates for f in disaster_areas.features if
-                                  f.geometry.type in ["Polygon"]]
+            if request.portal_options.return_areas_in_response and \
+                    request.portal_options.areas_response_mode == AreasResponseMode.compact:
+                # clients holding the areas only get references to them
+                disaster_areas, geometries = await run_in_threadpool(
+                    area_source.get_multi_references_with_geometries, **lookup)
+            elif request.portal_options.return_areas_in_response:
+                disaster_areas = await run_in_threadpool(area_source.get_multi_as_feature_collection, **lookup)
+                geometries = [shape(f.geometry.dict()) for f in disaster_areas.features]
+                if request.portal_options.areas_simplify_tolerance:
+                    disaster_areas = await run_in_threadpool(simplified_areas, disaster_areas, geometries,
+                                                             request.portal_options.areas_simplify_tolerance)
+            elif candidate_geometries is not None:
+                geometries = candidate_geometries
+            else:
+                # features are only assembled if they are returned
+                geometries = await run_in_threadpool(area_source.get_multi_geometries, **lookup)
+            vertex_budget = settings.ORS_AVOID_VERTEX_BUDGET
+            if request.portal_options.avoid_vertex_budget:
+                vertex_budget = min(vertex_budget, request.portal_options.avoid_vertex_budget)
+            # merged, clipped to the lookup window and simplified to keep the ORS request small
+            coordinates_to_add = await run_in_threadpool(
+                avoid_polygon_coordinates,
+                geometries,
+                lookup_window(lookup_bbox, lookup_geometries),
+                vertex_budget,
+                settings.ORS_AVOID_PRECISION,
+                settings.ORS_AVOID_MAX_SIMPLIFY_DISTANCE
+            )
             if coordinates_to_add:
                 # ORS expects Polygon coordinates to be a list of lists of coordinates, whilst for MultiPolygon
                 # coordinates is expected to be a list of lists, of lists of coordinates. If we get a Polygon in the
@@ -33,10 +113,13 @@ class ORSProcessor(BaseProcessor):
                 if request.options.avoid_polygons.type == "Polygon":
                     request.options.avoid_polygons.type = "MultiPolygon"
                     request.options.avoid_polygons.coordinates = [request.options.avoid_polygons.coordinates]
+                if request.portal_options.strip_avoid_areas:
+                    avoid_stripping = AvoidStripping(list(request.options.avoid_polygons.coordinates),
+                                                     len(coordinates_to_add))
                 request.options.avoid_polygons.coordinates += coordinates_to_add
 
         if type(request.user_speed_limits) == int:
-            cs = crud.custom_speeds.get(db, request.user_speed_limits)
+            cs = await run_in_threadpool(crud.custom_speeds.get, db, request.user_speed_limits)
             if not cs:
                 return JSONResponse(status_code=400, content={
                     "code": 6404,
@@ -53,24 +136,41 @@ class ORSProcessor(BaseProcessor):
         if request.portal_options.debug:
             return ORSResponse(
                 status_code=200,
-                body=json.dumps(request_dict),
+                body=dumps(request_dict),
                 media_type="application/json;charset=UTF-8"
             )
 
+        if settings.ORS_STREAM_RESPONSES and not request.portal_options.generate_difference:
+            # the response is forwarded as it arrives, the portal members are spliced into the stream
+            if request.portal_options.return_areas_in_response and lookup_bbox is None:
+                lookup_bbox = self.get_bounding_box(request, options.ors_api, options.ors_profile)
+            return await self.stream_ors_response(endpoint, request_header, request_dict, request, options,
+                                                  disaster_areas, lookup_bbox, key, stamp, avoid_stripping)
+
         # relay to backend
-        endpoint = f"/{options.ors_api}/{options.ors_profile}/{options.ors_response_type}"
-        response = self.relay_request_post(endpoint, request_header, request_dict, base_path=request.portal_options.ors_server)
+        relay_calls = {"relay": (endpoint, request_header, request_dict)}
+        generate_difference = request.portal_options.generate_difference and \
+            "avoid_polygons" in request_dict.get("options", {})
+        if generate_difference:
+            # the request without avoid areas is independent and relayed concurrently
+            request_dict_no_avoid = dict(request_dict, options=request_dict["options"].copy())
+            request_dict_no_avoid["options"].pop("avoid_polygons")
+            relay_calls["relay_no_avoid"] = (endpoint, request_header, request_dict_no_avoid)
+        timings = {}
+        responses = await self.relay_requests_post(relay_calls, base_path=request.portal_options.ors_server,
+                                                   timings=timings)
+        failed = [r for r in responses.values() if r.status_code != 200]
+        response = failed[0] if failed else responses["relay"]
         response_json = {}
         if response.status_code == 200 and request.portal_options.generate_difference:
-            response_json = response.json()
+            response_json = loads(response.content)
             new_features = []
-            if "options" in request_dict and "avoid_polygons" in request_dict["options"]:
-                request_dict.get("options").pop("avoid_polygons")
-                response_no_avoid = self.relay_request_post(endpoint, request_header, request_dict, base_path=request.portal_options.ors_server)
-
-                new_features = self.calculate_new_features(db, options, request_dict,
-                                                           response_json[result_key(options)],
-                                                           response_no_avoid.json()[result_key(options)])
+            if generate_difference:
+                start = time.perf_counter()
+                new_features = await run_in_threadpool(self.calculate_new_features, db, options, request_dict,
+                                                       response_json[result_key(options)],
+                                                       loads(responses["relay_no_avoid"].content)[result_key(options)])
+                timings["difference"] = round((time.perf_counter() - start) * 1000, 1)
             response_json[result_key(options)] = new_features
             bboxes = [f.get("bbox") if options.ors_response_type == "json" else f.get("geometry").get("bbox") for f in
                       new_features]
@@ -78,29 +178,179 @@ class ORSProcessor(BaseProcessor):
 
         # process result
         if options.ors_response_type.value == "gpx":
-            response_body = response.text
+            response_body = response.content
         else:
             if not response_json:
-                response_json = response.json()
+                response_json = loads(response.content)
             if response.status_code == 200:
                 if request.portal_options.return_areas_in_response:
-                    response_json["disaster_areas"] = json.loads(disaster_areas.json())
+                    # the feature collection is serialized once with the whole response
+                    response_json["disaster_areas"] = disaster_areas
+                    if lookup_bbox is None:
+                        lookup_bbox = self.get_bounding_box(request, options.ors_api, options.ors_profile)
                     response_json["disaster_areas_lookup_bbox"] = lookup_bbox
 
                 # add portal options to query
                 response_json['metadata']['query']['portal_options'] = request.portal_options.dict(by_alias=True)
-            response_body = json.dumps(response_json)
+                if avoid_stripping is not None:
+                    avoid_stripping.apply(response_json['metadata']['query'])
+            response_body = dumps(response_json)
 
-        return ORSResponse(
+        result = ORSResponse(
             status_code=response.status_code,
             body=response_body,
-            media_type=response.headers.get("Content-Type")
+            media_type=response.headers.get("Content-Type"),
+            headers=server_timing_header(timings)
         )
+        if key is not None and result.status_code == 200:
+            self.cache.set(key, result, size=len(result.body), stamp=stamp)
+            result = result.copy(update={"headers": {**result.headers, "X-Cache": "MISS"}})
+        return result
+
+    async def handle_ors_batch(self, db: Session, requests: List[ORSDirections | ORSIsochrones],
+                               options: PathOptions, header_authorization: str = "",
+                               session_factory: Callable[[], Session] = None) -> AsyncIterator[bytes]:
+        """
+        Relays a batch of requests with bounded concurrency. Disaster areas are looked up once for all requests
+        sharing a disaster area filter.
+        @param session_factory: creates a db session per request, so requests handled concurrently do not share
+        the session of the batch
+        @return: one NDJSON line per request in completion order with its index in the batch, status code and body
+        """
+        candidates = {}
+        if options.portal_mode.value == "avoid_areas":
+            candidates = await self.lookup_batch_geometries(db, requests, options)
+        semaphore = asyncio.Semaphore(settings.ORS_BATCH_CONCURRENCY)
+
+        async def handle(index: int, request: ORSDirections | ORSIsochrones) -> bytes:
+            if not matches_api(request, options):
+                return batch_line(index, 400, dumps({"detail": f"Your request body doesn't match the ors_api "
+                                                               f"({options.ors_api.value})"}))
+            async with semaphore:
+                item_db = session_factory() if session_factory is not None else db
+                try:
+                    result = await self.handle_ors_request(item_db, request, options, header_authorization,
+                                                           candidates.get(index))
+                    return batch_line(index, result.status_code, await response_body(result), result.media_type)
+                except HTTPException as e:
+                    return batch_line(index, e.status_code, dumps({"detail": e.detail}))
+                except Exception as e:
+                    logger.error(f"Batch request {index} failed: {e!r}")
+                    return batch_line(index, 500, dumps({"detail": "Internal Server Error"}))
+                finally:
+                    if session_factory is not None:
+                        item_db.close()
+
+        tasks = [asyncio.ensure_future(handle(i, r)) for i, r in enumerate(requests)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # the client stopped reading
+            for task in tasks:
+                task.cancel()
+
+    async def lookup_batch_geometries(self, db: Session, requests: List[ORSDirections | ORSIsochrones],
+                                      options: PathOptions) -> Dict[int, List[shapely.Geometry]]:
+        """
+        Looks up the disaster areas of a batch with one lookup per disaster area filter and selects the areas
+        of each request from its result. The shared lookup is not limited, so the areas of one request can not
+        crowd out those of another, and each request keeps the first AREA_LOOKUP_LIMIT of its own areas.
+        Requests returning their areas are looked up individually.
+        @return: geometries by index of the request in the batch
+        """
+        area_source = self.area_index if self.area_index is not None else crud.disaster_area
+        groups = defaultdict(list)
+        for i, request in enumerate(requests):
+            if request.portal_options.return_areas_in_response or not matches_api(request, options):
+                continue
+            area_filter = request.portal_options.disaster_area_filter
+            lookup_geometries = self.get_lookup_geometries(request, options.ors_api, options.ors_profile)
+            lookup_bbox = None if lookup_geometries else self.get_bounding_box(request, options.ors_api,
+                                                                               options.ors_profile)
+            key = (area_filter.date_time, area_filter.d_type_id, tuple(lookup_bbox) if lookup_bbox else None)
+            groups[key].append((i, lookup_bbox, lookup_geometries))
+        candidates = {}
+        for (date_time, d_type_id, bbox), items in groups.items():
+            near = [g for _, _, lookup_geometries in items for g in lookup_geometries or []]
+            geometries = await run_in_threadpool(
+                area_source.get_multi_geometries,
+                db=db,
+                bbox=list(bbox) if bbox else None,
+                near=near or None,
+                date_time=date_time,
+                d_type_id=d_type_id,
+                limit=None
+            )
+            for i, lookup_bbox, lookup_geometries in items:
+                selected = await run_in_threadpool(select_within_lookup, geometries, lookup_bbox, lookup_geometries)
+                candidates[i] = selected[:AREA_LOOKUP_LIMIT]
+        return candidates
+
+    async def stream_ors_response(self, endpoint: str, request_header: dict, request_dict: dict,
+                                  request: ORSDirections | ORSIsochrones, options: PathOptions, disaster_areas,
+                                  lookup_bbox: list | None, key: str | None, stamp: dict | None,
+                                  avoid_stripping: "AvoidStripping" = None) -> StreamingResponse:
+        """
+        Relays the request and forwards the response body chunk by chunk. For successful JSON responses the
+        portal options and the disaster areas are spliced into the stream without parsing the body, and the
+        added disaster areas are stripped from the avoid polygons in the query.
+        Responses are cached once completely streamed, unless they exceed the cache entry size limit.
+        """
+        start = time.perf_counter()
+        response = await self.relay_request_stream(endpoint, request_header, request_dict,
+                                                   base_path=request.portal_options.ors_server)
+        headers = server_timing_header({"relay": round((time.perf_counter() - start) * 1000, 1)})
+        media_type = response.headers.get("Content-Type")
+        splicer = None
+        if response.status_code == 200 and options.ors_response_type.value != "gpx":
+            tail_members = b""
+            if request.portal_options.return_areas_in_response:
+                tail_members = b'"disaster_areas":' + dumps(disaster_areas) + \
+                               b',"disaster_areas_lookup_bbox":' + dumps(lookup_bbox)
+            query_members = b'"portal_options":' + dumps(request.portal_options.dict(by_alias=True))
+            replacement = None
+            if avoid_stripping is not None:
+                query_members += b',"stripped_avoid_polygons":' + dumps(avoid_stripping.count)
+                replacement = ("avoid_polygons", avoid_stripping.serialized())
+            splicer = JSONSplicer(query_members, tail_members, replacement)
+
+        async def body():
+            # chunks are only kept as long as the response can be cached
+            chunks = [] if key is not None and response.status_code == 200 else None
+            size = 0
+            try:
+                async for chunk in response.aiter_bytes():
+                    if splicer is not None:
+                        chunk = splicer.feed(chunk)
+                    if chunks is not None:
+                        chunks.append(chunk)
+                        size += len(chunk)
+                        if size > settings.ORS_CACHE_MAX_ENTRY_BYTES:
+                            chunks = None
+                    yield chunk
+                if splicer is not None:
+                    chunk = splicer.close()
+                    if chunks is not None:
+                        chunks.append(chunk)
+                        size += len(chunk)
+                    yield chunk
+                    if not splicer.query_spliced:
+                        logger.warning("Portal members could not be spliced into the ORS response metadata")
+            finally:
+                await response.aclose()
+            if chunks is not None and size <= settings.ORS_CACHE_MAX_ENTRY_BYTES:
+                self.cache.set(key, ORSResponse(status_code=response.status_code, body=b"".join(chunks),
+                                                media_type=media_type, headers=headers), size=size, stamp=stamp)
+
+        if key is not None and response.status_code == 200:
+            headers = {**headers, "X-Cache": "MISS"}
+        return StreamingResponse(body(), status_code=response.status_code, media_type=media_type, headers=headers)
 
     @staticmethod
     def calculate_new_features(db, options, request_dict, avoid_results, no_avoid_results):
         out_type = options.ors_response_type.value
-        new_features = []
+        pairs = []
         for i, item in enumerate(no_avoid_results):
             if options.ors_api == "isochrones":
                 avoid_item = ORSProcessor.get_matching_isochrone(avoid_results, item)
@@ -109,20 +359,49 @@ class ORSProcessor(BaseProcessor):
             # no difference
             if avoid_item == item:
                 continue
-            query = build_diff_query(avoid_item, item, options.ors_api, out_type)
-            diff_geom = db.execute(query).scalar()
+            pairs.append((avoid_item, item))
+        if not pairs:
+            return []
+        # encoded polylines of ORS include the elevation if requested
+        elevation = bool(request_dict.get("elevation"))
+        differences = None
+        if settings.ORS_DIFFERENCE_IN_PROCESS:
+            try:
+                differences = item_differences([p[0] for p in pairs], [p[1] for p in pairs], options.ors_api,
+                                               options.ors_response_type, elevation)
+            except (ValueError, TypeError, KeyError, shapely.errors.ShapelyError) as e:
+                logger.warning(f"In-process difference failed, falling back to PostGIS: {e!r}")
+        if differences is None:
+            differences = ORSProcessor.database_differences(db, options, pairs, elevation)
+        new_features = []
+        for i, (avoid_item, item) in enumerate(pairs):
+            # no difference
+            if differences[i] is None:
+                continue
+            avoid_item["geometry"] = differences[i]
             if out_type == "json":
-                avoid_item["geometry"] = diff_geom
-                avoid_item["bbox"] = get_bbox_for_encoded_polyline(db, item)
-            else:
-                avoid_item["geometry"] = json.loads(diff_geom)
-                # no difference
-                if not avoid_item["geometry"]["coordinates"]:
-                    continue
+                avoid_item["bbox"] = polyline_bbox(item["geometry"], elevation)
             ORSProcessor.update_info(avoid_item, item, options, request_dict)
             new_features.append(avoid_item)
         return new_features
 
+    @staticmethod
+    def database_differences(db, options, pairs, elevation=False):
+        out_type = options.ors_response_type.value
+        # one statement for all pairs
+        query = build_batch_diff_query([p[0] for p in pairs], [p[1] for p in pairs], options.ors_api, out_type,
+                                       elevation)
+        rows = db.execute(query).scalars().all()
+        if out_type == "json":
+            # route differences are returned as WKB and encoded like the in-process differences
+            return [None if diff_geom is None else encoded_difference(shapely.from_wkb(bytes(diff_geom)), elevation)
+                    for diff_geom in rows]
+        differences = []
+        for diff_geom in rows:
+            diff_geom = loads(diff_geom)
+            differences.append(diff_geom if diff_geom.get("coordinates") else None)
+        return differences
+
     @staticmethod
     def get_matching_isochrone(avoid_results, item):
         # the number of isochrones in the avoid-response can be different from the normal one
@@ -155,6 +434,8 @@ class ORSProcessor(BaseProcessor):
         if request.portal_options.disaster_area_filter.bbox:
             return request.portal_options.disaster_area_filter.dict()['bbox']
         bbox = [0, 0, 0, 0]
+        # disaster areas are looked up along a corridor or around the locations (see get_lookup_geometries),
+        # the bbox is only used to report the lookup extent or if no lookup geometries are available
         if target_api == "directions":
             bbox = [
                 float(min(c[0] for c in request.coordinates)),
@@ -166,30 +447,67 @@ class ORSProcessor(BaseProcessor):
                 bbox = buffer_bbox(bbox, p=int(request.portal_options.bounds_looseness))
 
         if target_api == "isochrones":
-            # this is a quick and dirty solution, it would be more efficient to do point-radius lookups in the database
-            # directly. A TODO for the production version.
-            radius = max(request.range)
-            if request.range_type is None or request.range_type == "time":
-                # range is seconds of travel time, convert to distance
-                speed = 80  # default to car
-                if target_profile.startswith("cycling"):
-                    speed = 20
-                if target_profile.startswith("foot"):
-                    speed = 5
-                if target_profile.startswith("wheelchair"):
-                    speed = 4
-                radius = meters_travelled(radius, speed)
-            boxes = []
-            for point in request.locations:
-                boxes.append(bbox_from_radius(point[0], point[1], radius))
-            bbox = get_overall_bbox(boxes)
+            radius = ORSProcessor.get_isochrone_radius(request, target_profile)
+            lons, lats = zip(*[point[:2] for point in request.locations])
+            bbox = get_overall_bbox(bboxes_from_radius(lons, lats, radius).tolist())
         return bbox
 
+    @staticmethod
+    def get_lookup_geometries(request: ORSDirections | ORSIsochrones, target_api,
+                              target_profile) -> List[LookupGeometry] | None:
+        """
+        Returns the geometries around which disaster areas are looked up,
+        or None if they are looked up within the bounding box
+        """
+        if request.portal_options.disaster_area_filter.bbox:
+            return None
+        if target_api == "directions":
+            return ORSProcessor.get_corridor(request)
+        if target_api == "isochrones":
+            radius = ORSProcessor.get_isochrone_radius(request, target_profile)
+            return [LookupGeometry(coordinates=[point], distance=radius) for point in request.locations]
+        return None
+
+    @staticmethod
+    def get_corridor(request: ORSDirections) -> List[LookupGeometry]:
+        """
+        Returns a corridor along the straight segments between the waypoints. The corridor width of each segment
+        scales with its length, as longer segments allow larger detours. bounds_looseness widens the corridor
+        by the given percentage of the segment length.
+        """
+        width = CORRIDOR_WIDTH + int(request.portal_options.bounds_looseness or 0) / 100
+        corridor = []
+        for start, end in zip(request.coordinates, request.coordinates[1:]):
+            start, end = [float(c) for c in start[:2]], [float(c) for c in end[:2]]
+            if start == end:
+                corridor.append(LookupGeometry(coordinates=[start], distance=CORRIDOR_MIN_DISTANCE))
+                continue
+            length = point_distance(*start, *end)
+            corridor.append(LookupGeometry(coordinates=[start, end],
+                                           distance=max(CORRIDOR_MIN_DISTANCE, round(length * width))))
+        return corridor
+
+    @staticmethod
+    def get_isochrone_radius(request: ORSIsochrones, target_profile) -> float:
+        """
+        Returns the maximum distance in meters reachable within the isochrone range
+        """
+        radius = max(request.range)
+        if request.range_type is None or request.range_type == "time":
+            # range is seconds of travel time, convert to distance
+            speed = 80  # default to car
+            if target_profile.startswith("cycling"):
+                speed = 20
+            if target_profile.startswith("foot"):
+                speed = 5
+            if target_profile.startswith("wheelchair"):
+                speed = 4
+            radius = meters_travelled(radius, speed)
+        return radius
+
     @staticmethod
     def prepare_request_dic(request: ORSDirections | ORSIsochrones) -> dict:
-        request_dict = request.dict()
-        request_dict.pop("portal_options")
-        request_dict = clean_dict(request_dict)
+        request_dict = clean_dict(request.dict(exclude={"portal_options"}))
         if "options" in request_dict:
             if len(request.options.avoid_polygons.coordinates) == 0:
                 request_dict.get("options").pop("avoid_polygons")
@@ -215,6 +533,95 @@ class ORSProcessor(BaseProcessor):
         return request_header
 
 
+class AvoidStripping:
+    """
+    Removes the disaster areas added to the avoid polygons from the query ORS returns in the response metadata
+    """
+
+    def __init__(self, coordinates: list, count: int):
+        """
+        @param coordinates: polygon coordinates of the avoid polygons of the request
+        @param count: number of polygons added to them
+        """
+        self.coordinates = coordinates
+        self.count = count
+
+    def avoid_polygons(self) -> dict | None:
+        if not self.coordinates:
+            return None
+        return {"coordinates": self.coordinates, "type": "MultiPolygon"}
+
+    def serialized(self) -> bytes | None:
+        avoid_polygons = self.avoid_polygons()
+        return None if avoid_polygons is None else dumps(avoid_polygons)
+
+    def apply(self, query: dict):
+        """
+        Strips the added polygons from a deserialized query
+        """
+        query["stripped_avoid_polygons"] = self.count
+        ors_options = query.get("options")
+        if not isinstance(ors_options, dict) or "avoid_polygons" not in ors_options:
+            return
+        avoid_polygons = self.avoid_polygons()
+        if avoid_polygons is None:
+            ors_options.pop("avoid_polygons")
+        else:
+            ors_options["avoid_polygons"] = avoid_polygons
+
+
+def matches_api(request: ORSDirections | ORSIsochrones, options: PathOptions) -> bool:
+    """
+    checks whether the request body is of the requested ORS API
+    """
+    if options.ors_api == "isochrones":
+        return isinstance(request, ORSIsochrones)
+    return isinstance(request, ORSDirections)
+
+
+async def response_body(response: ORSResponse | JSONResponse | StreamingResponse) -> bytes:
+    """
+    returns the complete body of a response
+    """
+    if isinstance(response, StreamingResponse):
+        return b"".join([chunk async for chunk in response.body_iterator])
+    return response.body
+
+
+def batch_line(index: int, status_code: int, body: bytes, media_type: str = "application/json") -> bytes:
+    """
+    returns the NDJSON line of a batch response. JSON bodies are embedded as they are, others as string.
+    """
+    if not body:
+        body = b"null"
+    elif "json" not in (media_type or ""):
+        body = dumps(body.decode())
+    return b'{"index":%d,"status_code":%d,"body":%s}\n' % (index, status_code, body)
+
+
+def used_tables(request: ORSDirections | ORSIsochrones, options: PathOptions) -> list:
+    """
+    returns the tables a response depends on
+    """
+    tables = []
+    if options.portal_mode.value == "avoid_areas":
+        tables.append("disaster_areas")
+    if type(request.user_speed_limits) == int:
+        tables.append("custom_speeds")
+    return tables
+
+
+def simplified_areas(collection: DisasterAreaCollection, geometries: List[shapely.Geometry],
+                     tolerance: float) -> DisasterAreaCollection:
+    """
+    returns the collection with the geometries of its features simplified, their bboxes are kept
+    """
+    simplified = shapely.simplify(geometries, tolerance, preserve_topology=True)
+    features = [f.copy(update={"geometry": type(f.geometry).parse_obj(mapping(g))})
+                for f, g in zip(collection.features, simplified)]
+    return collection.copy(update={"features": features})
+
+
 def result_key(options: PathOptions) -> str:
     """
     returns the correct key of the result list depending on the response type
@@ -0,0 +1,79 @@
+"""
+Fast JSON serialization of relayed requests and responses
+
+Requests and responses of the routing relay are encoded with orjson straight to bytes.
+Pydantic models can be embedded in the serialized objects without converting them first.
+Feature streams are encoded chunk by chunk, as FeatureCollection or GeoJSON text sequence.
+"""
+from itertools import islice
+from typing import Any, Iterable, Iterator, List
+
+import orjson
+from pydantic import BaseModel
+
+OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def default(obj: Any) -> Any:
+    """
+    Converts objects orjson does not serialize natively. Pydantic models are converted one level at a time,
+    nested models are passed back to this function by orjson.
+    @param obj: object to convert
+    @return: serializable object
+    """
+    if isinstance(obj, BaseModel):
+        if "__root__" in obj.__fields__:
+            return obj.__root__
+        return dict(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Serializes an object to JSON
+    @param obj: object to serialize, may contain pydantic models and numpy arrays
+    @return: UTF-8 encoded JSON
+    """
+    return orjson.dumps(obj, default=default, option=OPTIONS)
+
+
+def loads(data: bytes | str) -> Any:
+    """
+    Deserializes JSON
+    @param data: JSON document
+    @return: deserialized object
+    """
+    return orjson.loads(data)
+
+
+def feature_sequence_chunks(features: Iterable[dict], chunk_features: int = 100) -> Iterator[bytes]:
+    """
+    Encodes features as GeoJSON text sequence (RFC 8142), every feature preceded by a record separator
+    @param features: GeoJSON features
+    @param chunk_features: features per chunk
+    @return: chunks of the sequence
+    """
+    features = iter(features)
+    while chunk := list(islice(features, chunk_features)):
+        yield b"".join(b"\x1e" + dumps(f) + b"\n" for f in chunk)
+
+
+def feature_collection_chunks(features: Iterable[dict], chunk_features: int = 100) -> Iterator[bytes]:
+    """
+    Encodes features as FeatureCollection. The bbox of the collection is collected from the bboxes of the
+    features and appended after the features.
+    @param features: GeoJSON features with bbox
+    @param chunk_features: features per chunk
+    @return: chunks of the FeatureCollection
+    """
+    bbox: List[float] = []
+    separator = b""
+    features = iter(features)
+    yield b'{"type":"FeatureCollection","features":['
+    while chunk := list(islice(features, chunk_features)):
+        for f in chunk:
+            b = f["bbox"]
+            bbox = [min(bbox[0], b[0]), min(bbox[1], b[1]), max(bbox[2], b[2]), max(bbox[3], b[3])] if bbox else b
+        yield separator + b",".join(dumps(f) for f in chunk)
+        separator = b","
+    yield b'],"bbox":' + dumps(bbox or [0, 0, 0, 0]) + b"}"
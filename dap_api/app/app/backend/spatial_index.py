@@ -0,0 +1,228 @@
+import hashlib
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import shapely
+from shapely.geometry import box
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.backend.geoutil import lookup_bbox, within_lookup_distance
+from app.crud.crud_disaster_area import get_row_as_feature, date_time_range, area_references
+from app.db.change_tracker import ChangeTracker, change_tracker
+from app.models import DisasterArea
+from app.schemas import DisasterArea as DisasterAreaSchema
+from app.schemas.disaster_area import DisasterAreaCollection, BBoxModel, LookupGeometry, DisasterAreaReferences
+
+# estimated bytes per coordinate: two doubles in the GEOS geometry plus a python list of two floats in the feature
+COORDINATE_SIZE = 152
+# estimated bytes per area for properties, bounds and object overhead
+ENTRY_SIZE = 1024
+
+
+class IndexEntry(NamedTuple):
+    feature: DisasterAreaSchema
+    geom: shapely.Geometry
+    d_type_id: int
+    created: Optional[datetime]
+    size: int
+    # md5 of the GeoJSON geometry, as computed by CRUDDisasterArea.get_multi_references
+    digest: str
+
+
+class DisasterAreaIndex:
+    """
+    In-process spatial index (STRtree) of all disaster areas.
+    Answers disaster area lookups without querying the database. Changes reported by the change tracker
+    are applied on the next lookup by reloading only the changed rows, including changes of other processes
+    forwarded by the ChangeListener. The index is still fully reloaded once it is older than max_age seconds,
+    in case the listener is disabled or disconnected.
+    """
+
+    def __init__(self, max_age: float = 60, tracker: ChangeTracker = change_tracker):
+        self.max_age = max_age
+        self._entries: Dict[int, IndexEntry] = {}
+        self._ids = np.empty(0, dtype=int)
+        self._tree = shapely.STRtree([])
+        self._pending = set()
+        self._reload = True
+        self._changed_at: Optional[float] = None
+        self._loaded_at: Optional[float] = None
+        self._refreshed_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        tracker.subscribe(DisasterArea.__tablename__, self.on_change)
+
+    def on_change(self, table: str, ids: Optional[List[Any]] = None) -> None:
+        """
+        Queues changed rows for the next refresh, or a full reload if the rows are unknown
+        """
+        with self._lock:
+            if ids is None:
+                self._reload = True
+            else:
+                self._pending.update(ids)
+            if self._changed_at is None:
+                self._changed_at = time.monotonic()
+
+    def refresh(self, db: Session) -> None:
+        """
+        Applies queued changes to the index
+        @param db: db session used to load changed rows
+        """
+        with self._refresh_lock:
+            with self._lock:
+                reload = self._reload or self._loaded_at is None or \
+                    time.monotonic() - self._loaded_at > self.max_age
+                pending = self._pending
+                if not reload and not pending:
+                    return
+                # changes reported while loading are queued again
+                self._pending = set()
+                self._reload = False
+                self._changed_at = None
+            try:
+                if reload:
+                    entries = {row.id: index_entry(row) for row in crud.disaster_area.feature_query(db).all()}
+                else:
+                    entries = dict(self._entries)
+                    for i in pending:
+                        entries.pop(i, None)
+                    rows = crud.disaster_area.feature_query(db).filter(DisasterArea.id.in_(pending)).all()
+                    entries.update({row.id: index_entry(row) for row in rows})
+            except Exception:
+                self.on_change(DisasterArea.__tablename__)
+                raise
+            ids = np.array(sorted(entries), dtype=int)
+            tree = shapely.STRtree([entries[i].geom for i in ids])
+            with self._lock:
+                self._entries, self._ids, self._tree = entries, ids, tree
+                self._refreshed_at = time.monotonic()
+                if reload:
+                    self._loaded_at = self._refreshed_at
+
+    def get_multi_as_feature_collection(
+            self, db: Session, bbox: BBoxModel = None, skip: int = 0, limit: int = 100, d_type_id: int = None,
+            date_time: str = None, near: List[LookupGeometry] = None
+    ) -> DisasterAreaCollection:
+        """
+        Same as crud.disaster_area.get_multi_as_feature_collection, answered from the index
+        """
+        matches = self.query(db, bbox, skip, limit, d_type_id, date_time, near)
+        bbox = [0, 0, 0, 0]
+        if matches:
+            bbox = np.round(shapely.total_bounds([e.geom for e in matches]), 7).tolist()
+        return DisasterAreaCollection(
+            features=[e.feature for e in matches],
+            bbox=bbox
+        )
+
+    def get_multi_geometries(
+            self, db: Session, bbox: BBoxModel = None, skip: int = 0, limit: int = 100, d_type_id: int = None,
+            date_time: str = None, near: List[LookupGeometry] = None
+    ) -> List[shapely.Geometry]:
+        """
+        Same as crud.disaster_area.get_multi_geometries, answered from the index
+        """
+        return [e.geom for e in self.query(db, bbox, skip, limit, d_type_id, date_time, near)]
+
+    def get_multi_references(
+            self, db: Session, bbox: BBoxModel = None, skip: int = 0, limit: int = 100, d_type_id: int = None,
+            date_time: str = None, near: List[LookupGeometry] = None
+    ) -> DisasterAreaReferences:
+        """
+        Same as crud.disaster_area.get_multi_references, answered from the index
+        """
+        matches = self.query(db, bbox, skip, limit, d_type_id, date_time, near)
+        return area_references([(e.feature.id, list(e.feature.bbox), e.digest) for e in matches])
+
+    def get_multi_references_with_geometries(
+            self, db: Session, bbox: BBoxModel = None, skip: int = 0, limit: int = 100, d_type_id: int = None,
+            date_time: str = None, near: List[LookupGeometry] = None
+    ) -> Tuple[DisasterAreaReferences, List[shapely.Geometry]]:
+        """
+        Same as crud.disaster_area.get_multi_references_with_geometries, answered from the index in one query
+        """
+        matches = self.query(db, bbox, skip, limit, d_type_id, date_time, near)
+        references = area_references([(e.feature.id, list(e.feature.bbox), e.digest) for e in matches])
+        return references, [e.geom for e in matches]
+
+    def query(self, db: Session, bbox: BBoxModel = None, skip: int = 0, limit: int = 100, d_type_id: int = None,
+              date_time: str = None, near: List[LookupGeometry] = None) -> List[IndexEntry]:
+        """
+        Returns the entries matching the filters ordered by id, all of them if limit is None
+        """
+        self.refresh(db)
+        with self._lock:
+            entries, ids, tree = self._entries, self._ids, self._tree
+        positions = np.arange(len(ids))
+        if bbox:
+            positions = tree.query(box(*bbox), predicate="intersects")
+        if near:
+            positions = np.intersect1d(positions, query_near(tree, near))
+        ids = np.sort(ids[positions])
+        start = end = None
+        if date_time:
+            start, end = (naive(d) for d in date_time_range(date_time))
+        matches = []
+        for i in ids:
+            entry = entries[i]
+            if d_type_id and entry.d_type_id != d_type_id:
+                continue
+            if (start is not None or end is not None) and entry.created is None:
+                continue
+            if (start is not None and entry.created < start) or (end is not None and entry.created > end):
+                continue
+            matches.append(entry)
+        return matches[skip:] if limit is None else matches[skip:skip + limit]
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._entries.values())
+            return {
+                "entries": len(entries),
+                "coordinates": int(sum(shapely.get_num_coordinates(e.geom) for e in entries)),
+                "memory_bytes": sum(e.size for e in entries),
+                "max_age": self.max_age,
+                "age": round(now - self._loaded_at, 1) if self._loaded_at is not None else None,
+                "last_refresh": round(now - self._refreshed_at, 1) if self._refreshed_at is not None else None,
+                "pending_changes": len(self._pending),
+                "reload_pending": self._reload,
+                "stale_for": round(now - self._changed_at, 1) if self._changed_at is not None else 0
+            }
+
+
+def query_near(tree: shapely.STRtree, near: List[LookupGeometry]) -> np.ndarray:
+    """
+    Returns the sorted tree positions of geometries within the distance of any lookup geometry
+    """
+    hits = [np.empty(0, dtype=np.intp)]
+    for lookup in near:
+        candidates = tree.query(box(*lookup_bbox(lookup)))
+        hits.append(candidates[within_lookup_distance(tree.geometries[candidates], lookup)])
+    return np.unique(np.concatenate(hits))
+
+
+def index_entry(row: Row) -> IndexEntry:
+    """
+    Creates an index entry from a row of CRUDDisasterArea.feature_query
+    """
+    feature = get_row_as_feature(row)
+    geom = shapely.from_geojson(row.geojson)
+    size = shapely.get_num_coordinates(geom) * COORDINATE_SIZE + ENTRY_SIZE
+    digest = hashlib.md5(row.geojson.encode()).hexdigest()
+    return IndexEntry(feature, geom, row.d_type_id, row.created, int(size), digest)
+
+
+def naive(d: Optional[datetime]) -> Optional[datetime]:
+    """
+    Converts timezone aware timestamps to naive local time, as stored in the database
+    """
+    if d is not None and d.tzinfo is not None:
+        return d.astimezone().replace(tzinfo=None)
+    return d
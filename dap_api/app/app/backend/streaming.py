@@ -0,0 +1,149 @@
+"""
+Splicing of members into streamed JSON responses
+
+ORS responses that only need a few changes are forwarded chunk by chunk instead of being parsed
+and serialized again. The changes are applied to the raw byte stream: members are inserted into the
+`query` object of the top level `metadata` object and at the end of the top level object, and a member
+of the query can be replaced or removed.
+"""
+import re
+from typing import Optional, Tuple
+
+METADATA = re.compile(rb'"metadata"\s*:\s*\{')
+QUERY = re.compile(rb'"query"\s*:\s*\{')
+STRUCTURE = re.compile(rb'[{}\[\],]')
+# bytes kept back from every chunk, so a pattern split across chunks is still found
+HOLD_BACK = 64
+
+
+class JSONSplicer:
+    def __init__(self, query_members: bytes = b"", tail_members: bytes = b"",
+                 query_replacement: Optional[Tuple[str, Optional[bytes]]] = None):
+        """
+        @param query_members: serialized members to insert into metadata.query, without enclosing braces
+        @param tail_members: serialized members to append to the top level object, without enclosing braces
+        @param query_replacement: name of a member within metadata.query and its new serialized value,
+        the member is removed if the value is None. String values of the replaced member must not contain
+        brackets or commas.
+        """
+        self.query_members = query_members
+        self.tail_members = tail_members
+        self.query_replacement = query_replacement
+        self._pattern = METADATA if query_members or query_replacement else None
+        self._member = None
+        if query_replacement is not None:
+            self._member = re.compile(rb'"' + re.escape(query_replacement[0].encode()) + rb'"\s*:\s*')
+        # position of the value of the member being replaced, and whether a comma precedes the member
+        self._value: Optional[Tuple[int, bool]] = None
+        self._buffer = b""
+
+    @property
+    def query_spliced(self) -> bool:
+        """
+        Whether the members were inserted into the query. A missing member to replace is not an error.
+        """
+        return self._pattern not in (METADATA, QUERY) and self._value is None
+
+    def feed(self, chunk: bytes) -> bytes:
+        """
+        Adds a chunk of the stream
+        @param chunk: next bytes of the JSON document
+        @return: bytes ready to be forwarded
+        """
+        self._buffer += chunk
+        out = []
+        while self._value is not None or self._pattern is not None:
+            if self._value is not None:
+                if not self._replace_value():
+                    # the value is not complete yet
+                    return b"".join(out)
+                continue
+            match = self._pattern.search(self._buffer)
+            if match is None:
+                break
+            if self._pattern is QUERY:
+                rest = self._buffer[match.end():].lstrip()
+                if not rest:
+                    # the separator depends on whether the query object is empty
+                    return b"".join(out)
+                separator = b"" if rest.startswith(b"}") or not self.query_members else b","
+                out.append(self._buffer[:match.end()] + self.query_members + separator)
+                self._buffer = self._buffer[match.end():]
+                self._pattern = self._member
+            elif self._pattern is METADATA:
+                out.append(self._buffer[:match.end()])
+                self._buffer = self._buffer[match.end():]
+                self._pattern = QUERY
+            else:
+                # keep a preceding comma, it is removed together with the member
+                before = self._buffer[:match.start()].rstrip()
+                comma = before.endswith(b",")
+                start = len(before) - 1 if comma else match.start()
+                out.append(self._buffer[:start])
+                self._buffer = self._buffer[start:]
+                self._value = (match.end() - start, comma)
+                self._pattern = None
+        limit = len(self._buffer) - HOLD_BACK
+        if limit > 0 and self._pattern is not None and self._pattern is self._member:
+            # a comma preceding the member has to stay in the buffer
+            comma = self._buffer.rfind(b",", 0, limit)
+            if comma >= 0:
+                limit = comma
+        if limit > 0:
+            out.append(self._buffer[:limit])
+            self._buffer = self._buffer[limit:]
+        return b"".join(out)
+
+    def _replace_value(self) -> bool:
+        """
+        Replaces or removes the member at the start of the buffer once its value is complete
+        @return: whether the member was replaced
+        """
+        start, comma = self._value
+        depth = 0
+        end = None
+        for match in STRUCTURE.finditer(self._buffer, start):
+            char = match.group()
+            if char in b"{[":
+                depth += 1
+            elif char in b"}]":
+                depth -= 1
+                if depth == 0:
+                    end = match.end()
+                    break
+                if depth < 0:
+                    end = match.start()
+                    break
+            elif depth == 0:
+                end = match.start()
+                break
+        if end is None:
+            return False
+        rest = self._buffer[end:]
+        value = self.query_replacement[1]
+        if value is not None:
+            member = self._buffer[:start] + value
+        else:
+            member = b""
+            if not comma:
+                # the first member is removed together with the following comma
+                stripped = rest.lstrip()
+                if not stripped:
+                    return False
+                if stripped.startswith(b","):
+                    rest = stripped[1:]
+        self._buffer = member + rest
+        self._value = None
+        return True
+
+    def close(self) -> bytes:
+        """
+        Ends the stream
+        @return: remaining bytes including the tail members
+        """
+        buffer, self._buffer = self._buffer, b""
+        if self.tail_members:
+            end = buffer.rfind(b"}")
+            if end >= 0:
+                buffer = buffer[:end] + b"," + self.tail_members + buffer[end:]
+        return buffer
@@ -0,0 +1,236 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Iterable, List, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.db.change_tracker import ChangeTracker, change_tracker
+from app.logger import logger
+from app.models import DisasterArea
+
+# estimated bytes per tile for the entry and the file, so empty tiles count against the budgets as well
+TILE_OVERHEAD = 512
+
+
+class TileEntry(NamedTuple):
+    # bounds of the tile including its buffer, in WGS84
+    bounds: List[float]
+    area_ids: FrozenSet[int]
+    size: int
+    expires: float
+
+
+def bboxes_intersect(a: List[float], b: List[float]) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class TileCache:
+    """
+    LRU cache of rendered vector tiles, kept in memory and moved to a directory on disk once the memory
+    budget is exceeded.
+    Tiles are invalidated by footprint: a change of an area drops the tiles that contained it right away, and
+    the tiles intersecting its new bounds once these are loaded by the next lookup. Changes made by other
+    processes are reported the same way by the ChangeListener. Tiles are still rendered again after ttl
+    seconds, which bounds how long they are outdated if the listener is disabled or disconnected.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, disk_max_bytes: int = 0, disk_dir: str = "",
+                 ttl: float = 3600, tracker: ChangeTracker = change_tracker):
+        """
+        @param max_bytes: size of the tiles kept in memory
+        @param disk_max_bytes: size of the tiles kept on disk, 0 disables the disk cache
+        @param disk_dir: parent of the temporary cache directory, the system default if empty
+        @param ttl: seconds until a tile is rendered again
+        """
+        self.max_bytes = max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_dir = disk_dir
+        self.ttl = ttl
+        self.tracker = tracker
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.memory_size = 0
+        self.disk_size = 0
+        self._entries: Dict[str, TileEntry] = {}
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._disk: OrderedDict[str, None] = OrderedDict()
+        self._directory: Optional[str] = None
+        self._pending = set()
+        self._lock = threading.Lock()
+        tracker.subscribe(DisasterArea.__tablename__, self.on_change)
+
+    def on_change(self, table: str, ids: Optional[List[Any]] = None) -> None:
+        """
+        Drops the tiles containing changed areas and queues the areas for the next lookup,
+        or drops all tiles if the areas are unknown
+        """
+        with self._lock:
+            if ids is None:
+                keys = list(self._entries)
+            else:
+                ids = set(ids)
+                keys = [k for k, e in self._entries.items() if not e.area_ids.isdisjoint(ids)]
+                self._pending.update(ids)
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+
+    def refresh(self, db: Session) -> None:
+        """
+        Drops the tiles intersecting the current bounds of queued areas
+        @param db: db session used to load the bounds
+        """
+        with self._lock:
+            pending, self._pending = self._pending, set()
+        if not pending:
+            return
+        try:
+            bboxes = crud.disaster_area.get_bboxes(db, pending)
+        except Exception:
+            with self._lock:
+                self._pending.update(pending)
+            raise
+        with self._lock:
+            keys = [k for k, e in self._entries.items() if any(bboxes_intersect(e.bounds, b) for b in bboxes)]
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+
+    def get(self, db: Session, key: str) -> Optional[bytes]:
+        """
+        Returns a cached tile, tiles on disk are moved back to memory
+        @param db: db session used to apply queued changes
+        @param key: cache key
+        """
+        self.refresh(db)
+        with self._lock:
+            entry = self._entries.get(key)
+            # a change reported meanwhile may affect the tile
+            if entry is None or self._pending:
+                self.misses += 1
+                return None
+            if entry.expires < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            tile = self._memory.get(key)
+            if tile is None:
+                try:
+                    tile = self._read(key)
+                except OSError:
+                    self._remove(key)
+                    self.misses += 1
+                    return None
+                self._disk.pop(key)
+                self.disk_size -= entry.size
+                self._memory[key] = tile
+                self.memory_size += entry.size
+                self._spill()
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return tile
+
+    def set(self, key: str, tile: bytes, bounds: List[float], area_ids: Iterable[int],
+            stamp: Dict[str, int]) -> None:
+        """
+        Adds a tile to the cache
+        @param key: cache key
+        @param tile: rendered tile
+        @param bounds: bounds of the tile including its buffer, in WGS84
+        @param area_ids: ids of the areas in the tile
+        @param stamp: table versions taken before the tile was rendered
+        """
+        size = len(tile) + TILE_OVERHEAD
+        if size > self.max_bytes or not self.tracker.is_current(stamp):
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = TileEntry(bounds, frozenset(area_ids), size, time.monotonic() + self.ttl)
+            self._memory[key] = tile
+            self.memory_size += size
+            self._spill()
+
+    def close(self) -> None:
+        """
+        Drops all tiles and removes the cache directory
+        """
+        with self._lock:
+            self._entries.clear()
+            self._memory.clear()
+            self._disk.clear()
+            self.memory_size = self.disk_size = 0
+            if self._directory is not None:
+                shutil.rmtree(self._directory, ignore_errors=True)
+                self._directory = None
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "memory_entries": len(self._memory),
+            "memory_bytes": self.memory_size,
+            "max_bytes": self.max_bytes,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self.disk_size,
+            "disk_max_bytes": self.disk_max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+    def _spill(self) -> None:
+        """
+        Moves the least recently used tiles to disk until the memory budget is met
+        """
+        while self.memory_size > self.max_bytes:
+            key, tile = self._memory.popitem(last=False)
+            size = self._entries[key].size
+            self.memory_size -= size
+            if size > self.disk_max_bytes or not self._write(key, tile):
+                del self._entries[key]
+                self.evictions += 1
+                continue
+            self._disk[key] = None
+            self.disk_size += size
+            while self.disk_size > self.disk_max_bytes:
+                self._remove(next(iter(self._disk)))
+                self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        if self._memory.pop(key, None) is not None:
+            self.memory_size -= entry.size
+        elif key in self._disk:
+            del self._disk[key]
+            self.disk_size -= entry.size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, f"{key}.mvt")
+
+    def _write(self, key: str, tile: bytes) -> bool:
+        try:
+            if self._directory is None:
+                self._directory = tempfile.mkdtemp(prefix="dap-tiles-", dir=self.disk_dir or None)
+            with open(self._path(key), "wb") as f:
+                f.write(tile)
+            return True
+        except OSError as e:
+            logger.error(f"Writing tile to disk cache failed: {e!r}")
+            return False
+
+    def _read(self, key: str) -> bytes:
+        with open(self._path(key), "rb") as f:
+            return f.read()
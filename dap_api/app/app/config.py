@@ -10,6 +10,52 @@ class Settings(BaseSettings):
     ADMIN_USER_SECRET: str
     API_V1_STR: str = "/api/v1"
     ORS_BACKEND_URL: str = "https://api.openrouteservice.org/v2"
+    # relay client: timeouts in seconds, connection limits per backend
+    ORS_CONNECT_TIMEOUT: float = 5.0
+    ORS_READ_TIMEOUT: float = 120.0
+    ORS_MAX_CONNECTIONS: int = 50
+    ORS_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    ORS_KEEPALIVE_EXPIRY: float = 30.0
+    # relay response cache: time to live in seconds, size limits
+    ORS_CACHE_ENABLED: bool = True
+    ORS_CACHE_TTL: float = 300.0
+    ORS_CACHE_MAX_ENTRIES: int = 1000
+    ORS_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    ORS_CACHE_MAX_ENTRY_BYTES: int = 8 * 1024 * 1024
+    # forward responses that need no rewriting chunk by chunk
+    ORS_STREAM_RESPONSES: bool = True
+    # batch requests: relays running at the same time per batch, requests per batch
+    ORS_BATCH_CONCURRENCY: int = 8
+    ORS_BATCH_MAX_ITEMS: int = 500
+
+    ORS_AVOID_VERTEX_BUDGET: int = 10000
+    ORS_AVOID_PRECISION: int = 6
+    # maximum distance in meters avoid polygons may be moved by simplifying them to the vertex budget
+    ORS_AVOID_MAX_SIMPLIFY_DISTANCE: float = 100.0
+    # compute differences of generate_difference with shapely, PostGIS is used as fallback
+    ORS_DIFFERENCE_IN_PROCESS: bool = True
+
+    # routing jobs: jobs executed at the same time per process, seconds until jobs are removed
+    ROUTING_JOB_WORKERS: int = 4
+    ROUTING_JOB_TTL: float = 24 * 3600.0
+
+    # validate uploaded disaster area geometries with shapely, otherwise only PostGIS validates them on write
+    DISASTER_AREA_VALIDATION_IN_PROCESS: bool = True
+    # bulk ingestion: features per upload, geometries validated per batch
+    DISASTER_AREA_INGEST_MAX_FEATURES: int = 10000
+    DISASTER_AREA_INGEST_BATCH_SIZE: int = 500
+    DISASTER_AREA_INDEX_ENABLED: bool = True
+    DISASTER_AREA_INDEX_MAX_AGE: float = 3600.0
+
+    # vector tiles: cache size in memory and on disk, seconds until tiles are rendered again. Tiles evicted
+    # from memory are moved to a temporary directory within DISASTER_AREA_TILE_CACHE_DIR (system default if empty)
+    DISASTER_AREA_TILE_CACHE_ENABLED: bool = True
+    DISASTER_AREA_TILE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    DISASTER_AREA_TILE_CACHE_DISK_MAX_BYTES: int = 1024 * 1024 * 1024
+    DISASTER_AREA_TILE_CACHE_DIR: str = ""
+    DISASTER_AREA_TILE_CACHE_TTL: float = 3600.0
+
+    DB_CHANGE_LISTENER_ENABLED: bool = True
 
     CREATE_EXAMPLE_DATA_ON_STARTUP: bool = False
     DEBUG: bool = False
@@ -4,3 +4,4 @@ from .crud_disaster_type import disaster_type
 from .crud_disaster_sub_type import disaster_sub_type
 from .crud_disaster_area import disaster_area
 from .crud_custom_speeds import custom_speeds
+from .crud_routing_job import routing_job
@@ -1,10 +1,12 @@
-from typing import Any, Dict, Generic, List, Optional, Type, TypeVar
+from typing import Any, Dict, Generic, Iterable, List, Optional, Type, TypeVar
 
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
+from sqlalchemy import inspect
 from sqlalchemy.orm import Session
 
 from app.db.base import BaseTable
+from app.db.change_tracker import change_tracker
 
 ModelType = TypeVar("ModelType", bound=BaseTable)
 CreateSchemaType = TypeVar("CreateSchemaType", bound=BaseModel)
@@ -29,11 +31,18 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     ) -> List[ModelType]:
         return db.query(self.model).offset(skip).limit(limit).all()
 
+    def get_multi_by_ids(self, db: Session, ids: Iterable[Any]) -> List[ModelType]:
+        ids = set(ids)
+        if not ids:
+            return []
+        return db.query(self.model).filter(self.model.id.in_(ids)).all()
+
     def create(self, db: Session, *, obj_in: CreateSchemaType) -> ModelType:
         obj_in_data = jsonable_encoder(obj_in)
         db_obj = self.model(**obj_in_data)  # type: ignore
         db.add(db_obj)
         db.commit()
+        self.notify_change(db_obj)
         db.refresh(db_obj)
         return db_obj
 
@@ -54,6 +63,7 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
                 setattr(db_obj, field, update_data[field])
         db.add(db_obj)
         db.commit()
+        self.notify_change(db_obj)
         db.refresh(db_obj)
         return db_obj
 
@@ -61,7 +71,16 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         obj = db.query(self.model).get(id)
         db.delete(obj)
         db.commit()
+        self.notify_change(obj)
         return obj
 
+    def notify_change(self, *db_objs: ModelType) -> None:
+        """
+        Marks the table of the model as changed, which invalidates cached data depending on it
+        @param db_objs: the changed rows. Their ids are taken from the identity map, so no reload is triggered
+        """
+        ids = [inspect(db_obj).identity[0] for db_obj in db_objs]
+        change_tracker.notify(self.model.__tablename__, ids or None)
+
     def count(self, db: Session) -> int:
         return db.query(self.model).count()
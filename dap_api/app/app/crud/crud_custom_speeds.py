@@ -49,6 +49,7 @@ class CRUDCustomSpeeds(CRUDBase[CustomSpeedsSchema, CustomSpeedsCreate, CustomSp
         )
         db.add(db_obj)
         db.commit()
+        self.notify_change(db_obj)
         db.refresh(db_obj)
         return db_obj
 
@@ -67,6 +68,7 @@ class CRUDCustomSpeeds(CRUDBase[CustomSpeedsSchema, CustomSpeedsCreate, CustomSp
             setattr(db_obj, field, update_data[field])
         db.add(db_obj)
         db.commit()
+        self.notify_change(db_obj)
         db.refresh(db_obj)
         return db_obj
 
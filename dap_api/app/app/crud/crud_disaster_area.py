@@ -1,16 +1,28 @@
+import hashlib
+import io
 import json
 from datetime import datetime
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple, Iterable, Iterator, Set
 
+import shapely
 from dateutil import parser as date_parser
-from geoalchemy2 import func, Geometry
-from sqlalchemy.orm import Session
+from geoalchemy2 import func
+from sqlalchemy import or_, not_, select, insert, update, literal, literal_column, cast, inspect, text, table, column, Numeric, Float, \
+    Integer, String
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session, Query
+from sqlalchemy.sql.expression import ColumnElement, Subquery
 
 from app.models import DisasterArea
 from app.schemas import DisasterArea as DisasterAreaSchema
 from app.schemas import DisasterAreaCreate, DisasterAreaUpdate
+from app.backend.geoutil import tile_bounds
+from app.backend.serialization import loads
+from app.db.change_tracker import change_tracker
 from .base import CRUDBase
-from ..schemas.disaster_area import DisasterAreaCollection, BBoxModel
+from ..schemas.disaster_area import DisasterAreaCollection, BBoxModel, LookupGeometry, DisasterAreaReferences, \
+    DisasterAreaPropertiesBase, DisasterAreaPropertiesCreateOut
 
 
 def multi_to_single(multi_polygon: dict) -> None:
@@ -21,27 +33,172 @@ def single_to_multi(polygon: dict) -> None:
     polygon.update(type="MultiPolygon", coordinates=[polygon.get("coordinates")])
 
 
-def get_entry_as_feature(db: Session, entry: DisasterArea) -> DisasterAreaSchema:
-    json_geom = json.loads(db.execute(entry.geom.ST_AsGeoJson(7, 1)).scalar())
+def get_row_as_feature(row: Row) -> DisasterAreaSchema:
+    """
+    Assembles a feature from a row of CRUDDisasterArea.feature_query
+    """
+    json_geom = json.loads(row.geojson)
     if len(json_geom.get("coordinates")) == 1:
         multi_to_single(json_geom)
     d_area = DisasterAreaSchema(
-        id=entry.id,
-        properties=entry.__dict__,
+        id=row.id,
+        properties=dict(row._mapping),
         geometry=json_geom,
         bbox=json_geom.get('bbox')
     )
     return d_area
 
 
-def calculate_geometry_area(db: Session, geom: Geometry) -> float:
-    # get the best Projection for area calculation
-    best_area_projection = db.execute(func._ST_BestSRID(geom)).scalar()
-    # reproject to
-    transformed_geom = func.ST_Transform(geom, best_area_projection)
-    # calculate polygon area
-    area = db.execute(func.ST_Area(transformed_geom)).scalar()
-    return round(area, 2)
+def get_row_as_feature_dict(row: Row) -> Dict[str, Any]:
+    """
+    Assembles a feature from a row of CRUDDisasterArea.feature_query as plain dict, in the format of the
+    DisasterArea schema but without validating it
+    """
+    json_geom = loads(row.geojson)
+    if len(json_geom.get("coordinates")) == 1:
+        multi_to_single(json_geom)
+    return {
+        "type": "Feature",
+        "geometry": {"type": json_geom["type"], "coordinates": json_geom["coordinates"]},
+        "properties": {key: row._mapping[key] for key in DisasterAreaPropertiesCreateOut.__fields__},
+        "id": row.id,
+        "bbox": json_geom.get("bbox")
+    }
+
+
+def area_references(areas: List[Tuple[int, List[float], str]]) -> DisasterAreaReferences:
+    """
+    Assembles references to areas. The version tag of the references changes whenever an area is added or removed
+    or the geometry of an area changes.
+    @param areas: id, bbox and digest of the GeoJSON geometry of each area
+    @return: references
+    """
+    version = hashlib.md5("".join(f"{i}:{digest};" for i, _, digest in areas).encode()).hexdigest()
+    bbox = [0, 0, 0, 0]
+    if areas:
+        bboxes = [b for _, b, _ in areas]
+        bbox = [min(b[0] for b in bboxes), min(b[1] for b in bboxes),
+                max(b[2] for b in bboxes), max(b[3] for b in bboxes)]
+    return DisasterAreaReferences(
+        version=version,
+        areas=[dict(id=i, bbox=b) for i, b, _ in areas],
+        bbox=bbox
+    )
+
+
+def reference_of_row(row: Row) -> Tuple[int, List[float], str]:
+    return row.id, [round(row.xmin, 7), round(row.ymin, 7), round(row.xmax, 7), round(row.ymax, 7)], row.digest
+
+
+def date_time_range(date_time: str) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    Parses a date_time filter, either a single timestamp or an interval with open ends marked by '' or '..'
+    @param date_time: date_time filter
+    @return: start and end of the interval, equal for a single timestamp and None for open ends
+    """
+    date_time_array = date_time.split('/')
+    if len(date_time_array) == 1:
+        timestamp = date_parser.isoparse(date_time)
+        return timestamp, timestamp
+    if len(date_time_array) == 2:
+        date1, date2 = date_time_array
+        start = date_parser.isoparse(date1) if date1 not in ['', '..'] else None
+        end = date_parser.isoparse(date2) if date2 not in ['', '..'] else None
+        return start, end
+    return None, None
+
+
+def filter_query(query: Query, bbox: BBoxModel = None, d_type_id: int = None, date_time: str = None,
+                 near: List[LookupGeometry] = None, after: int = None) -> Query:
+    if after is not None:
+        # keyset pagination on the id
+        query = query.filter(DisasterArea.id > after)
+    if bbox:
+        query = query.filter(
+            DisasterArea.geom.intersects(func.ST_MakeEnvelope(*bbox))
+        )
+    if near:
+        # areas within the distance of any lookup geometry, using the geography index of the geometries
+        query = query.filter(or_(*[
+            func.ST_DWithin(func.geography(DisasterArea.geom), func.ST_GeogFromText(g.wkt), g.distance)
+            for g in near
+        ]))
+    if d_type_id:
+        query = query.filter(
+            DisasterArea.d_type_id == d_type_id
+        )
+    if date_time:
+        start, end = date_time_range(date_time)
+        if start is not None and start == end:
+            query = query.filter(DisasterArea.created == start)
+        else:
+            if start is not None:
+                query = query.filter(DisasterArea.created >= start)
+            if end is not None:
+                query = query.filter(DisasterArea.created <= end)
+    return query
+
+
+def geometry_area(geom: ColumnElement) -> ColumnElement:
+    """
+    Area in square meters, calculated in the best projection for the geometry and rounded to 2 decimals
+    """
+    transformed_geom = func.ST_Transform(geom, func._ST_BestSRID(geom))
+    return cast(func.round(cast(func.ST_Area(transformed_geom), Numeric), 2), Float)
+
+
+def parsed_geometry(geometry: Dict[str, Any]) -> Subquery:
+    """
+    Subquery parsing a GeoJSON Polygon or MultiPolygon into the stored MultiPolygon
+    @param geometry: GeoJSON geometry
+    @return: subquery with the column geom
+    """
+    return select(func.ST_Multi(func.ST_GeomFromGeoJSON(json.dumps(geometry))).label("geom")).subquery("parsed")
+
+
+def feature_columns() -> List[ColumnElement]:
+    """
+    Properties and GeoJSON geometry (including its bbox) of disaster areas, as needed by get_row_as_feature
+    """
+    return [
+        DisasterArea.id,
+        DisasterArea.name,
+        DisasterArea.provider_id,
+        DisasterArea.d_type_id,
+        DisasterArea.ds_type_id,
+        DisasterArea.description,
+        DisasterArea.created,
+        DisasterArea.area,
+        func.ST_AsGeoJson(DisasterArea.geom, 7, 1).label("geojson")
+    ]
+
+
+# temporary table bulk uploads are copied into, dropped when the transaction ends
+STAGING_TABLE = table(
+    "disaster_area_staging",
+    column("idx", Integer),
+    column("name", String),
+    column("provider_id", Integer),
+    column("d_type_id", Integer),
+    column("ds_type_id", Integer),
+    column("description", String),
+    column("geojson", String)
+)
+
+
+def copy_text(value: Any) -> str:
+    """
+    Formats a value for COPY in text format
+    """
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+class InvalidGeometryError(ValueError):
+    def __init__(self, reason: str):
+        super().__init__(f"Geometry not valid: {reason}")
+        self.reason = reason
 
 
 class CRUDDisasterArea(CRUDBase[DisasterArea, DisasterAreaCreate, DisasterAreaUpdate]):
@@ -49,104 +206,308 @@ class CRUDDisasterArea(CRUDBase[DisasterArea, DisasterAreaCreate, DisasterAreaUp
         entry = db.query(DisasterArea).get(id)
         return entry
 
+    @staticmethod
+    def feature_query(db: Session, *columns) -> Query:
+        """
+        Query selecting the properties and the GeoJSON geometry (including its bbox) of disaster areas,
+        so features can be assembled without further queries.
+        @param db: db session
+        @param columns: additional columns to select
+        @return: query
+        """
+        return db.query(*feature_columns(), *columns)
+
     def get_as_feature(self, db: Session, id: Any) -> Optional[DisasterAreaSchema]:
-        entry = db.query(DisasterArea).get(id)
-        d_area = get_entry_as_feature(db, entry)
-        return d_area
+        row = self.feature_query(db).filter(DisasterArea.id == id).first()
+        if not row:
+            return None
+        return get_row_as_feature(row)
 
     def get_multi(
             self, db: Session, bbox: BBoxModel = None, skip: int = 0, limit: int = 100, d_type_id: int = None,
-            date_time: str = None
+            date_time: str = None, near: List[LookupGeometry] = None
     ) -> List[DisasterArea]:
-        if any([x is not None for x in [bbox, d_type_id, date_time]]):
-            query = db.query(DisasterArea)
-            if bbox:
-                query = query.filter(
-                    DisasterArea.geom.intersects(func.ST_MakeEnvelope(*bbox))
-                )
-            if d_type_id:
-                query = query.filter(
-                    DisasterArea.d_type_id == d_type_id
-                )
-            if date_time:
-                date_time_array = date_time.split('/')
-                if len(date_time_array) == 1:
-                    query = query.filter(DisasterArea.created == date_parser.isoparse(date_time))
-                elif len(date_time_array) == 2:
-                    date1, date2 = date_time_array
-                    if date1 not in ['', '..']:
-                        query = query.filter(DisasterArea.created >= date_parser.isoparse(date1))
-                    if date2 not in ['', '..']:
-                        query = query.filter(DisasterArea.created <= date_parser.isoparse(date2))
+        if any([x is not None for x in [bbox, d_type_id, date_time, near]]):
+            query = filter_query(db.query(DisasterArea), bbox, d_type_id, date_time, near)
             return query.offset(skip).limit(limit).all()
         return super().get_multi(db=db, skip=skip, limit=limit)
 
     def get_multi_as_feature_collection(
             self, db: Session, bbox: BBoxModel = None, skip: int = 0, limit: int = 100, d_type_id: int = None,
-            date_time: str = None
+            date_time: str = None, near: List[LookupGeometry] = None, after: int = None
     ) -> DisasterAreaCollection:
-        entries = self.get_multi(db, bbox, skip, limit, d_type_id, date_time)
-        features = [self.get_as_feature(db, e.id) for e in entries]
-        boxes = [f.bbox for f in features]
+        # features of the page and the extent of the page are selected in a single statement
+        page = filter_query(self.feature_query(db, DisasterArea.geom), bbox, d_type_id, date_time, near, after) \
+            .order_by(DisasterArea.id).offset(skip).limit(limit).subquery()
+        extent = func.ST_Extent(page.c.geom).over()
+        rows = db.query(
+            *[c for c in page.c if c.key != "geom"],
+            func.ST_XMin(extent).label("xmin"),
+            func.ST_YMin(extent).label("ymin"),
+            func.ST_XMax(extent).label("xmax"),
+            func.ST_YMax(extent).label("ymax")
+        ).order_by(page.c.id).all()
+        features = [get_row_as_feature(row) for row in rows]
         bbox = [0, 0, 0, 0]
-        if boxes:
-            bbox = [
-                min(b[0] for b in boxes),
-                min(b[1] for b in boxes),
-                max(b[2] for b in boxes),
-                max(b[3] for b in boxes)
-            ]
+        if rows:
+            bbox = [round(rows[0].xmin, 7), round(rows[0].ymin, 7), round(rows[0].xmax, 7), round(rows[0].ymax, 7)]
         return DisasterAreaCollection(
             features=features,
             bbox=bbox
         )
 
+    def iter_features(
+            self, db: Session, bbox: BBoxModel = None, d_type_id: int = None, date_time: str = None,
+            after: int = None, batch_size: int = 500
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Features of all areas matching the filters, ordered by id. Rows are fetched in batches through a
+        server-side cursor, so the collection is never held in memory.
+        @return: features as plain dicts, see get_row_as_feature_dict
+        """
+        query = filter_query(self.feature_query(db), bbox, d_type_id, date_time, after=after) \
+            .order_by(DisasterArea.id).yield_per(batch_size)
+        for row in query:
+            yield get_row_as_feature_dict(row)
+
+    def get_multi_geometries(
+            self, db: Session, bbox: BBoxModel = None, skip: int = 0, limit: int = 100, d_type_id: int = None,
+            date_time: str = None, near: List[LookupGeometry] = None
+    ) -> List[shapely.Geometry]:
+        """
+        Returns only the geometries of the areas matching the filters, as needed for avoid polygons.
+        Polygon and MultiPolygon areas are returned alike, as they are all stored as MultiPolygon.
+        Geometries are transferred as WKB, no features are assembled.
+        """
+        rows = filter_query(db.query(func.ST_AsBinary(DisasterArea.geom)), bbox, d_type_id, date_time, near) \
+            .order_by(DisasterArea.id).offset(skip).limit(limit).all()
+        return list(shapely.from_wkb([bytes(row[0]) for row in rows]))
+
+    def get_multi_references(
+            self, db: Session, bbox: BBoxModel = None, skip: int = 0, limit: int = 100, d_type_id: int = None,
+            date_time: str = None, near: List[LookupGeometry] = None
+    ) -> DisasterAreaReferences:
+        """
+        Returns references to the areas matching the filters. Only ids, bboxes and digests of the
+        geometries are transferred.
+        """
+        rows = filter_query(self.reference_query(db), bbox, d_type_id, date_time, near) \
+            .order_by(DisasterArea.id).offset(skip).limit(limit).all()
+        return area_references([reference_of_row(row) for row in rows])
+
+    def get_multi_references_with_geometries(
+            self, db: Session, bbox: BBoxModel = None, skip: int = 0, limit: int = 100, d_type_id: int = None,
+            date_time: str = None, near: List[LookupGeometry] = None
+    ) -> Tuple[DisasterAreaReferences, List[shapely.Geometry]]:
+        """
+        Returns references to the areas matching the filters together with their geometries, as needed for
+        avoid polygons if only references are returned. Both are read in a single statement, the geometries
+        are transferred as WKB.
+        """
+        rows = filter_query(self.reference_query(db, func.ST_AsBinary(DisasterArea.geom).label("wkb")), bbox,
+                            d_type_id, date_time, near).order_by(DisasterArea.id).offset(skip).limit(limit).all()
+        references = area_references([reference_of_row(row) for row in rows])
+        return references, list(shapely.from_wkb([bytes(row.wkb) for row in rows]))
+
+    @staticmethod
+    def reference_query(db: Session, *columns: ColumnElement) -> Query:
+        return db.query(
+            DisasterArea.id,
+            func.md5(func.ST_AsGeoJson(DisasterArea.geom, 7, 1)).label("digest"),
+            func.ST_XMin(DisasterArea.geom).label("xmin"),
+            func.ST_YMin(DisasterArea.geom).label("ymin"),
+            func.ST_XMax(DisasterArea.geom).label("xmax"),
+            func.ST_YMax(DisasterArea.geom).label("ymax"),
+            *columns
+        )
+
+    def get_tile(
+            self, db: Session, z: int, x: int, y: int, d_type_id: int = None, date_time: str = None,
+            extent: int = 4096, buffer: int = 64
+    ) -> Tuple[bytes, List[int]]:
+        """
+        Renders the areas matching the filters as Mapbox Vector Tile, with a layer "disaster_areas"
+        @param z: zoom level
+        @param x: column of the tile
+        @param y: row of the tile
+        @param extent: tile extent in screen space
+        @param buffer: buffer around the tile in screen space, geometries are clipped to it
+        @return: the tile and the ids of the areas in it
+        """
+        envelope = func.ST_TileEnvelope(z, x, y)
+        features = filter_query(db.query(
+            DisasterArea.id,
+            DisasterArea.name,
+            DisasterArea.provider_id,
+            DisasterArea.d_type_id,
+            DisasterArea.ds_type_id,
+            DisasterArea.description,
+            cast(DisasterArea.created, String).label("created"),
+            DisasterArea.area,
+            func.ST_AsMVTGeom(func.ST_Transform(DisasterArea.geom, 3857), envelope, extent, buffer, True).label("geom")
+        ), bbox=tile_bounds(z, x, y, buffer / extent), d_type_id=d_type_id, date_time=date_time).subquery("features")
+        row = db.query(
+            func.ST_AsMVT(literal_column("features"), "disaster_areas", extent, "geom", "id"),
+            func.array_agg(features.c.id)
+        ).select_from(features).filter(features.c.geom.isnot(None)).one()
+        return bytes(row[0] or b""), list(row[1] or [])
+
+    def get_bboxes(self, db: Session, ids: Iterable[Any]) -> List[List[float]]:
+        """
+        Bounding boxes of the areas with the given ids, missing areas are skipped
+        """
+        ids = set(ids)
+        if not ids:
+            return []
+        rows = db.query(
+            func.ST_XMin(DisasterArea.geom),
+            func.ST_YMin(DisasterArea.geom),
+            func.ST_XMax(DisasterArea.geom),
+            func.ST_YMax(DisasterArea.geom)
+        ).filter(DisasterArea.id.in_(ids)).all()
+        return [list(row) for row in rows]
+
     def get_by_name(self, db: Session, *, name: str) -> Optional[DisasterArea]:
         return db.query(DisasterArea).filter(DisasterArea.name == name).first()
 
     def create(self, db: Session, *, obj_in: DisasterAreaCreate) -> DisasterArea:
-        geom_dict = obj_in.geometry.dict()
-        if len(obj_in.geometry.coordinates) == 1:
-            single_to_multi(geom_dict)
-        geom = func.ST_GeomFromGeoJSON(json.dumps(geom_dict))
-        area = calculate_geometry_area(db, geom)
-        db_obj = DisasterArea(
-            name=obj_in.properties.name,
-            provider_id=obj_in.properties.provider_id,
-            d_type_id=obj_in.properties.d_type_id,
-            ds_type_id=obj_in.properties.ds_type_id,
-            description=obj_in.properties.description,
-            geom=geom,
-            area=area,
-            created=datetime.now()
-        )
-        db.add(db_obj)
+        feature = self.create_as_feature(db, obj_in=obj_in)
+        return self.get(db, feature.id)
+
+    def create_as_feature(self, db: Session, *, obj_in: DisasterAreaCreate) -> DisasterAreaSchema:
+        """
+        Creates an area in a single statement, which validates the geometry, calculates the area and
+        returns the stored feature
+        @param db: db session
+        @param obj_in: area to create
+        @return: the created feature
+        @raise InvalidGeometryError: if the geometry is not valid
+        """
+        parsed = parsed_geometry(obj_in.geometry.dict())
+        values = dict(obj_in.properties.dict(include=set(DisasterAreaPropertiesBase.__fields__)),
+                      created=datetime.now())
+        table = DisasterArea.__table__
+        statement = insert(DisasterArea).from_select(
+            [*values, "geom", "area"],
+            select(
+                *[literal(value, table.c[key].type) for key, value in values.items()],
+                parsed.c.geom,
+                geometry_area(parsed.c.geom)
+            ).where(func.ST_IsValid(parsed.c.geom))
+        ).returning(*feature_columns())
+        row = db.execute(statement).first()
+        if row is None:
+            db.rollback()
+            raise InvalidGeometryError(self.geometry_validity(db, parsed))
         db.commit()
-        db.refresh(db_obj)
-        return db_obj
+        change_tracker.notify(self.model.__tablename__, [row.id])
+        return get_row_as_feature(row)
+
+    def create_bulk(self, db: Session, *, objs_in: Dict[int, DisasterAreaCreate]
+                    ) -> Tuple[Dict[int, int], Dict[int, str]]:
+        """
+        Creates many areas in one transaction. The areas are copied into a staging table and merged with a single
+        statement, which skips invalid geometries and names that already exist.
+        @param db: db session
+        @param objs_in: areas to create by their index in the upload, the names must be unique
+        @return: ids of the created areas and reasons of the invalid geometries, by index. Areas missing in
+        both were skipped because their name was taken meanwhile.
+        """
+        if not objs_in:
+            return {}, {}
+        db.execute(text(
+            "CREATE TEMPORARY TABLE disaster_area_staging (idx integer, name varchar, provider_id integer, "
+            "d_type_id integer, ds_type_id integer, description varchar, geojson varchar) ON COMMIT DROP"
+        ))
+        buffer = io.StringIO()
+        for i, obj_in in objs_in.items():
+            p = obj_in.properties
+            values = (i, p.name, p.provider_id, p.d_type_id, p.ds_type_id, p.description, obj_in.geometry.json())
+            buffer.write("\t".join(copy_text(v) for v in values) + "\n")
+        buffer.seek(0)
+        columns = ", ".join(c.name for c in STAGING_TABLE.c)
+        with db.connection().connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY disaster_area_staging ({columns}) FROM STDIN", buffer)
+
+        parsed_geom = func.ST_Multi(func.ST_GeomFromGeoJSON(STAGING_TABLE.c.geojson))
+        parsed = select(
+            *[c for c in STAGING_TABLE.c if c.name not in ("idx", "geojson")],
+            parsed_geom.label("geom")
+        ).subquery("parsed")
+        properties = [c.name for c in parsed.c if c.name != "geom"]
+        statement = pg_insert(DisasterArea).from_select(
+            [*properties, "geom", "area", "created"],
+            select(
+                *[parsed.c[name] for name in properties],
+                parsed.c.geom,
+                geometry_area(parsed.c.geom),
+                literal(datetime.now(), DisasterArea.created.type)
+            ).where(func.ST_IsValid(parsed.c.geom))
+        ).on_conflict_do_nothing(index_elements=["name"]).returning(DisasterArea.id, DisasterArea.name)
+        index = {obj_in.properties.name: i for i, obj_in in objs_in.items()}
+        created = {index[row.name]: row.id for row in db.execute(statement)}
+        invalid = {}
+        if len(created) < len(objs_in):
+            invalid = dict(db.execute(
+                select(STAGING_TABLE.c.idx, func.ST_IsValidReason(parsed_geom))
+                .where(STAGING_TABLE.c.idx.notin_(list(created)), not_(func.ST_IsValid(parsed_geom)))
+            ).all())
+        db.commit()
+        if created:
+            change_tracker.notify(self.model.__tablename__, list(created.values()))
+        return created, invalid
+
+    def get_existing_names(self, db: Session, names: Iterable[str]) -> Set[str]:
+        names = set(names)
+        if not names:
+            return set()
+        return {row.name for row in db.query(DisasterArea.name).filter(DisasterArea.name.in_(names))}
 
     def update(self, db: Session, *, db_obj: DisasterArea, obj_in: DisasterAreaUpdate | Dict[str, Any]
                ) -> DisasterArea:
+        self.update_as_feature(db, id=inspect(db_obj).identity[0], obj_in=obj_in)
+        db.refresh(db_obj)
+        return db_obj
+
+    def update_as_feature(self, db: Session, *, id: Any, obj_in: DisasterAreaUpdate | Dict[str, Any]
+                          ) -> Optional[DisasterAreaSchema]:
+        """
+        Updates an area in a single statement, which validates a new geometry, recalculates the area and
+        returns the stored feature
+        @param db: db session
+        @param id: id of the area
+        @param obj_in: new properties and/or geometry
+        @return: the updated feature, None if the area does not exist
+        @raise InvalidGeometryError: if the new geometry is not valid
+        """
         if isinstance(obj_in, DisasterAreaUpdate):
             obj_in = obj_in.dict(exclude_unset=True)
+        update_data = obj_in.get('properties') or {k: v for k, v in obj_in.items() if k != 'geometry'}
+        values = {k: v for k, v in update_data.items() if k in DisasterAreaPropertiesBase.__fields__}
+        statement = update(DisasterArea).where(DisasterArea.id == id)
+        parsed = None
         if obj_in.get('geometry'):
-            geom_dict = obj_in.get('geometry')
-            if len(geom_dict.get("coordinates")) == 1:
-                single_to_multi(geom_dict)
-            geom = func.ST_GeomFromGeoJSON(json.dumps(geom_dict))
-            area = calculate_geometry_area(db, geom)
-            setattr(db_obj, 'geom', geom)
-            setattr(db_obj, 'area', area)
-            del obj_in['geometry']
-        update_data = obj_in
-        if update_data.get('properties'):
-            update_data = update_data['properties']
-        for field in update_data:
-            setattr(db_obj, field, update_data[field])
-        db.add(db_obj)
+            parsed = parsed_geometry(obj_in['geometry'])
+            statement = statement.where(func.ST_IsValid(parsed.c.geom))
+            values.update(geom=parsed.c.geom, area=geometry_area(parsed.c.geom))
+        if not values:
+            return self.get_as_feature(db, id)
+        row = db.execute(statement.values(**values).returning(*feature_columns())).first()
+        if row is None:
+            db.rollback()
+            if parsed is not None and self.get(db, id) is not None:
+                raise InvalidGeometryError(self.geometry_validity(db, parsed))
+            return None
         db.commit()
-        db.refresh(db_obj)
-        return db_obj
+        change_tracker.notify(self.model.__tablename__, [row.id])
+        return get_row_as_feature(row)
+
+    @staticmethod
+    def geometry_validity(db: Session, parsed: Subquery) -> str:
+        """
+        Reason for the validity of a parsed geometry, only queried once a write rejected the geometry
+        """
+        return db.execute(select(func.ST_IsValidReason(parsed.c.geom))).scalar()
 
 
 disaster_area = CRUDDisasterArea(DisasterArea)
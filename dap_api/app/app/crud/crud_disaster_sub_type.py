@@ -19,6 +19,7 @@ class CRUDDisasterSubType(CRUDBase[DisasterSubType, DisasterSubTypeCreate, Disas
         )
         db.add(db_obj)
         db.commit()
+        self.notify_change(db_obj)
         db.refresh(db_obj)
         return db_obj
 
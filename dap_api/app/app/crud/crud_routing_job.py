@@ -0,0 +1,68 @@
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Optional
+
+from sqlalchemy.orm import Session
+
+from app.models import RoutingJob
+from app.schemas import RoutingJobCreate, JobStatus
+from .base import CRUDBase
+
+
+class CRUDRoutingJob(CRUDBase[RoutingJob, RoutingJobCreate, RoutingJobCreate]):
+    def get(self, db: Session, id: Any) -> Optional[RoutingJob]:
+        return db.query(RoutingJob).get(id)
+
+    def create(self, db: Session, *, obj_in: RoutingJobCreate) -> RoutingJob:
+        db_obj = RoutingJob(
+            id=uuid.uuid4().hex,
+            status=JobStatus.pending.value,
+            created=datetime.now(),
+            **obj_in.dict()
+        )
+        db.add(db_obj)
+        db.commit()
+        db.refresh(db_obj)
+        return db_obj
+
+    @staticmethod
+    def start(db: Session, *, db_obj: RoutingJob) -> RoutingJob:
+        db_obj.status = JobStatus.running.value
+        db_obj.started = datetime.now()
+        db.commit()
+        return db_obj
+
+    @staticmethod
+    def finish(db: Session, *, db_obj: RoutingJob, status_code: int, result: bytes, media_type: str) -> RoutingJob:
+        """
+        Stores the result of a job. Jobs succeed once ORS was queried, whatever the status code of the result.
+        """
+        db_obj.status = JobStatus.succeeded.value
+        db_obj.status_code = status_code
+        db_obj.result = result
+        db_obj.media_type = media_type
+        db_obj.finished = datetime.now()
+        db.commit()
+        return db_obj
+
+    @staticmethod
+    def fail(db: Session, *, db_obj: RoutingJob, error: str) -> RoutingJob:
+        db_obj.status = JobStatus.failed.value
+        db_obj.error = error
+        db_obj.finished = datetime.now()
+        db.commit()
+        return db_obj
+
+    @staticmethod
+    def remove_expired(db: Session, *, max_age: float) -> int:
+        """
+        Removes jobs created more than max_age seconds ago, including unfinished jobs of stopped processes
+        @return: number of removed jobs
+        """
+        removed = db.query(RoutingJob).filter(RoutingJob.created < datetime.now() - timedelta(seconds=max_age)) \
+            .delete(synchronize_session=False)
+        db.commit()
+        return removed
+
+
+routing_job = CRUDRoutingJob(RoutingJob)
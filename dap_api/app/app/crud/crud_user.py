@@ -30,6 +30,7 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
         )
         db.add(db_obj)
         db.commit()
+        self.notify_change(db_obj)
         db.refresh(db_obj)
         return db_obj
 
@@ -37,6 +38,7 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
         db_obj = User(**obj_in.dict())
         db.add(db_obj)
         db.commit()
+        self.notify_change(db_obj)
         db.refresh(db_obj)
         return db_obj
 
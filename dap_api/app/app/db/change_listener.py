@@ -0,0 +1,109 @@
+"""
+Listener for table changes published by the database
+
+Triggers on the tables used by caches publish every written row on the `table_changes` channel
+(see alembic revision 5b1e3d2c7a90). Each worker listens on a dedicated connection in a background
+thread and forwards the changes to the in-process change tracker, so caches of all workers are
+invalidated, no matter which worker or client wrote the change.
+"""
+import json
+import os
+import select
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from app.db.change_tracker import ChangeTracker, change_tracker
+from app.logger import logger
+
+CHANNEL = "table_changes"
+# tables with triggers publishing their changes
+TABLES = ["disaster_areas", "custom_speeds", "disaster_types", "providers"]
+# application name of the connections of this worker. Changes made through them are already
+# reported to the change tracker by the CRUD objects, so their notifications are skipped.
+ORIGIN = f"dap-api-{os.getpid()}"
+
+
+class ChangeListener:
+    def __init__(self, dsn: str, tracker: ChangeTracker = change_tracker, origin: str = ORIGIN,
+                 poll_timeout: float = 1.0, reconnect_delay: float = 5.0):
+        self.dsn = dsn
+        self.tracker = tracker
+        self.origin = origin
+        self.poll_timeout = poll_timeout
+        self.reconnect_delay = reconnect_delay
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.run, name="change-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run(self) -> None:
+        connected_before = False
+        while not self._stopped.is_set():
+            try:
+                connection = psycopg2.connect(self.dsn, application_name=f"{self.origin}-listener")
+            except psycopg2.Error as e:
+                logger.error(f"Change listener failed to connect: {e!r}")
+                self._stopped.wait(self.reconnect_delay)
+                continue
+            try:
+                connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHANNEL};")
+                if connected_before:
+                    # notifications sent while disconnected are lost
+                    for table in TABLES:
+                        self.tracker.notify(table)
+                connected_before = True
+                self.listen(connection)
+            except (psycopg2.Error, OSError) as e:
+                logger.error(f"Change listener lost connection: {e!r}")
+                self._stopped.wait(self.reconnect_delay)
+            finally:
+                connection.close()
+
+    def listen(self, connection) -> None:
+        while not self._stopped.is_set():
+            if select.select([connection], [], [], self.poll_timeout) == ([], [], []):
+                continue
+            connection.poll()
+            payloads = [n.payload for n in connection.notifies]
+            connection.notifies.clear()
+            self.handle(payloads)
+
+    def handle(self, payloads: Iterable[str]) -> None:
+        """
+        Reports the changes of a batch of notifications to the change tracker, one call per table
+        @param payloads: notification payloads with table, id and origin of a changed row
+        """
+        changes: Dict[str, Optional[List[int]]] = defaultdict(list)
+        for payload in payloads:
+            try:
+                change = json.loads(payload)
+                table = change["table"]
+            except (ValueError, KeyError, TypeError):
+                logger.error(f"Invalid change notification: {payload}")
+                continue
+            if change.get("origin") == self.origin:
+                continue
+            if change.get("id") is None or changes.get(table, []) is None:
+                # unknown rows, e.g. after TRUNCATE
+                changes[table] = None
+            else:
+                changes[table].append(change["id"])
+        for table, ids in changes.items():
+            self.tracker.notify(table, ids)
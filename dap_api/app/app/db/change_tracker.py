@@ -0,0 +1,62 @@
+"""
+In-process tracking of table changes
+
+Every write through the CRUD objects increments the version of the written table and calls the
+callbacks registered for it with the ids of the written rows. Caches use the versions to stamp
+their entries and the callbacks to drop or reload entries depending on a changed table.
+"""
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+from app.logger import logger
+
+
+class ChangeTracker:
+    def __init__(self):
+        self._versions: Dict[str, int] = defaultdict(int)
+        self._callbacks: Dict[str, List[Callable[[str, Optional[List[Any]]], None]]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def version(self, table: str) -> int:
+        return self._versions[table]
+
+    def stamp(self, *tables: str) -> Dict[str, int]:
+        """
+        Returns the current versions of the tables
+        @param tables: table names
+        @return: version by table name
+        """
+        return {table: self._versions[table] for table in tables}
+
+    def is_current(self, stamp: Dict[str, int]) -> bool:
+        """
+        Checks whether none of the tables in a stamp changed since it was taken
+        """
+        return all(self._versions[table] == version for table, version in stamp.items())
+
+    def subscribe(self, table: str, callback: Callable[[str, Optional[List[Any]]], None]) -> None:
+        """
+        Registers a callback that is called with the table name and the ids of the changed rows
+        whenever the table changes. The ids are None if they are unknown.
+        """
+        with self._lock:
+            self._callbacks[table].append(callback)
+
+    def notify(self, table: str, ids: Optional[List[Any]] = None) -> None:
+        """
+        Marks a table as changed
+        @param table: table name
+        @param ids: ids of the changed rows, None if unknown
+        """
+        with self._lock:
+            self._versions[table] += 1
+            callbacks = list(self._callbacks[table])
+        for callback in callbacks:
+            try:
+                callback(table, ids)
+            except Exception as e:
+                logger.error(f"Change callback for table {table} failed: {e!r}")
+
+
+change_tracker = ChangeTracker()
@@ -1,4 +1,4 @@
 # Import all the models, so that BaseTable has them before being
 # imported by Alembic
-from app.models import User, Provider, DisasterType, DisasterSubType, CustomSpeeds # noqa
+from app.models import User, Provider, DisasterType, DisasterSubType, CustomSpeeds, RoutingJob # noqa
 from .base import BaseTable  # noqa
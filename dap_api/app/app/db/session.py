@@ -2,12 +2,14 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
 from app.config import settings
+from app.db.change_listener import ORIGIN
 
 engine = create_engine(
     settings.SQLALCHEMY_DATABASE_URI,
     pool_timeout=60,
     pool_size=20,
-    max_overflow=50  #
+    max_overflow=50,
+    connect_args={"application_name": ORIGIN}
     # connect_args={"check_same_thread": False}  # only needed for SQLite DB
 )
 
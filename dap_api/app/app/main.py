@@ -11,6 +11,7 @@ from starlette.middleware.cors import CORSMiddleware
 
 from app.api.api_v1.api import api_router
 from app.config import settings
+from app.db.change_listener import ChangeListener
 
 api_description = """
 The HeiGIT disaster portal API manages features that can be used by applications or users
@@ -116,6 +117,20 @@ if settings.CORS_ORIGINS or settings.CORS_ORIGINS_REGEX:
 
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
+# forwards changes of other workers and clients to the in-process caches
+change_listener = ChangeListener(str(settings.SQLALCHEMY_DATABASE_URI))
+
+
+@app.on_event("startup")
+def start_change_listener():
+    if settings.DB_CHANGE_LISTENER_ENABLED:
+        change_listener.start()
+
+
+@app.on_event("shutdown")
+def stop_change_listener():
+    change_listener.stop()
+
 
 @app.get("/api/")
 def landing_page():
@@ -4,3 +4,4 @@ from .disaster_type import DisasterType
 from .disaster_sub_type import DisasterSubType
 from .disaster_areas import DisasterArea
 from .custom_speeds import CustomSpeeds
+from .routing_job import RoutingJob
@@ -2,8 +2,7 @@ from datetime import datetime
 from typing import TYPE_CHECKING
 
 from geoalchemy2 import Geometry, func
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Float
-from sqlalchemy.orm import validates
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Float, Index
 
 from app.db.base import BaseTable
 
@@ -25,12 +24,7 @@ class DisasterArea(BaseTable):
 
     geom = Column(Geometry('MULTIPOLYGON', srid=4326))
 
-    @validates("geom")
-    def validate_geometry(self, key, geom):
-        from app.db.session import SessionLocal
-        db = SessionLocal()
-        valid_check = db.query(func.ST_IsValidReason(geom)).first()[0]
-        db.close()
-        if valid_check != "Valid Geometry":
-            raise ValueError(f"Invalid geometry: {valid_check}")
-        return geom
+    __table_args__ = (
+        # distance lookups in meters (ST_DWithin on geography)
+        Index("idx_disaster_areas_geom_geography", func.geography(geom), postgresql_using="gist"),
+    )
@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, String, DateTime, LargeBinary
+from app.db.base import BaseTable
+
+
+class RoutingJob(BaseTable):
+    __tablename__ = "routing_jobs"
+
+    # random hex uuid, results are readable by anyone knowing the id
+    id = Column(String, primary_key=True, index=True)
+    status = Column(String, index=True, nullable=False)
+    portal_mode = Column(String, nullable=False)
+    ors_api = Column(String, nullable=False)
+    ors_profile = Column(String, nullable=False)
+    ors_response_type = Column(String, nullable=False)
+    request = Column(String, nullable=False)
+    status_code = Column(Integer)
+    media_type = Column(String)
+    result = Column(LargeBinary)
+    error = Column(String)
+    created = Column(DateTime, index=True, nullable=False)
+    started = Column(DateTime)
+    finished = Column(DateTime)
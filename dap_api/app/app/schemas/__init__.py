@@ -7,9 +7,11 @@ from .disaster_sub_type import DisasterSubType, DisasterSubTypeBase, DisasterSub
     DisasterSubTypeBaseInDBBase, DisasterSubTypeCreate, DisasterSubTypeUpdate
 from .disaster_area import DisasterArea, DisasterAreaBase, DisasterAreaCreate, DisasterAreaInDB, DisasterAreaUpdate, \
     DisasterAreaCreateOut, DisasterAreaInDBBase, DisasterAreaCollection, DisasterAreaPropertiesCreate, \
-    DisasterAreaPropertiesBase
+    DisasterAreaPropertiesBase, DisasterAreaReference, DisasterAreaReferences, \
+    DisasterAreaIngestResult, DisasterAreaIngestReport, DisasterAreaPage, FeatureStreamFormat
 from .custom_speeds import CustomSpeeds, CustomSpeedsOut, CustomSpeedsCreate, CustomSpeedsUpdate, \
     CustomSpeedsProperties, CustomSpeedsContent, RoadSpeeds, SurfaceSpeeds
 from .ors_request import ORSRequest, PathOptionsValidation, PathOptions, PortalOptions, ORSResponse, PortalMode, \
-    Options, OrsProfile, AvoidPolygons, OrsResponseType, OrsApi
+    Options, OrsProfile, AvoidPolygons, OrsResponseType, OrsApi, AreasResponseMode
 from .utils import CollectionMetadata, BadRequestResponse, HttpErrorResponse
+from .routing_job import RoutingJob, RoutingJobCreate, JobStatus
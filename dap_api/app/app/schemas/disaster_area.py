@@ -1,7 +1,7 @@
+from enum import Enum
 from sqlite3.dbapi2 import Timestamp
 from typing import Optional, List, Dict, Any
 
-from geoalchemy2 import func
 from pydantic import BaseModel, validator, root_validator
 
 
@@ -29,6 +29,12 @@ class Polygon(BaseModel):
     type: str = "Polygon"
     coordinates: List[List[List[float]]]
 
+    @validator("type")
+    def check_type(cls, t):
+        if t != "Polygon":
+            raise ValueError("type must be Polygon for polygon coordinates")
+        return t
+
     @validator("coordinates")
     def check_coordinates(cls, rings):
         check_polygon_rings(rings)
@@ -39,6 +45,12 @@ class MultiPolygon(BaseModel):
     type: str = "MultiPolygon"
     coordinates: List[List[List[List[float]]]]
 
+    @validator("type")
+    def check_type(cls, t):
+        if t != "MultiPolygon":
+            raise ValueError("type must be MultiPolygon for multipolygon coordinates")
+        return t
+
     @validator("coordinates")
     def check_coordinates(cls, polygons):
         for rings in polygons:
@@ -89,6 +101,21 @@ class BBoxModel(BaseModel):
         return values
 
 
+class LookupGeometry(BaseModel):
+    """
+    Point or line around which disaster areas are looked up
+    """
+    coordinates: List[List[float]]
+    distance: float  # in meters
+
+    @property
+    def wkt(self) -> str:
+        points = ", ".join(f"{c[0]} {c[1]}" for c in self.coordinates)
+        if len(self.coordinates) == 1:
+            return f"POINT({points})"
+        return f"LINESTRING({points})"
+
+
 class DisasterAreaPropertiesBase(BaseModel):
     name: Optional[str] = None
     provider_id: Optional[int] = None
@@ -115,17 +142,6 @@ class DisasterAreaCreate(DisasterAreaBase):
     geometry: Polygon | MultiPolygon
     properties: DisasterAreaPropertiesCreate
 
-    @validator("geometry")
-    def check_validity(cls, geometry):
-        from app.db.session import SessionLocal
-        db = SessionLocal()
-        geom = func.ST_GeomFromGeoJSON(geometry.json())
-        valid_check = db.query(func.ST_IsValidReason(geom)).first()[0]
-        db.close()
-        if valid_check != "Valid Geometry":
-            raise ValueError(f"Geometry not valid: {valid_check}")
-        return geometry
-
 
 class DisasterAreaPropertiesCreateOut(DisasterAreaPropertiesCreate):
     created: Timestamp
@@ -167,3 +183,42 @@ class DisasterAreaCollection(BaseModel):
     type: str = "FeatureCollection"
     features: List[DisasterArea]
     bbox: BBoxModel
+
+
+# Schema for a page of the disaster area listing, the next link continues after the last feature
+class DisasterAreaPage(DisasterAreaCollection):
+    links: List[Dict[str, Any]] = []
+
+
+class FeatureStreamFormat(str, Enum):
+    feature_collection = "geojson"
+    sequence = "geojson-seq"
+
+
+class DisasterAreaReference(BaseModel):
+    id: int
+    bbox: BBoxModel
+
+
+# Schema for compact references to the areas of a collection
+class DisasterAreaReferences(BaseModel):
+    type: str = "DisasterAreaReferences"
+    version: str
+    areas: List[DisasterAreaReference]
+    bbox: BBoxModel
+
+
+class DisasterAreaIngestResult(BaseModel):
+    index: int  # position of the feature in the upload
+    id: Optional[int] = None
+    name: Optional[str] = None
+    code: Optional[int] = None
+    message: Optional[str] = None
+
+
+# Schema for the per-feature report of a bulk ingestion
+class DisasterAreaIngestReport(BaseModel):
+    type: str = "DisasterAreaIngestReport"
+    created: int
+    failed: int
+    results: List[DisasterAreaIngestResult]
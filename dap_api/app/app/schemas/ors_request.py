@@ -1,8 +1,8 @@
 from enum import Enum
-from typing import Optional
+from typing import Optional, Dict
 
 from dateutil.parser import isoparse
-from pydantic import BaseModel, Extra, conint, conlist, Field, validator
+from pydantic import BaseModel, Extra, conint, confloat, conlist, Field, validator
 
 from app.schemas import CustomSpeedsContent
 from app.schemas.disaster_area import BBoxModel
@@ -37,6 +37,11 @@ class OrsResponseType(str, Enum):
     gpx = "gpx"
 
 
+class AreasResponseMode(str, Enum):
+    full = "full"
+    compact = "compact"
+
+
 class OrsIsochroneRangeType(str, Enum):
     time = "time"
     distance = "distance"
@@ -90,10 +95,25 @@ class DisasterAreaFilter(BaseModel):
 class PortalOptions(BaseModel):
     debug: Optional[bool] = False
     return_areas_in_response: Optional[bool] = False
+    areas_response_mode: AreasResponseMode = Field(AreasResponseMode.full,
+                                                   description='Format of the disaster areas returned with '
+                                                               'return_areas_in_response. "compact" only returns '
+                                                               'the ids and bboxes of the areas and a version tag '
+                                                               'of the returned set.')
+    areas_simplify_tolerance: Optional[confloat(gt=0)] = Field(None, description='Simplifies the returned disaster '
+                                                                                 'area geometries with this '
+                                                                                 'tolerance in degrees.')
     bounds_looseness: Optional[conint(ge=0, le=200)] = 0
     generate_difference: Optional[bool] = Field(False, description='Generates difference between requests with and '
                                                                    'without avoid areas. Uses up 2 ORS requests.')
     disaster_area_filter: DisasterAreaFilter | None = DisasterAreaFilter()
+    avoid_vertex_budget: Optional[conint(ge=100)] = Field(None, description='Maximum number of disaster area '
+                                                                            'vertices added to the avoid polygons. '
+                                                                            'Areas are simplified to meet the '
+                                                                            'budget. Capped by the server limit.')
+    strip_avoid_areas: Optional[bool] = Field(True, description='Removes the disaster areas added to the avoid '
+                                                                'polygons from the query in the response metadata. '
+                                                                'Only the number of removed polygons is reported.')
     ors_server: str | None = None
 
 
@@ -177,5 +197,6 @@ class ORSDirections(ORSRequest):
 
 class ORSResponse(BaseModel):
     status_code: int
-    body: str
+    body: bytes
     media_type: str
+    headers: Dict[str, str] = {}
@@ -0,0 +1,39 @@
+from datetime import datetime
+from enum import Enum
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class JobStatus(str, Enum):
+    pending = "pending"
+    running = "running"
+    succeeded = "succeeded"
+    failed = "failed"
+
+
+# Properties to receive on creation
+class RoutingJobCreate(BaseModel):
+    portal_mode: str
+    ors_api: str
+    ors_profile: str
+    ors_response_type: str
+    request: str
+
+
+# Properties to return via API
+class RoutingJob(BaseModel):
+    id: str
+    status: JobStatus
+    portal_mode: str
+    ors_api: str
+    ors_profile: str
+    ors_response_type: str
+    status_code: Optional[int]
+    error: Optional[str]
+    created: datetime
+    started: Optional[datetime]
+    finished: Optional[datetime]
+
+    class Config:
+        orm_mode = True
@@ -1,3 +1,4 @@
+import json
 from datetime import datetime, timedelta
 from typing import List, Dict
 
@@ -6,7 +7,11 @@ from fastapi.testclient import TestClient
 from sqlalchemy.orm import Session
 
 from app import crud
+from app.api import deps
+from app.api.api_v1.endpoints import disaster_areas
+from app.backend.tile_cache import TileCache
 from app.config import settings
+from app.db.change_tracker import change_tracker
 from app.schemas.disaster_area import DisasterAreaPropertiesCreate
 from app.tests.utils.disaster_areas import create_new_disaster_area
 from app.tests.utils.disaster_areas import create_new_polygon, create_new_properties
@@ -103,6 +108,31 @@ def test_create_d_area_invalid_geom(
     assert r_obj["detail"][0]["msg"] == e_msg
 
 
+def test_create_d_area_invalid_geom_postgis(
+        client: TestClient, db: Session,
+        admin_auth_header: Dict[str, str],
+        mocker
+) -> None:
+    mocker.patch.object(settings, "DISASTER_AREA_VALIDATION_IN_PROCESS", False)
+    new_props = create_new_properties()
+    data = {
+        "type": "Feature",
+        "properties": new_props.dict(),
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [[[0, 0], [0, 1], [1, 0], [1, 1], [0, 0]]]
+        }
+    }
+    r = client.post(
+        f"{settings.API_V1_STR}/collections/disaster_areas/items", json=data, headers=admin_auth_header
+    )
+    r_obj = r.json()
+    assert r.status_code == 422
+    assert r_obj["detail"][0]["loc"] == ["body", "geometry"]
+    assert r_obj["detail"][0]["msg"] == "Geometry not valid: Self-intersection[0.5 0.5]"
+    assert not crud.disaster_area.get_by_name(db, name=new_props.name)
+
+
 def test_create_d_area_existing_name(
         client: TestClient, db: Session,
         admin_auth_header: Dict[str, str]
@@ -159,6 +189,49 @@ def test_create_d_area_missing_name(
     assert r_obj["detail"][0]["msg"] == "field required"
 
 
+def test_create_d_areas_bulk(
+        client: TestClient, db: Session,
+        admin_auth_header: Dict[str, str]
+) -> None:
+    d_area = create_new_disaster_area(db)
+    features = [
+        {"type": "Feature", "properties": create_new_properties().dict(), "geometry": create_new_polygon().dict()},
+        {"type": "Feature", "properties": create_new_properties(name=d_area.name).dict(),
+         "geometry": create_new_polygon().dict()},
+        {"type": "Feature", "properties": create_new_properties(p_id=-1).dict(),
+         "geometry": create_new_polygon().dict()}
+    ]
+    r = client.post(f"{settings.API_V1_STR}/collections/disaster_areas/items/bulk",
+                    json={"type": "FeatureCollection", "features": features}, headers=admin_auth_header)
+    report = r.json()
+    assert r.status_code == 200
+    assert report["created"] == 1
+    assert report["failed"] == 2
+    assert [result["code"] for result in report["results"]] == [None, 5409, 2404]
+    assert crud.disaster_area.get(db, report["results"][0]["id"]).name == features[0]["properties"]["name"]
+
+
+def test_create_d_areas_bulk_sequence(
+        client: TestClient, db: Session,
+        admin_auth_header: Dict[str, str]
+) -> None:
+    features = [
+        {"type": "Feature", "properties": create_new_properties().dict(), "geometry": create_new_polygon().dict()}
+        for _ in range(3)
+    ]
+    r = client.post(f"{settings.API_V1_STR}/collections/disaster_areas/items/bulk",
+                    data="".join(f"\x1e{json.dumps(f)}\n" for f in features),
+                    headers={**admin_auth_header, "Content-Type": "application/geo+json-seq"})
+    report = r.json()
+    assert r.status_code == 200
+    assert report["created"] == 3
+    assert [result["name"] for result in report["results"]] == [f["properties"]["name"] for f in features]
+
+    r = client.post(f"{settings.API_V1_STR}/collections/disaster_areas/items/bulk",
+                    data="{", headers={**admin_auth_header, "Content-Type": "application/geo+json-seq"})
+    assert r.status_code == 400
+
+
 def test_get_existing_d_area(
         client: TestClient, db: Session
 ) -> None:
@@ -223,6 +296,21 @@ def test_update_existing_d_area_geometry(
     assert r.json()["geometry"] != d_area_feature.geometry.json()
 
 
+def test_update_d_area_invalid_geometry(
+        client: TestClient, db: Session,
+        admin_auth_header: Dict[str, str]
+) -> None:
+    d_area = create_new_disaster_area(db)
+    data = {"geometry": {"type": "Polygon", "coordinates": [[[0, 0], [0, 1], [1, 0], [1, 1], [0, 0]]]}}
+    r = client.put(f"{settings.API_V1_STR}/collections/disaster_areas/items/{d_area.id}",
+                   json=data,
+                   headers=admin_auth_header)
+    r_obj = r.json()
+    assert r.status_code == 422
+    assert r_obj["detail"][0]["loc"] == ["body", "geometry"]
+    assert r_obj["detail"][0]["msg"] == "Geometry not valid: Self-intersection[0.5 0.5]"
+
+
 def test_update_not_existing_d_area(
         client: TestClient,
         admin_auth_header: Dict[str, str]
@@ -277,6 +365,73 @@ def test_retrieve_d_areas(
         assert "id" in area
 
 
+def test_retrieve_d_areas_pages(
+        client: TestClient, db: Session
+) -> None:
+    d_areas = [create_new_disaster_area(db) for _ in range(3)]
+    ids = []
+    url = f"{settings.API_V1_STR}/collections/disaster_areas/items?limit=2"
+    while url:
+        r = client.get(url)
+        assert r.status_code == 200
+        page = r.json()
+        ids += [f["id"] for f in page["features"]]
+        url = next((link["href"] for link in page["links"] if link["rel"] == "next"), None)
+    assert all(a.id in ids for a in d_areas)
+    assert ids == sorted(set(ids))
+
+    r = client.get(f"{settings.API_V1_STR}/collections/disaster_areas/items", params={"cursor": "invalid"})
+    assert r.status_code == 422
+    assert r.json()["detail"][0]["loc"] == ["query", "cursor"]
+
+
+def test_retrieve_d_areas_streamed(
+        client: TestClient, db: Session
+) -> None:
+    d_areas = [create_new_disaster_area(db) for _ in range(3)]
+    paged = client.get(f"{settings.API_V1_STR}/collections/disaster_areas/items", params={"limit": 1000}).json()
+
+    r = client.get(f"{settings.API_V1_STR}/collections/disaster_areas/items", params={"stream": "geojson"})
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/geo+json"
+    streamed = r.json()
+    assert [f["id"] for f in streamed["features"]] == [f["id"] for f in paged["features"]]
+    assert streamed["bbox"] == paged["bbox"]
+
+    r = client.get(f"{settings.API_V1_STR}/collections/disaster_areas/items",
+                   params={"stream": "geojson-seq", "cursor": deps.encode_cursor(d_areas[0].id)})
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/geo+json-seq"
+    features = [json.loads(line.lstrip("\x1e")) for line in r.text.splitlines()]
+    assert [f["id"] for f in features] == [a.id for a in d_areas[1:]]
+
+
+def test_retrieve_d_area_tiles(
+        client: TestClient, db: Session, mocker
+) -> None:
+    tile_cache = mocker.patch.object(disaster_areas, "tile_cache", TileCache(tracker=change_tracker))
+    url = f"{settings.API_V1_STR}/collections/disaster_areas/tiles/10/536/349"
+    r = client.get(url)
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/vnd.mapbox-vector-tile"
+    assert client.get(url).content == r.content
+    assert tile_cache.hits == 1
+
+    # a new area in the footprint of the tile invalidates it
+    d_area = create_new_disaster_area(db, [8.5, 49.5], f=0.01)
+    r2 = client.get(url)
+    assert r2.content != r.content
+    assert tile_cache.hits == 1
+    crud.disaster_area.remove(db, id=d_area.id)
+    assert client.get(url).content == r.content
+
+    r = client.get(f"{settings.API_V1_STR}/collections/disaster_areas/tiles/1/2/0")
+    assert r.status_code == 404
+    r = client.get(f"{settings.API_V1_STR}/collections/disaster_areas/tiles/10/536/349", params={"d_type_id": 99999})
+    assert r.status_code == 400
+    assert r.json()["code"] == 3404
+
+
 def test_retrieve_d_areas_of_type(
         client: TestClient, db: Session
 ) -> None:
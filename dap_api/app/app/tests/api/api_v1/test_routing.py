@@ -352,6 +352,35 @@ def test_isochrones_api_post(
     assert len(result) > 0
 
 
+# ---------------------------------- batch ----------------------------------
+
+
+def test_routing_api_post_batch(
+    client: TestClient
+) -> None:
+    directions = {"coordinates": [[8.678613, 49.411721], [8.687782, 49.424597]], "portal_options": {"debug": True}}
+    isochrones = {"locations": [[8.678613, 49.411721]], "range": [300], "portal_options": {"debug": True}}
+    r = client.post(
+        f"{settings.API_V1_STR}/routing/avoid_areas/directions/driving-car/batch", json=[directions, isochrones],
+        headers={"ORS-Authorization": "An API key"}
+    )
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/x-ndjson"
+    lines = sorted([json.loads(line) for line in r.text.splitlines()], key=lambda line: line["index"])
+    assert [line["status_code"] for line in lines] == [200, 400]
+    assert lines[0]["body"]["coordinates"] == directions["coordinates"]
+
+
+def test_routing_api_post_batch_empty(
+    client: TestClient
+) -> None:
+    r = client.post(
+        f"{settings.API_V1_STR}/routing/avoid_areas/directions/driving-car/batch", json=[],
+        headers={"ORS-Authorization": "An API key"}
+    )
+    assert r.status_code == 422
+
+
 # ---------------------------------- HTTP GET validation ----------------------------------
 
 INVALID_ENUM_VALUE_MESSAGE = "value is not a valid enumeration member; permitted: "
@@ -0,0 +1,75 @@
+import time
+
+from fastapi.testclient import TestClient
+
+from app.config import settings
+
+
+def wait_for_job(client: TestClient, job_id: str) -> dict:
+    for _ in range(100):
+        job = client.get(f"{settings.API_V1_STR}/routing/jobs/{job_id}").json()
+        if job["status"] in ["succeeded", "failed"]:
+            return job
+        time.sleep(0.05)
+    return job
+
+
+def test_routing_job(
+    client: TestClient
+) -> None:
+    data = {
+        "coordinates": [[8.678613, 49.411721], [8.687782, 49.424597]],
+        "portal_options": {"debug": True}
+    }
+    r = client.post(
+        f"{settings.API_V1_STR}/routing/jobs/avoid_areas/directions/driving-car", json=data,
+        headers={"ORS-Authorization": "An API key"}
+    )
+    assert r.status_code == 202
+    job = r.json()
+    assert job["status"] == "pending"
+    assert job["ors_response_type"] == "json"
+    assert r.headers["location"] == f"{settings.API_V1_STR}/routing/jobs/{job['id']}"
+
+    job = wait_for_job(client, job["id"])
+    assert job["status"] == "succeeded"
+    assert job["status_code"] == 200
+    r = client.get(f"{settings.API_V1_STR}/routing/jobs/{job['id']}/result")
+    assert r.status_code == 200
+    assert r.json()["coordinates"] == data["coordinates"]
+
+
+def test_routing_batch_job(
+    client: TestClient
+) -> None:
+    data = [{"coordinates": [[8.678613, 49.411721], [8.687782, 49.424597]], "portal_options": {"debug": True}}] * 3
+    r = client.post(
+        f"{settings.API_V1_STR}/routing/jobs/avoid_areas/directions/driving-car/batch", json=data,
+        headers={"ORS-Authorization": "An API key"}
+    )
+    assert r.status_code == 202
+    job = wait_for_job(client, r.json()["id"])
+    assert job["status"] == "succeeded"
+    r = client.get(f"{settings.API_V1_STR}/routing/jobs/{job['id']}/result")
+    assert r.headers["content-type"] == "application/x-ndjson"
+    assert len(r.text.splitlines()) == 3
+
+
+def test_routing_job_api_mismatch(
+    client: TestClient
+) -> None:
+    data = {"locations": [[8.678613, 49.411721]], "range": [300]}
+    r = client.post(
+        f"{settings.API_V1_STR}/routing/jobs/avoid_areas/directions/driving-car", json=data,
+        headers={"ORS-Authorization": "An API key"}
+    )
+    assert r.status_code == 400
+
+
+def test_routing_job_not_found(
+    client: TestClient
+) -> None:
+    r = client.get(f"{settings.API_V1_STR}/routing/jobs/unknown")
+    assert r.status_code == 404
+    r = client.get(f"{settings.API_V1_STR}/routing/jobs/unknown/result")
+    assert r.status_code == 404
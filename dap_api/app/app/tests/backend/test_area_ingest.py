@@ -0,0 +1,102 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from pytest_mock import MockerFixture
+
+from app import crud
+from app.backend.area_ingest import parse_feature_collection, read_feature_sequence, ingest_disaster_areas
+from app.config import settings
+
+
+def feature(name: str, provider_id: int = 1, d_type_id: int = 1, ds_type_id: int = None,
+            coordinates: list = None) -> dict:
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Polygon", "coordinates": coordinates or [[[0, 0], [0, 1], [1, 1], [0, 0]]]},
+        "properties": {"name": name, "provider_id": provider_id, "d_type_id": d_type_id, "ds_type_id": ds_type_id}
+    }
+
+
+async def chunked(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def mock_crud(mocker: MockerFixture, existing_names=(), taken_names=()) -> dict:
+    """Mocks the lookups and the bulk creation, returns the created areas by index"""
+    created = {}
+
+    def create_bulk(db, objs_in):
+        for i, obj_in in objs_in.items():
+            if obj_in.properties.name not in taken_names:
+                created[i] = 100 + i
+        return created, {}
+
+    mocker.patch.object(crud.provider, "get_multi_by_ids", side_effect=lambda db, ids: [
+        SimpleNamespace(id=i, owner_id=i, email=f"{i}@example.org") for i in set(ids) if i in (1, 2)])
+    mocker.patch.object(crud.disaster_type, "get_multi_by_ids",
+                        side_effect=lambda db, ids: [SimpleNamespace(id=i) for i in set(ids) if i < 10])
+    mocker.patch.object(crud.disaster_sub_type, "get_multi_by_ids",
+                        side_effect=lambda db, ids: [SimpleNamespace(id=i) for i in set(ids) if i < 10])
+    mocker.patch.object(crud.disaster_area, "get_existing_names",
+                        side_effect=lambda db, names: set(names) & set(existing_names))
+    mocker.patch.object(crud.disaster_area, "create_bulk", side_effect=create_bulk)
+    return created
+
+
+class TestAreaIngest:
+    def test_parse_feature_collection(self):
+        features = [feature("a"), feature("b")]
+        assert parse_feature_collection(json.dumps({"type": "FeatureCollection", "features": features}).encode(),
+                                        2) == features
+        with pytest.raises(ValueError):
+            parse_feature_collection(json.dumps({"type": "FeatureCollection", "features": features}).encode(), 1)
+        with pytest.raises(ValueError):
+            parse_feature_collection(json.dumps(features).encode(), 2)
+
+    @pytest.mark.parametrize("chunk_size", [1, 7, 100000])
+    @pytest.mark.parametrize("separator", [b"\n", b"\x1e", b"\r\n"])
+    async def test_read_feature_sequence(self, chunk_size, separator):
+        features = [feature("a"), feature("b"), feature("c")]
+        data = b"".join((b"\x1e" if separator == b"\x1e" else b"") + json.dumps(f).encode() +
+                        (b"\n" if separator == b"\x1e" else separator) for f in features)
+        assert await read_feature_sequence(chunked(data, chunk_size), 3) == features
+        with pytest.raises(ValueError):
+            await read_feature_sequence(chunked(data, chunk_size), 2)
+
+    async def test_read_invalid_feature_sequence(self):
+        with pytest.raises(ValueError, match="Feature 1"):
+            await read_feature_sequence(chunked(b'{"a": 1}\n{"b": \n', 4), 10)
+
+    @pytest.mark.parametrize("in_process", [True, False])
+    def test_ingest(self, mocker: MockerFixture, in_process):
+        mocker.patch.object(settings, "DISASTER_AREA_VALIDATION_IN_PROCESS", in_process)
+        mocker.patch.object(settings, "DISASTER_AREA_INGEST_BATCH_SIZE", 2)
+        created = mock_crud(mocker, existing_names=["existing"], taken_names=["taken"])
+        features = [
+            feature("a"),
+            feature("b", provider_id=3),
+            feature("c", provider_id=2),
+            feature("d", d_type_id=11),
+            feature("e", ds_type_id=12),
+            feature("a"),
+            feature("existing"),
+            {"type": "Feature", "properties": {"name": "f"}},
+            feature("taken"),
+            feature("g", coordinates=[[[0, 0], [0, 1], [1, 0], [1, 1], [0, 0]]]),
+            feature("h", ds_type_id=2),
+            {**feature("i"), "geometry": {"type": "LineString", "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 0]]]}}
+        ]
+        user = SimpleNamespace(id=1, is_admin=False)
+        report = ingest_disaster_areas(None, features, user)
+
+        codes = [r.code for r in report.results]
+        # without in-process validation the mocked database accepts the invalid geometry
+        assert codes == [None, 2404, 2403, 3404, 4404, 5409, 5409, 5422, 5409, 5422 if in_process else None, None,
+                         5422]
+        assert [r.index for r in report.results] == list(range(len(features)))
+        assert report.results[0].id == created[0]
+        assert report.results[9].message == ("Geometry not valid: Self-intersection[0.5 0.5]" if in_process else None)
+        assert report.created == len(created)
+        assert report.failed == len(features) - len(created)
@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from pytest_mock import MockerFixture
+
+from app.backend.base import BaseProcessor, server_timing_header
+
+
+def delayed_relay(delays: dict, cancelled: list):
+    """Returns a relay mock answering with the status code after the delay of the requested path"""
+    async def relay(path, header, body, base_path=None):
+        status_code, delay = delays[path]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(path)
+            raise
+        return httpx.Response(status_code)
+    return relay
+
+
+class TestBaseProcessor:
+    async def test_get_client_pooled_per_backend(self):
+        processor = BaseProcessor("http://backend1")
+        default_client = processor.get_client()
+        assert processor.get_client("http://backend1") is default_client
+        assert processor.get_client("http://backend2") is not default_client
+        await processor.close()
+        assert default_client.is_closed
+        assert processor.get_client() is not default_client
+        await processor.close()
+
+    async def test_relay_request_post(self, mocker: MockerFixture):
+        mock_post = mocker.patch('httpx.AsyncClient.post', new_callable=mocker.AsyncMock)
+        processor = BaseProcessor("http://backend1")
+        await processor.relay_request_post("/path", {"Accept": "application/json"}, {"a": 1})
+        await processor.relay_request_post("/path", {}, {}, base_path="http://backend2")
+        assert mock_post.call_args_list[0].kwargs["url"] == "http://backend1/path"
+        assert mock_post.call_args_list[0].kwargs["content"] == b'{"a":1}'
+        assert mock_post.call_args_list[0].kwargs["headers"] == {"Content-Type": "application/json",
+                                                                 "Accept": "application/json"}
+        assert mock_post.call_args_list[1].kwargs["url"] == "http://backend2/path"
+        await processor.close()
+
+    @pytest.mark.parametrize(
+        "error,status_code", [
+            (httpx.ConnectError("connection refused"), 500),
+            (httpx.ReadTimeout("timed out"), 504)
+        ])
+    async def test_relay_request_post_errors(self, mocker: MockerFixture, error, status_code):
+        mocker.patch('httpx.AsyncClient.post', new_callable=mocker.AsyncMock, side_effect=error)
+        processor = BaseProcessor("http://backend1")
+        with pytest.raises(HTTPException) as e:
+            await processor.relay_request_post("/path", {}, {})
+        assert e.value.status_code == status_code
+        await processor.close()
+
+    async def test_relay_requests_post_concurrently(self, mocker: MockerFixture):
+        processor = BaseProcessor("http://backend1")
+        mocker.patch.object(processor, "relay_request_post", delayed_relay({"/a": (200, 0.2), "/b": (200, 0.2)}, []))
+        timings = {}
+        start = time.perf_counter()
+        responses = await processor.relay_requests_post({"a": ("/a", {}, {}), "b": ("/b", {}, {})}, timings=timings)
+        assert time.perf_counter() - start < 0.35
+        assert [responses[k].status_code for k in ["a", "b"]] == [200, 200]
+        assert set(timings.keys()) == {"a", "b"}
+        assert all(t >= 200 for t in timings.values())
+
+    async def test_relay_requests_post_cancel_on_error_status(self, mocker: MockerFixture):
+        processor = BaseProcessor("http://backend1")
+        cancelled = []
+        mocker.patch.object(processor, "relay_request_post", delayed_relay({"/a": (500, 0), "/b": (200, 5)}, cancelled))
+        responses = await processor.relay_requests_post({"a": ("/a", {}, {}), "b": ("/b", {}, {})})
+        await asyncio.sleep(0)
+        assert list(responses.keys()) == ["a"]
+        assert responses["a"].status_code == 500
+        assert cancelled == ["/b"]
+
+    async def test_relay_requests_post_cancel_on_exception(self, mocker: MockerFixture):
+        processor = BaseProcessor("http://backend1")
+        cancelled = []
+        relay = delayed_relay({"/b": (200, 5)}, cancelled)
+
+        async def failing_relay(path, header, body, base_path=None):
+            if path == "/a":
+                raise HTTPException(status_code=500, detail="Connection to backend failed")
+            return await relay(path, header, body, base_path)
+
+        mocker.patch.object(processor, "relay_request_post", failing_relay)
+        with pytest.raises(HTTPException):
+            await processor.relay_requests_post({"a": ("/a", {}, {}), "b": ("/b", {}, {})})
+        await asyncio.sleep(0)
+        assert cancelled == ["/b"]
+
+
+def test_server_timing_header():
+    assert server_timing_header({}) == {}
+    assert server_timing_header({"relay": 12.3, "relay_no_avoid": 10.0}) == {
+        "Server-Timing": "relay;dur=12.3, relay_no_avoid;dur=10.0"
+    }
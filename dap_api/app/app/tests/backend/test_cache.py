@@ -0,0 +1,73 @@
+import time
+
+from app.backend.cache import ResponseCache, cache_key
+from app.db.change_tracker import ChangeTracker
+
+
+class TestResponseCache:
+    def test_get_set(self):
+        cache = ResponseCache(tracker=ChangeTracker())
+        assert cache.get("a") is None
+        cache.set("a", "value", size=5, stamp={})
+        assert cache.get("a") == "value"
+        assert cache.hits == 1
+        assert cache.misses == 1
+        assert cache.size == 5
+
+    def test_lru_eviction_by_entries(self):
+        cache = ResponseCache(max_entries=2, tracker=ChangeTracker())
+        cache.set("a", 1, size=1, stamp={})
+        cache.set("b", 2, size=1, stamp={})
+        cache.get("a")
+        cache.set("c", 3, size=1, stamp={})
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert cache.evictions == 1
+
+    def test_eviction_by_bytes(self):
+        cache = ResponseCache(max_bytes=10, tracker=ChangeTracker())
+        cache.set("a", 1, size=6, stamp={})
+        cache.set("b", 2, size=6, stamp={})
+        assert cache.get("a") is None
+        assert cache.get("b") == 2
+        assert cache.size == 6
+        # values larger than the budget are not cached at all
+        cache.set("c", 3, size=11, stamp={})
+        assert cache.get("c") is None
+        assert cache.get("b") == 2
+
+    def test_ttl(self):
+        cache = ResponseCache(ttl=0.05, tracker=ChangeTracker())
+        cache.set("a", 1, size=1, stamp={})
+        assert cache.get("a") == 1
+        time.sleep(0.06)
+        assert cache.get("a") is None
+        assert cache.size == 0
+
+    def test_invalidation(self):
+        tracker = ChangeTracker()
+        cache = ResponseCache(tracker=tracker)
+        cache.set("areas", 1, size=1, stamp=tracker.stamp("disaster_areas"))
+        cache.set("speeds", 2, size=1, stamp=tracker.stamp("custom_speeds"))
+        cache.set("none", 3, size=1, stamp=tracker.stamp())
+        tracker.notify("disaster_areas")
+        assert cache.get("areas") is None
+        assert cache.get("speeds") == 2
+        assert cache.get("none") == 3
+        assert cache.invalidations == 1
+
+    def test_outdated_stamp(self):
+        tracker = ChangeTracker()
+        cache = ResponseCache(tracker=tracker)
+        # the table changed while the value was computed
+        stamp = tracker.stamp("disaster_areas")
+        tracker.notify("disaster_areas")
+        cache.set("areas", 1, size=1, stamp=stamp)
+        assert cache.get("areas") is None
+
+
+def test_cache_key():
+    assert cache_key({"a": 1, "b": [1, 2]}, "/directions") == cache_key({"b": [1, 2], "a": 1}, "/directions")
+    assert cache_key({"a": 1}, "/directions") != cache_key({"a": 1}, "/isochrones")
+    assert cache_key({"a": 1}, None) != cache_key({"a": 2}, None)
@@ -1,5 +1,7 @@
 import pytest
+from pytest_mock import MockerFixture
 from app.backend.geoutil import *
+from app.schemas.disaster_area import LookupGeometry
 from app.tests.backend.util_test_data import basic_directions_json_item, basic_directions_geojson_item, \
     basic_isochrones_item
 
@@ -11,6 +13,33 @@ def _get_clauses(f: Function, level: int = 0):
         return _get_clauses(f.clauses.clauses[0], level - 1)
 
 
+VALIDITY_CASES = [
+    ({"type": "Polygon", "coordinates": [[[0, 0], [0, 1], [1, 1], [0, 0]]]}, "Valid Geometry"),
+    ({"type": "Polygon", "coordinates": [[[0, 0], [0, 1], [1, 0], [1, 1], [0, 0]]]}, "Self-intersection[0.5 0.5]"),
+    ({"type": "Polygon", "coordinates": [[[0, 0], [0, 2], [2, 2], [2, 0], [0, 0]],
+                                         [[3, 3], [3, 4], [4, 4], [4, 3], [3, 3]]]}, "Hole lies outside shell[3 3]"),
+    ({"type": "MultiPolygon", "coordinates": [[[[0, 0], [0, 2], [2, 2], [2, 0], [0, 0]]],
+                                              [[[1, 1], [1, 3], [3, 3], [3, 1], [1, 1]]]]}, "Self-intersection[1 2]")
+]
+
+
+def long_segment_lookup() -> (LookupGeometry, List[shapely.Point], List[int]):
+    """
+    Lookup along a segment of 570 km and points at offsets in meters north of its great circle arc
+    """
+    lookup = LookupGeometry(coordinates=[[0, 50], [8, 50]], distance=1000)
+    points, offsets = [], []
+    for lon in [0.5, 2, 4, 6, 7.5]:
+        # latitude of the great circle arc at the longitude
+        lat = math.degrees(math.atan(math.tan(math.radians(50)) * math.cos(math.radians(lon - 4))
+                                     / math.cos(math.radians(4))))
+        for offset in [-1600, -1200, -800, -400, 0, 400, 800, 1200, 1600]:
+            p = geopy.distance.geodesic(meters=abs(offset)).destination((lat, lon), 0 if offset >= 0 else 180)
+            points.append(shapely.Point(p.longitude, p.latitude))
+            offsets.append(offset)
+    return lookup, points, offsets
+
+
 class TestGeoUtil:
     @pytest.mark.parametrize(
         "lon,lat,bearing,distance,out",
@@ -76,6 +105,25 @@ class TestGeoUtil:
         bbox = bbox_from_radius(lon, lat, r)
         assert bbox == out
 
+    def test_bboxes_from_radius(self):
+        lons = [0, 2, 8.681495, 179.9, 10]
+        lats = [0, 2, 49.41461, 10, -89.95]
+        radius = [200000, 200000, 20, 50000, 30000]
+        bboxes = bboxes_from_radius(lons, lats, radius)
+        assert bboxes.shape == (5, 4)
+        assert bboxes[:3].tolist() == [[-1.7966306, -1.8087329, 1.7966306, 1.8087329],
+                                       [0.2022824, 0.1912692, 3.7977176, 3.8086908],
+                                       [8.6812194, 49.4144302, 8.6817706, 49.4147898]]
+        assert bboxes_from_radius(lons, lats, 1000).shape == (5, 4)
+
+    def test_destinations_match_geopy(self):
+        lons, lats = np.array([8.681495, -70.5, 150.1]), np.array([49.41461, -60.2, 1.5])
+        for bearing in [0, 30, 90, 180, 270]:
+            points = destinations(lons, lats, bearing, 12345.6)
+            expected = [geopy.distance.geodesic(meters=12345.6).destination(geopy.Point(lat, lon), bearing)
+                        for lon, lat in zip(lons, lats)]
+            assert np.abs(points - np.array([[p.longitude, p.latitude] for p in expected])).max() < 1e-9
+
     @pytest.mark.parametrize(
         "seconds,speed,out",
         [(0, 100, 0),
@@ -127,6 +175,46 @@ class TestGeoUtil:
         assert _get_clauses(query, 1)[0].description == "ST_Difference"
         assert _get_clauses(query, 3)[0].value == avoid_item.get("geometry")
 
+    def test_build_batch_diff_query_geojson(self, db: Session):
+        avoid_items = [
+            basic_isochrones_item(geom={"type": "Polygon", "coordinates": [[[0, 0], [0, 1], [1, 1], [1, 0], [0, 0]]]}),
+            basic_isochrones_item(geom={"type": "Polygon", "coordinates": [[[0, 0], [0, 2], [1, 2], [1, 0], [0, 0]]]})
+        ]
+        items = [
+            basic_isochrones_item(geom={"type": "Polygon", "coordinates": [[[0, 0], [0, 2], [2, 2], [2, 0], [0, 0]]]}),
+            basic_isochrones_item(geom={"type": "Polygon", "coordinates": [[[0, 0], [0, 2], [2, 2], [2, 0], [0, 0]]]})
+        ]
+        rows = db.execute(build_batch_diff_query(avoid_items, items, OrsApi.isochrones, OrsResponseType.geojson)).all()
+        assert [r[0] for r in rows] == [db.execute(build_diff_query(a, i, OrsApi.isochrones, OrsResponseType.geojson))
+                                        .scalar() for a, i in zip(avoid_items, items)]
+
+    def test_build_batch_diff_query_json(self, db: Session):
+        avoid_items = [basic_directions_json_item(db, geom={"type": "LineString", "coordinates": c}) for c in
+                       [[[0.1, 3.6], [0.2, 2.1], [0.4, 4.1], [0.6, 5.1], [0.4, 5.2]], [[0, 0], [1, 1], [3, 3]]]]
+        items = [basic_directions_json_item(db, geom={"type": "LineString", "coordinates": c}) for c in
+                 [[[0.1, 3.6], [0.2, 2.1], [0.4, 5.2]], [[0, 0], [3, 3]]]]
+        rows = db.execute(build_batch_diff_query(avoid_items, items, OrsApi.directions,
+                                                 OrsResponseType.json)).scalars().all()
+        assert [encoded_difference(shapely.from_wkb(bytes(r))) for r in rows] == \
+            [db.execute(build_diff_query(a, i, OrsApi.directions, OrsResponseType.json)).scalar()
+             for a, i in zip(avoid_items, items)]
+
+    def test_build_batch_diff_query_elevation(self, db: Session):
+        avoid_items = [{"geometry": encode_polyline([[0, 0, 100], [1, 1, 110], [1, 2, 120], [3, 3, 130]], True)}]
+        items = [{"geometry": encode_polyline([[0, 0, 100], [3, 3, 130]], True)}]
+        rows = db.execute(build_batch_diff_query(avoid_items, items, OrsApi.directions, OrsResponseType.json,
+                                                 True)).scalars().all()
+        assert [encoded_difference(shapely.from_wkb(bytes(r)), True) for r in rows] == \
+            item_differences(avoid_items, items, OrsApi.directions, OrsResponseType.json, True)
+
+    def test_build_batch_diff_query_statement(self):
+        avoid_items = [basic_directions_geojson_item(geom={"type": "LineString", "coordinates": [[0, 0], [1, 1]]})] * 3
+        items = [basic_directions_geojson_item(geom={"type": "LineString", "coordinates": [[0, 0], [2, 2]]})] * 3
+        sql = str(build_batch_diff_query(avoid_items, items, OrsApi.directions, OrsResponseType.geojson))
+        # all pairs are passed in a single statement
+        assert sql.count("VALUES") == 1
+        assert sql.count("ST_Difference") == 1
+
     @pytest.mark.parametrize(
         "geom,out",
         [
@@ -172,6 +260,185 @@ class TestGeoUtil:
         box = get_overall_bbox(bboxes)
         assert box == out
 
+    @pytest.mark.parametrize(
+        "lon,lat,radius",
+        [(0, 0, 10000), (8.681495, 49.41461, 2500), (-70.5, -60.2, 50000)])
+    def test_lookup_bbox(self, lon, lat, radius):
+        bbox = lookup_bbox(LookupGeometry(coordinates=[[lon, lat]], distance=radius))
+        exact = bbox_from_radius(lon, lat, radius)
+        # contains the exact bbox, but is at most 5% larger
+        assert bbox[0] <= exact[0] and bbox[1] <= exact[1] and bbox[2] >= exact[2] and bbox[3] >= exact[3]
+        assert (bbox[2] - bbox[0]) / (exact[2] - exact[0]) < 1.05
+        assert (bbox[3] - bbox[1]) / (exact[3] - exact[1]) < 1.05
+
+    def test_within_lookup_distance(self):
+        lookup = LookupGeometry(coordinates=[[8.68, 49.41]], distance=9000)
+        near = shapely.box(8.8, 49.4, 8.9, 49.5)  # 8708 m
+        far = shapely.box(8.81, 49.4, 8.9, 49.5)  # 9434 m
+        assert within_lookup_distance(np.array([near, far]), lookup).tolist() == [True, False]
+
+    def test_within_lookup_distance_long_segment(self):
+        lookup, points, offsets = long_segment_lookup()
+        # the great circle arc runs up to 8 km north of the parallel between its end points
+        assert within_lookup_distance(np.array(points), lookup).tolist() == [abs(o) < 1000 for o in offsets]
+        assert not within_lookup_distance(np.array([shapely.Point(4, 50)]), lookup)[0]
+        assert lookup_bbox(lookup)[3] > 50.07
+
+    def test_within_lookup_distance_matches_database(self, db: Session):
+        lookup, points, _ = long_segment_lookup()
+        expected = [db.execute(select(func.ST_DWithin(
+            func.geography(func.ST_GeomFromText(p.wkt, 4326)),
+            func.geography(func.ST_GeomFromText(lookup.wkt, 4326)), lookup.distance))).scalar() for p in points]
+        assert within_lookup_distance(np.array(points), lookup).tolist() == expected
+
+    def test_select_within_lookup(self):
+        geoms = [shapely.box(8.8, 49.4, 8.9, 49.5), shapely.box(8.81, 49.4, 8.9, 49.5), shapely.box(0, 0, 1, 1)]
+        lookup = LookupGeometry(coordinates=[[8.68, 49.41]], distance=9000)
+        assert select_within_lookup(geoms, near=[lookup]) == geoms[:1]
+        assert select_within_lookup(geoms, bbox=[0.5, 0.5, 8.805, 50]) == geoms[:3:2]
+        assert select_within_lookup(geoms, bbox=[0.5, 0.5, 8.805, 50], near=[lookup]) == geoms[:1]
+        assert select_within_lookup(geoms) == geoms
+        assert select_within_lookup([], near=[lookup]) == []
+
+    def test_lookup_window(self):
+        assert lookup_window() is None
+        assert lookup_window(bbox=[0, 0, 1, 1]).bounds == (0, 0, 1, 1)
+        window = lookup_window(near=[LookupGeometry(coordinates=[[0, 0]], distance=1000),
+                                     LookupGeometry(coordinates=[[1, 1]], distance=1000)])
+        assert window.geom_type == "MultiPolygon"
+        assert window.contains(shapely.Point(0.005, 0.005))
+        assert not window.contains(shapely.Point(0.5, 0.5))
+
+    def test_simplify_to_budget(self):
+        circle = shapely.Point(8.68, 49.41).buffer(0.05, quad_segs=1000)
+        simplified = simplify_to_budget(circle, 500)
+        assert shapely.get_num_coordinates(simplified) <= 500
+        assert simplified.is_valid
+        assert abs(simplified.area - circle.area) / circle.area < 0.01
+        assert simplify_to_budget(circle, 10000) is circle
+
+    def test_simplify_to_budget_max_distance(self, mocker: MockerFixture):
+        warning = mocker.patch("app.backend.geoutil.logger.warning")
+        circle = shapely.Point(8.68, 49.41).buffer(0.05, quad_segs=1000)
+        simplified = simplify_to_budget(circle, 10, max_distance=100)
+        # the budget can not be met without moving the boundary by more than 100 m
+        assert shapely.get_num_coordinates(simplified) > 10
+        assert shapely.hausdorff_distance(simplified, circle) < 100 / meters_per_degree(49.46)[1]
+        warning.assert_called_once()
+        assert "budget is 10" in warning.call_args.args[0]
+        warning.reset_mock()
+        simplify_to_budget(circle, 500, max_distance=100)
+        warning.assert_not_called()
+
+    def test_avoid_polygon_coordinates(self):
+        geometries = [
+            shapely.box(0, 0, 2, 2),
+            shapely.MultiPolygon([shapely.box(1, 1, 3, 3), shapely.box(4, 4, 4.5, 4.5)]),
+            shapely.box(10, 10, 11, 11)
+        ]
+        # overlapping areas are merged, areas outside the window are dropped
+        coordinates = avoid_polygon_coordinates(geometries, shapely.box(-1, -1, 5, 5), 1000)
+        assert len(coordinates) == 2
+        assert shapely.Polygon(coordinates[0][0]).area == 7
+        assert shapely.Polygon(coordinates[1][0]).area == 0.25
+        # areas are clipped to the window
+        coordinates = avoid_polygon_coordinates(geometries, shapely.box(-1, -1, 1, 1), 1000)
+        assert shapely.Polygon(coordinates[0][0]).area == 1
+        assert avoid_polygon_coordinates([], None, 1000) == []
+
+    def test_avoid_polygon_coordinates_precision(self):
+        geometries = [shapely.box(0.12345678, 0.12345678, 1.987654321, 1.987654321)]
+        coordinates = avoid_polygon_coordinates(geometries, None, 1000, precision=6)
+        assert sorted(set(c for ring in coordinates[0] for point in ring for c in point)) == [0.123457, 1.987654]
+
+    @pytest.mark.parametrize(
+        "coordinates,encoded",
+        [([[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]], "_p~iF~ps|U_ulLnnqC_mqNvxq`@"),
+         ([[8.68149, 49.41461], [8.68787, 49.42032]], "ihrlHir~s@ub@{f@")
+         ])
+    def test_polyline_codec(self, coordinates, encoded):
+        assert encode_polyline(coordinates) == encoded
+        assert decode_polyline(encoded).tolist() == coordinates
+
+    def test_polyline_codec_elevation(self):
+        coordinates = [[8.68149, 49.41461, 104.5], [8.68787, 49.42032, 116.23], [8.68787, 49.42031, -3.1]]
+        encoded = encode_polyline(coordinates, elevation=True)
+        assert decode_polyline(encoded, elevation=True).tolist() == coordinates
+        # elevation is ignored if not requested
+        assert decode_polyline(encode_polyline(coordinates)).tolist() == [c[:2] for c in coordinates]
+        assert decode_polyline("").shape == (0, 2)
+
+    def test_polyline_bbox_elevation(self):
+        encoded = encode_polyline([[0.1, 3.6, 10], [0.4, 5.2, -2.5], [0.2, 2.1, 7]], elevation=True)
+        assert polyline_bbox(encoded, elevation=True) == [0.1, 2.1, -2.5, 0.4, 5.2, 10]
+
+    def test_polyline_bbox_matches_database(self, db: Session):
+        coordinates = [[0.11111111, 3.00000900], [22.88888888, 2.11]]
+        item = basic_directions_json_item(db, geom={"type": "LineString", "coordinates": coordinates})
+        assert polyline_bbox(item["geometry"]) == get_bbox_for_encoded_polyline(db, item)
+
+    @pytest.mark.parametrize(
+        "coordinates,out",
+        [([[0.1, 3.602], [0.22, 2.11], [0.42, 4.123], [0.3102, 5.12312]], [0.1, 2.11, 0.42, 5.12312]),
+         ([[0, 0], [1, 1], [0, 2]], [0, 0, 1, 2]),
+         ([[0.11111111, 3.00000900], [22.88888888, 2.11]], [0.11111, 2.11, 22.88889, 3.00001])
+         ])
+    def test_polyline_bbox(self, coordinates, out):
+        assert polyline_bbox(encode_polyline(coordinates)) == out
+
+    def test_geojson_with_bbox(self):
+        geojson = geojson_with_bbox(shapely.LineString([[0.123456789, 1, 5], [2, 3.000000001, 7]]))
+        assert geojson == {"type": "LineString", "bbox": [0.1234568, 1, 5, 2, 3, 7],
+                           "coordinates": [[0.1234568, 1, 5], [2, 3, 7]]}
+        geojson = geojson_with_bbox(shapely.GeometryCollection([shapely.Point(0.123456789, 1, 5)]))
+        assert geojson == {"type": "GeometryCollection", "bbox": [0.1234568, 1, 5, 0.1234568, 1, 5],
+                           "geometries": [{"type": "Point", "coordinates": [0.1234568, 1, 5]}]}
+
+    def test_item_differences_json(self):
+        avoid_items = [{"geometry": encode_polyline([[0, 0], [1, 0], [1, 1], [2, 1], [2, 0], [5, 0], [5, 2],
+                                                     [6, 2], [6, 0], [7, 0]])}]
+        items = [{"geometry": encode_polyline([[0, 0], [7, 0]])}]
+        differences = item_differences(avoid_items, items, OrsApi.directions, OrsResponseType.json)
+        # parts are not joined, every detour is kept
+        parts = [[[1, 0], [1, 1], [2, 1], [2, 0]], [[5, 0], [5, 2], [6, 2], [6, 0]]]
+        assert [decode_polyline(d).tolist() for d in differences[0]] == parts
+        assert encoded_difference(shapely.MultiLineString([[[0, 0], [0, 1]], [[2, 0], [2, 3]]])) == \
+            [encode_polyline([[0, 0], [0, 1]]), encode_polyline([[2, 0], [2, 3]])]
+        assert encoded_difference(shapely.MultiLineString([[[0, 0], [0, 1]], [[0, 1], [0, 3]]])) == \
+            encode_polyline([[0, 0], [0, 1], [0, 3]])
+        assert encoded_difference(shapely.LineString()) is None
+
+    def test_item_differences_elevation(self):
+        avoid_items = [{"geometry": {"type": "LineString", "coordinates": [[0, 0, 10], [1, 1, 20], [3, 3, 40]]}}]
+        items = [{"geometry": {"type": "LineString", "coordinates": [[0, 0, 10], [1, 1, 20]]}}]
+        differences = item_differences(avoid_items, items, OrsApi.directions, OrsResponseType.geojson, True)
+        assert differences[0] == {"type": "LineString", "bbox": [1, 1, 20, 3, 3, 40],
+                                  "coordinates": [[1, 1, 20], [3, 3, 40]]}
+
+    def test_item_differences(self):
+        avoid_items = [{"geometry": {"type": "LineString", "coordinates": [[0, 0], [1, 1], [1, 2], [3, 3]]}},
+                       {"geometry": {"type": "LineString", "coordinates": [[0, 0], [3, 3]]}}]
+        items = [{"geometry": {"type": "LineString", "coordinates": [[0, 0], [3, 3]]}},
+                 {"geometry": {"type": "LineString", "coordinates": [[0, 0], [3, 3]]}}]
+        differences = item_differences(avoid_items, items, OrsApi.directions, OrsResponseType.geojson)
+        assert shapely.equals(shapely.from_geojson(json.dumps(differences[0])),
+                              shapely.LineString([[1, 1], [1, 2], [3, 3]]))
+        assert differences[0]["bbox"] == [1, 1, 3, 3]
+        assert differences[1] is None
+        # differences of several parts are kept as a whole
+        avoid_items = [{"geometry": {"type": "LineString", "coordinates": [[0, 0], [1, 0], [1, 1], [2, 1], [2, 0],
+                                                                           [5, 0], [5, 2], [6, 2], [6, 0], [7, 0]]}}]
+        items = [{"geometry": {"type": "LineString", "coordinates": [[0, 0], [7, 0]]}}]
+        differences = item_differences(avoid_items, items, OrsApi.directions, OrsResponseType.geojson)
+        assert differences[0]["type"] == "MultiLineString"
+        assert shapely.equals(shapely.from_geojson(json.dumps(differences[0])), shapely.MultiLineString(
+            [[[1, 0], [1, 1], [2, 1], [2, 0]], [[5, 0], [5, 2], [6, 2], [6, 0]]]))
+        # isochrones are subtracted the other way around
+        avoid_items = [{"geometry": {"type": "Polygon", "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]}}]
+        items = [{"geometry": {"type": "Polygon", "coordinates": [[[0, 0], [2, 0], [2, 1], [0, 1], [0, 0]]]}}]
+        differences = item_differences(avoid_items, items, OrsApi.isochrones, OrsResponseType.geojson)
+        assert differences[0]["bbox"] == [1, 0, 2, 1]
+
     @pytest.mark.parametrize(
         "f,limit,out",
         [(0, None, 0),
@@ -182,3 +449,28 @@ class TestGeoUtil:
     def test_float_precision(self, f, limit, out):
         p = float_precision(f, limit) if limit else float_precision(f)
         assert p == out
+
+    @pytest.mark.parametrize("geometry,out", VALIDITY_CASES)
+    def test_validity_reason(self, geometry, out):
+        assert validity_reason(geometry) == out
+        assert validity_reasons([geometry, geometry]) == [out, out]
+
+    def test_validity_reasons_unreadable(self):
+        unreadable = {"type": "LineString", "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 0]]]}
+        assert validity_reasons([VALIDITY_CASES[0][0], unreadable]) == ["Valid Geometry", UNREADABLE_GEOMETRY]
+        assert validity_reason(unreadable) == UNREADABLE_GEOMETRY
+
+    @pytest.mark.parametrize("geometry,out", VALIDITY_CASES)
+    def test_validity_reason_matches_database(self, db: Session, geometry, out):
+        reason = db.execute(func.ST_IsValidReason(func.ST_GeomFromGeoJSON(json.dumps(geometry)))).scalar()
+        assert validity_reason(geometry) == reason
+
+    @pytest.mark.parametrize(
+        "z,x,y,buffer,out",
+        [(0, 0, 0, 0, [-180, -85.0511288, 180, 85.0511288]),
+         (1, 1, 0, 0, [0, 0, 180, 85.0511288]),
+         (2, 1, 2, 0, [-90, -66.5132604, 0, 0]),
+         (1, 0, 1, 0.5, [-180, -88.9706184, 90, 66.5132604])
+         ])
+    def test_tile_bounds(self, z, x, y, buffer, out):
+        assert tile_bounds(z, x, y, buffer) == pytest.approx(out)
@@ -0,0 +1,98 @@
+import asyncio
+from types import SimpleNamespace
+
+from pytest_mock import MockerFixture
+
+from app import crud
+from app.backend.jobs import JobRunner
+
+
+def mock_jobs(mocker: MockerFixture) -> dict:
+    """Mocks the routing job CRUD object, returns the jobs by id"""
+    jobs = {}
+    mocker.patch.object(crud.routing_job, "get", side_effect=lambda db, job_id: jobs.get(job_id))
+    mocker.patch.object(crud.routing_job, "start",
+                        side_effect=lambda db, db_obj: setattr(db_obj, "status", "running"))
+    mocker.patch.object(crud.routing_job, "finish", side_effect=lambda db, db_obj, **result: (
+        setattr(db_obj, "status", "succeeded"), db_obj.__dict__.update(result)))
+    mocker.patch.object(crud.routing_job, "fail", side_effect=lambda db, db_obj, error: (
+        setattr(db_obj, "status", "failed"), setattr(db_obj, "error", error)))
+    return jobs
+
+
+async def wait(runner: JobRunner):
+    while runner.stats()["jobs"]:
+        await asyncio.sleep(0.01)
+
+
+class TestJobRunner:
+    async def test_run(self, mocker: MockerFixture):
+        jobs = mock_jobs(mocker)
+        sessions = []
+        runner = JobRunner(workers=2)
+        running = []
+
+        async def work(db):
+            running.append(1)
+            assert len(running) <= 2
+            await asyncio.sleep(0.02)
+            running.pop()
+            return 200, b"{}", "application/json"
+
+        for i in range(5):
+            jobs[i] = SimpleNamespace(status="pending")
+            runner.submit(i, work, lambda: sessions.append(mocker.MagicMock()) or sessions[-1])
+        await wait(runner)
+        assert [j.status for j in jobs.values()] == ["succeeded"] * 5
+        assert jobs[0].status_code == 200
+        assert jobs[0].result == b"{}"
+        # one session per job, closed afterwards
+        assert len(sessions) == 5
+        assert all(s.close.called for s in sessions)
+
+    async def test_failure(self, mocker: MockerFixture):
+        jobs = mock_jobs(mocker)
+        runner = JobRunner()
+
+        async def work(db):
+            raise ValueError("broken")
+
+        jobs[1] = SimpleNamespace(status="pending")
+        runner.submit(1, work, mocker.MagicMock)
+        await wait(runner)
+        assert jobs[1].status == "failed"
+        assert jobs[1].error == "broken"
+
+    async def test_close(self, mocker: MockerFixture):
+        jobs = mock_jobs(mocker)
+        runner = JobRunner()
+
+        async def work(db):
+            await asyncio.sleep(10)
+
+        jobs[1] = SimpleNamespace(status="pending")
+        runner.submit(1, work, mocker.MagicMock)
+        await asyncio.sleep(0.05)
+        assert jobs[1].status == "running"
+        await runner.close()
+        assert jobs[1].status == "failed"
+        assert jobs[1].error == "Job was interrupted"
+
+    async def test_close_queued(self, mocker: MockerFixture):
+        jobs = mock_jobs(mocker)
+        sessions = []
+        runner = JobRunner(workers=1)
+
+        async def work(db):
+            await asyncio.sleep(10)
+
+        for i in range(3):
+            jobs[i] = SimpleNamespace(status="pending")
+            runner.submit(i, work, lambda: sessions.append(mocker.MagicMock()) or sessions[-1])
+        await asyncio.sleep(0.05)
+        assert [j.status for j in jobs.values()] == ["running", "pending", "pending"]
+        await runner.close()
+        # queued jobs are failed as well, so clients stop polling them
+        assert [j.status for j in jobs.values()] == ["failed"] * 3
+        assert all(j.error == "Job was interrupted" for j in jobs.values())
+        assert all(s.close.called for s in sessions)
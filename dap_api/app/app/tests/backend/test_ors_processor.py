@@ -1,16 +1,25 @@
+import asyncio
 import json
 
+import httpx
 import pytest
+from fastapi.responses import StreamingResponse
+import shapely
 from pytest_mock import MockerFixture
 from sqlalchemy.orm import Session
 
-from app.backend.ors_processor import ORSProcessor, result_key, has_same_prop
+from app.backend.cache import ResponseCache
+from app.backend.geoutil import decode_polyline, encode_polyline
+from app.backend.ors_processor import ORSProcessor, result_key, has_same_prop, batch_line
+from app.backend.spatial_index import DisasterAreaIndex
 from app.config import settings
-from app.schemas import PathOptions
+from app.db.change_tracker import ChangeTracker
+from app.schemas import PathOptions, ORSResponse
 from app.schemas.ors_request import ORSIsochrones, ORSDirections
+from app.tests.backend.test_spatial_index import fake_row, mock_feature_query
 from app.tests.backend.util_test_data import update_info_set_1, update_info_set_2, calc_features_set_1, \
     calc_features_set_2, matching_iso_set_1, matching_iso_set_2, calc_features_set_3, \
-    calc_features_set_4, calc_features_set_5, basic_options
+    calc_features_set_4, calc_features_set_5, basic_options, basic_directions_geojson_item, basic_directions_json_item
 
 
 class TestOrsProcessor:
@@ -36,9 +45,9 @@ class TestOrsProcessor:
             }), "mock_api_key", "")
         ]
     )
-    def test_handle_ors_request(self, mocker: MockerFixture, db: Session, request_dict: ORSDirections | ORSIsochrones, options: PathOptions,
-                                header_authorization: str, out):
-        mock_requests = mocker.patch('app.backend.base.requests')
+    async def test_handle_ors_request(self, mocker: MockerFixture, db: Session, request_dict: ORSDirections | ORSIsochrones,
+                                      options: PathOptions, header_authorization: str, out):
+        mock_post = mocker.patch('httpx.AsyncClient.post', new_callable=mocker.AsyncMock)
         mock_response = mocker.MagicMock()
         mock_response.status_code = 200
         mock_response.headers = {
@@ -51,29 +60,18 @@ class TestOrsProcessor:
                 }
             }
         }
-        mock_requests.post.return_value = mock_response
+        mock_post.return_value = mock_response
         ors_p = ORSProcessor(settings.ORS_BACKEND_URL)
-        res = ors_p.handle_ors_request(db, request_dict, options, header_authorization)
+        res = await ors_p.handle_ors_request(db, request_dict, options, header_authorization)
         # mock_requests
         assert out == res
 
-    def test_handle_ors_request_with_ors_server(self, mocker: MockerFixture, db: Session):
-        mock_requests = mocker.patch('app.backend.base.requests')
-        mock_response = mocker.MagicMock()
-        mock_response.status_code = 200
-        mock_response.headers = {
-            "Content-Type": "application/geo+json;charset=UTF-8"
-        }
-        mock_response.json.return_value = {
-            'metadata': {
-                'query': {
-
-                }
-            }
-        }
-        mock_requests.post.return_value = mock_response
+    async def test_handle_ors_request_with_ors_server(self, mocker: MockerFixture, db: Session):
+        mock_send = mocker.patch('httpx.AsyncClient.send', new_callable=mocker.AsyncMock)
+        mock_send.return_value = httpx.Response(200, json={'metadata': {'query': {}}},
+                                                headers={"Content-Type": "application/geo+json;charset=UTF-8"})
         ors_p = ORSProcessor(settings.ORS_BACKEND_URL)
-        ors_p.handle_ors_request(db, request=ORSDirections.parse_obj({
+        await ors_p.handle_ors_request(db, request=ORSDirections.parse_obj({
                 "portal_options": {"ors_server": "disaster1"},
                 "coordinates": [
                     [
@@ -92,7 +90,7 @@ class TestOrsProcessor:
                 "ors_response_type": "geojson"
             }), header_authorization="mock_api_key")
 
-        assert mock_requests.method_calls[0][2]['url'].startswith('disaster1')
+        assert mock_send.call_args.args[0].url.path.startswith('/disaster1/')
 
 
     @pytest.mark.parametrize(
@@ -105,11 +103,90 @@ class TestOrsProcessor:
 
         ]
     )
-    def test_calculate_new_features(self, db: Session, options: PathOptions, request_dict, response, response_no_avoid,
-                                    out):
+    def test_calculate_new_features(self, db: Session, mocker: MockerFixture, options: PathOptions, request_dict,
+                                    response, response_no_avoid, out):
+        mocker.patch.object(settings, "ORS_DIFFERENCE_IN_PROCESS", False)
         f = ORSProcessor.calculate_new_features(db, options, request_dict, response, response_no_avoid)
         assert f == out
 
+    @pytest.mark.parametrize(
+        "options,request_dict,response,response_no_avoid,out", [
+            calc_features_set_1(),
+            calc_features_set_2(),
+            calc_features_set_3(),
+            calc_features_set_4(),
+            calc_features_set_5()
+        ]
+    )
+    def test_calculate_new_features_in_process(self, options: PathOptions, request_dict, response, response_no_avoid,
+                                               out):
+        f = ORSProcessor.calculate_new_features(None, options, request_dict, response, response_no_avoid)
+        # rings may start at a different vertex than in PostGIS
+        geometries = [shapely.from_geojson(json.dumps(x.pop("geometry"))) for x in f]
+        expected = [shapely.from_geojson(json.dumps(x.pop("geometry"))) for x in out]
+        assert f == out
+        assert shapely.equals(geometries, expected).all()
+        assert [list(g.bounds) for g in geometries] == [list(g.bounds) for g in expected]
+
+    def test_calculate_new_features_json(self):
+        avoid_item = basic_directions_json_item(None, dis=8, dur=15)
+        avoid_item["geometry"] = encode_polyline([[0.1, 3.6], [0.2, 2.1], [0.4, 4.1], [0.6, 5.1], [0.4, 5.2]])
+        item = basic_directions_json_item(None)
+        item["geometry"] = encode_polyline([[0.1, 3.6], [0.2, 2.1], [0.4, 5.2]])
+        f = ORSProcessor.calculate_new_features(None, basic_options(res="json"), {}, [avoid_item], [item])
+        assert decode_polyline(f[0]["geometry"]).tolist() == [[0.2, 2.1], [0.4, 4.1], [0.6, 5.1], [0.4, 5.2]]
+        assert f[0]["bbox"] == [0.1, 2.1, 0.4, 5.2]
+        assert f[0]["summary"] == {"distance": 3, "duration": 10}
+
+    def test_calculate_new_features_json_elevation(self):
+        avoid_item = basic_directions_json_item(None, dis=8, dur=15)
+        avoid_item["geometry"] = encode_polyline([[0, 0, 100], [1, 1, 110], [1, 2, 120], [3, 3, 130]], elevation=True)
+        item = basic_directions_json_item(None)
+        item["geometry"] = encode_polyline([[0, 0, 100], [3, 3, 130]], elevation=True)
+        f = ORSProcessor.calculate_new_features(None, basic_options(res="json"), {"elevation": True}, [avoid_item],
+                                                [item])
+        assert decode_polyline(f[0]["geometry"], elevation=True).tolist() == [[1, 1, 110], [1, 2, 120], [3, 3, 130]]
+        assert f[0]["bbox"] == [0, 0, 100, 3, 3, 130]
+
+    def test_calculate_new_features_json_elevation_database(self, mocker: MockerFixture):
+        mocker.patch.object(settings, "ORS_DIFFERENCE_IN_PROCESS", False)
+        db = mocker.MagicMock()
+        db.execute.return_value.scalars.return_value.all.return_value = [
+            shapely.to_wkb(shapely.LineString([[1, 1, 110], [1, 2, 120], [3, 3, 130]]))]
+        avoid_item = basic_directions_json_item(None, dis=8, dur=15)
+        avoid_item["geometry"] = encode_polyline([[0, 0, 100], [1, 1, 110], [1, 2, 120], [3, 3, 130]], elevation=True)
+        item = basic_directions_json_item(None)
+        item["geometry"] = encode_polyline([[0, 0, 100], [3, 3, 130]], elevation=True)
+        f = ORSProcessor.calculate_new_features(db, basic_options(res="json"), {"elevation": True}, [avoid_item],
+                                                [item])
+        # PostGIS can not decode polylines with elevation, they are passed as WKB
+        sql = str(db.execute.call_args[0][0])
+        assert "ST_LineFromEncodedPolyline" not in sql and "ST_GeomFromWKB" in sql
+        assert decode_polyline(f[0]["geometry"], elevation=True).tolist() == [[1, 1, 110], [1, 2, 120], [3, 3, 130]]
+
+    def test_calculate_new_features_json_parts(self, mocker: MockerFixture):
+        avoid_item = basic_directions_json_item(None, dis=8, dur=15)
+        avoid_item["geometry"] = encode_polyline([[0, 0], [1, 0], [1, 1], [2, 1], [2, 0], [5, 0], [5, 2], [6, 2],
+                                                  [6, 0], [7, 0]])
+        item = basic_directions_json_item(None)
+        item["geometry"] = encode_polyline([[0, 0], [7, 0]])
+        parts = [[[1, 0], [1, 1], [2, 1], [2, 0]], [[5, 0], [5, 2], [6, 2], [6, 0]]]
+        f = ORSProcessor.calculate_new_features(None, basic_options(res="json"), {}, [dict(avoid_item)], [item])
+        assert [decode_polyline(p).tolist() for p in f[0]["geometry"]] == parts
+        # the database returns the same parts
+        mocker.patch.object(settings, "ORS_DIFFERENCE_IN_PROCESS", False)
+        db = mocker.MagicMock()
+        db.execute.return_value.scalars.return_value.all.return_value = [
+            shapely.to_wkb(shapely.MultiLineString(parts))]
+        assert ORSProcessor.calculate_new_features(db, basic_options(res="json"), {}, [dict(avoid_item)], [item]) == f
+
+    def test_calculate_new_features_fallback(self, mocker: MockerFixture):
+        database_differences = mocker.patch.object(ORSProcessor, "database_differences", return_value=[None])
+        avoid_item = basic_directions_geojson_item(geom={"type": "Invalid"})
+        item = basic_directions_geojson_item(geom={"coordinates": [[0, 0], [3, 3]], "type": "LineString"})
+        assert ORSProcessor.calculate_new_features(None, basic_options(), {}, [avoid_item], [item]) == []
+        database_differences.assert_called_once()
+
     @pytest.mark.parametrize(
         "avoid_results,item,out", [
             matching_iso_set_1(),
@@ -190,6 +267,38 @@ class TestOrsProcessor:
         result = ORSProcessor.get_bounding_box(request, 'directions', 'driving-car')
         assert result == bbox
 
+    def test_get_lookup_geometries_isochrones(self):
+        request = ORSIsochrones(range=[60, 120], locations=[[0.1, 0.1], [1, 1]])
+        result = ORSProcessor.get_lookup_geometries(request, 'isochrones', 'driving-car')
+        assert [g.coordinates for g in result] == [[[0.1, 0.1]], [[1, 1]]]
+        assert [g.distance for g in result] == [2667, 2667]
+
+    def test_get_lookup_geometries_bbox(self):
+        """
+        Should use the bbox specified in disaster_area_filters
+        """
+        request = ORSIsochrones.parse_obj({
+            "range": [60],
+            "locations": [[0, 0]],
+            "portal_options": {"disaster_area_filter": {"bbox": [0, 0, 1, 1]}}
+        })
+        assert ORSProcessor.get_lookup_geometries(request, 'isochrones', 'driving-car') is None
+
+    @pytest.mark.parametrize(
+        "looseness,distances", [
+            (0, [16698, 1000, 1000]),
+            (50, [72358, 1000, 1000])
+        ])
+    def test_get_lookup_geometries_directions(self, looseness, distances):
+        request = ORSDirections.parse_obj({
+            "coordinates": [[0, 0], [1, 0], [1, 0.001], [1, 0.001]],
+            "portal_options": {"bounds_looseness": looseness}
+        })
+        result = ORSProcessor.get_lookup_geometries(request, 'directions', 'driving-car')
+        # one corridor segment per pair of waypoints, its width scales with the segment length
+        assert [g.coordinates for g in result] == [[[0, 0], [1, 0]], [[1, 0], [1, 0.001]], [[1, 0.001]]]
+        assert [g.distance for g in result] == distances
+
     @pytest.mark.skipif(True, reason="TODO")  # TODO: WIP
     def test_prepare_request_dic(self):
         # ORSProcessor.prepare_request_dic()
@@ -227,3 +336,237 @@ def test_has_same_prop():
         {"properties": {"asd": True, "hello": False}},
         "asd"
     ) is True
+
+
+async def read_body(response: ORSResponse | StreamingResponse) -> bytes:
+    if isinstance(response, StreamingResponse):
+        return b"".join([chunk async for chunk in response.body_iterator])
+    return response.body
+
+
+async def test_handle_ors_request_cached(mocker: MockerFixture):
+    mock_send = mocker.patch('httpx.AsyncClient.send', new_callable=mocker.AsyncMock)
+    mock_send.side_effect = lambda *args, **kwargs: httpx.Response(
+        200, json={'metadata': {'query': {}}}, headers={"Content-Type": "application/geo+json;charset=UTF-8"})
+    tracker = ChangeTracker()
+    ors_p = ORSProcessor(settings.ORS_BACKEND_URL, cache=ResponseCache(tracker=tracker))
+    mocker.patch('app.backend.ors_processor.change_tracker', tracker)
+    request = ORSDirections.parse_obj({"coordinates": [[8.681495, 49.41461], [8.687872, 49.420318]]})
+    options = PathOptions.parse_obj({**basic_options().dict(), "portal_mode": "custom_speeds"})
+
+    first = await ors_p.handle_ors_request(None, request.copy(deep=True), options, "key")
+    first_body = await read_body(first)
+    second = await ors_p.handle_ors_request(None, request.copy(deep=True), options, "key")
+    assert mock_send.call_count == 1
+    assert first.headers["X-Cache"] == "MISS"
+    assert second.headers["X-Cache"] == "HIT"
+    assert second.headers["Server-Timing"] == first.headers["Server-Timing"]
+    assert first_body == second.body
+
+    # other authorization
+    await read_body(await ors_p.handle_ors_request(None, request.copy(deep=True), options, "other key"))
+    assert mock_send.call_count == 2
+    await ors_p.close()
+
+
+async def test_handle_ors_request_streamed(mocker: MockerFixture):
+    body = json.dumps({"type": "FeatureCollection", "features": [{"type": "Feature", "properties": {}}] * 500,
+                       "metadata": {"service": "routing", "query": {"profile": "driving-car"}}}).encode()
+    mock_send = mocker.patch('httpx.AsyncClient.send', new_callable=mocker.AsyncMock)
+    mock_send.return_value = httpx.Response(200, stream=httpx.ByteStream(body),
+                                            headers={"Content-Type": "application/geo+json;charset=UTF-8"})
+    ors_p = ORSProcessor(settings.ORS_BACKEND_URL)
+    request = ORSDirections.parse_obj({"coordinates": [[8.681495, 49.41461], [8.687872, 49.420318]]})
+    options = PathOptions.parse_obj({**basic_options().dict(), "portal_mode": "custom_speeds"})
+    response = await ors_p.handle_ors_request(None, request, options, "key")
+    assert isinstance(response, StreamingResponse)
+    assert mock_send.call_args.kwargs["stream"] is True
+    result = json.loads(await read_body(response))
+    assert result["metadata"]["query"] == {"portal_options": request.portal_options.dict(by_alias=True),
+                                           "profile": "driving-car"}
+    assert len(result["features"]) == 500
+    await ors_p.close()
+
+
+async def test_handle_ors_request_streamed_error(mocker: MockerFixture):
+    body = b'{"error":{"code":2010,"message":"Could not find point"}}'
+    mock_send = mocker.patch('httpx.AsyncClient.send', new_callable=mocker.AsyncMock)
+    mock_send.return_value = httpx.Response(404, content=body, headers={"Content-Type": "application/json"})
+    ors_p = ORSProcessor(settings.ORS_BACKEND_URL)
+    request = ORSDirections.parse_obj({"coordinates": [[8.681495, 49.41461], [8.687872, 49.420318]]})
+    options = PathOptions.parse_obj({**basic_options().dict(), "portal_mode": "custom_speeds"})
+    response = await ors_p.handle_ors_request(None, request, options, "key")
+    assert response.status_code == 404
+    assert await read_body(response) == body
+    await ors_p.close()
+
+
+@pytest.mark.parametrize("stream", [True, False])
+@pytest.mark.parametrize("user_polygon", [None, [[[8.60, 49.40], [8.61, 49.40], [8.61, 49.41], [8.60, 49.40]]]])
+async def test_handle_ors_request_strip_avoid_areas(mocker: MockerFixture, stream, user_polygon):
+    # ORS returns the relayed request as query in the metadata
+    mock_send = mocker.patch('httpx.AsyncClient.send', new_callable=mocker.AsyncMock)
+    mock_send.side_effect = lambda request, **kwargs: httpx.Response(
+        200, json={"routes": [], "metadata": {"query": json.loads(request.content)}},
+        headers={"Content-Type": "application/json;charset=UTF-8"})
+    mocker.patch.object(settings, "ORS_STREAM_RESPONSES", stream)
+    area_index = mocker.MagicMock()
+    area_index.get_multi_geometries.return_value = [shapely.box(8.683, 49.416, 8.685, 49.418)]
+    ors_p = ORSProcessor(settings.ORS_BACKEND_URL, area_index=area_index)
+    request = {"coordinates": [[8.681495, 49.41461], [8.687872, 49.420318]]}
+    if user_polygon:
+        request["options"] = {"avoid_polygons": {"type": "Polygon", "coordinates": user_polygon}}
+    options = PathOptions.parse_obj({**basic_options().dict(), "ors_response_type": "json"})
+
+    response = await ors_p.handle_ors_request(None, ORSDirections.parse_obj(request), options)
+    relayed = json.loads(mock_send.call_args.args[0].content)
+    assert len(relayed["options"]["avoid_polygons"]["coordinates"]) == (2 if user_polygon else 1)
+    query = json.loads(await read_body(response))["metadata"]["query"]
+    assert query["stripped_avoid_polygons"] == 1
+    if user_polygon:
+        assert query["options"] == {"avoid_polygons": {"coordinates": [user_polygon], "type": "MultiPolygon"}}
+    else:
+        assert query.get("options", {}) == {}
+    assert query["coordinates"] == request["coordinates"]
+
+    # opt out
+    request["portal_options"] = {"strip_avoid_areas": False}
+    response = await ors_p.handle_ors_request(None, ORSDirections.parse_obj(request), options)
+    query = json.loads(await read_body(response))["metadata"]["query"]
+    assert "stripped_avoid_polygons" not in query
+    assert query["options"]["avoid_polygons"] == relayed["options"]["avoid_polygons"]
+    await ors_p.close()
+
+
+@pytest.mark.parametrize("portal_options,geometry_vertices", [
+    ({}, 6),
+    ({"areas_simplify_tolerance": 0.01}, 6),
+    ({"areas_simplify_tolerance": 0.05}, 5),
+])
+async def test_handle_ors_request_areas_in_response(mocker: MockerFixture, portal_options, geometry_vertices):
+    mock_send = mocker.patch('httpx.AsyncClient.send', new_callable=mocker.AsyncMock)
+    mock_send.side_effect = lambda request, **kwargs: httpx.Response(
+        200, json={"routes": [], "metadata": {"query": {}}}, headers={"Content-Type": "application/json"})
+    row = fake_row(1, [8.684, 49.417])
+    # a vertex between two corners, removed by larger tolerances
+    geometry = json.loads(row.geojson)
+    geometry["coordinates"][0][0].insert(1, [8.684, 49.3])
+    row.geojson = json.dumps(geometry)
+    mock_feature_query(mocker, {1: row})
+    ors_p = ORSProcessor(settings.ORS_BACKEND_URL, area_index=DisasterAreaIndex(tracker=ChangeTracker()))
+    request = ORSDirections.parse_obj({"coordinates": [[8.681495, 49.41461], [8.687872, 49.420318]],
+                                       "portal_options": {"return_areas_in_response": True, **portal_options}})
+    response = await ors_p.handle_ors_request(None, request, basic_options(res="json"))
+    areas = json.loads(await read_body(response))["disaster_areas"]
+    assert [f["id"] for f in areas["features"]] == [1]
+    assert len(areas["features"][0]["geometry"]["coordinates"][0]) == geometry_vertices
+    relayed = json.loads(mock_send.call_args.args[0].content)
+    assert len(relayed["options"]["avoid_polygons"]["coordinates"]) == 1
+    await ors_p.close()
+
+
+async def test_handle_ors_request_compact_areas(mocker: MockerFixture):
+    mock_send = mocker.patch('httpx.AsyncClient.send', new_callable=mocker.AsyncMock)
+    mock_send.side_effect = lambda request, **kwargs: httpx.Response(
+        200, json={"routes": [], "metadata": {"query": {}}}, headers={"Content-Type": "application/json"})
+    mock_feature_query(mocker, {1: fake_row(1, [8.684, 49.417]), 2: fake_row(2, [20, 20])})
+    index = DisasterAreaIndex(tracker=ChangeTracker())
+    ors_p = ORSProcessor(settings.ORS_BACKEND_URL, area_index=index)
+    query = mocker.spy(index, "query")
+    request = ORSDirections.parse_obj({"coordinates": [[8.681495, 49.41461], [8.687872, 49.420318]],
+                                       "portal_options": {"return_areas_in_response": True,
+                                                          "areas_response_mode": "compact"}})
+    response = await ors_p.handle_ors_request(None, request, basic_options(res="json"))
+    # references and avoid polygons are taken from a single lookup
+    assert query.call_count == 1
+    result = json.loads(await read_body(response))
+    areas = result["disaster_areas"]
+    assert areas["version"] == index.get_multi_references(None, bbox=[8.6, 49.3, 8.8, 49.5]).version
+    assert [a["id"] for a in areas["areas"]] == [1]
+    assert areas["areas"][0]["bbox"] == pytest.approx([8.584, 49.317, 8.784, 49.517])
+    assert areas["bbox"] == areas["areas"][0]["bbox"]
+    assert "disaster_areas_lookup_bbox" in result
+    relayed = json.loads(mock_send.call_args.args[0].content)
+    assert len(relayed["options"]["avoid_polygons"]["coordinates"]) == 1
+    await ors_p.close()
+
+
+async def test_handle_ors_batch(mocker: MockerFixture):
+    # the relayed request is returned after a delay depending on its coordinates
+    delays = {0: 0.12, 1: 0.02, 2: 0.08, 3: 0.06}
+
+    async def send(request, **kwargs):
+        body = json.loads(request.content)
+        await asyncio.sleep(delays[body["coordinates"][0][0]])
+        if body["coordinates"][0][0] == 2:
+            return httpx.Response(404, json={"error": "not found"})
+        return httpx.Response(200, json={"routes": [], "metadata": {"query": body}},
+                              headers={"Content-Type": "application/json"})
+
+    mock_send = mocker.patch('httpx.AsyncClient.send', new_callable=mocker.AsyncMock)
+    mock_send.side_effect = send
+    mocker.patch.object(settings, "ORS_BATCH_CONCURRENCY", 2)
+    rows = {i: fake_row(i, [c, c]) for i, c in enumerate([0, 1, 2, 3], start=1)}
+    mock_feature_query(mocker, rows)
+    area_index = DisasterAreaIndex(tracker=ChangeTracker())
+    lookup = mocker.spy(area_index, "get_multi_geometries")
+    ors_p = ORSProcessor(settings.ORS_BACKEND_URL, area_index=area_index)
+    requests = [ORSDirections.parse_obj({"coordinates": [[c, c], [c + 0.01, c + 0.01]],
+                                         "portal_options": {"strip_avoid_areas": False}}) for c in [0, 1, 2, 3]]
+    requests.append(ORSIsochrones.parse_obj({"locations": [[0, 0]], "range": [300]}))
+    lines = [json.loads(line) async for line in ors_p.handle_ors_batch(None, requests, basic_options(res="json"))]
+
+    # one lookup for the batch
+    assert lookup.call_count == 1
+    # two requests are relayed at a time, the last one starts after the second completed
+    assert [line["index"] for line in lines] == [4, 1, 2, 0, 3]
+    assert [line["status_code"] for line in lines] == [400, 200, 404, 200, 200]
+    # each request only avoids its own area
+    for line in [lines[1], lines[3], lines[4]]:
+        c = line["index"]
+        polygons = line["body"]["metadata"]["query"]["options"]["avoid_polygons"]["coordinates"]
+        assert len(polygons) == 1
+        assert shapely.Polygon(polygons[0][0]).contains(shapely.Point(c, c))
+    assert lines[2]["body"] == {"error": "not found"}
+
+
+async def test_lookup_batch_geometries_limit(mocker: MockerFixture):
+    mocker.patch('app.backend.ors_processor.AREA_LOOKUP_LIMIT', 1)
+    # the first request is near three areas, the second one only near the area with the highest id
+    rows = {i: fake_row(i, [c, c]) for i, c in enumerate([0, 0.05, 0.1, 3], start=1)}
+    mock_feature_query(mocker, rows)
+    area_index = DisasterAreaIndex(tracker=ChangeTracker())
+    lookup = mocker.spy(area_index, "get_multi_geometries")
+    ors_p = ORSProcessor(settings.ORS_BACKEND_URL, area_index=area_index)
+    requests = [ORSDirections.parse_obj({"coordinates": [[c, c], [c + 0.01, c + 0.01]]}) for c in [0, 3]]
+    candidates = await ors_p.lookup_batch_geometries(None, requests, basic_options(res="json"))
+    assert lookup.call_count == 1
+    # the areas of the first request do not crowd out the area of the second one
+    assert [len(candidates[i]) for i in range(2)] == [1, 1]
+    assert candidates[0][0].contains(shapely.Point(0, 0))
+    assert candidates[1][0].contains(shapely.Point(3, 3))
+
+
+async def test_handle_ors_request_candidates_not_cached(mocker: MockerFixture):
+    mock_send = mocker.patch('httpx.AsyncClient.send', new_callable=mocker.AsyncMock)
+    mock_send.side_effect = lambda *args, **kwargs: httpx.Response(
+        200, json={'routes': [], 'metadata': {'query': {}}}, headers={"Content-Type": "application/json"})
+    tracker = ChangeTracker()
+    ors_p = ORSProcessor(settings.ORS_BACKEND_URL, cache=ResponseCache(tracker=tracker))
+    mocker.patch('app.backend.ors_processor.change_tracker', tracker)
+    request = ORSDirections.parse_obj({"coordinates": [[8.681495, 49.41461], [8.687872, 49.420318]]})
+
+    for _ in range(2):
+        response = await ors_p.handle_ors_request(None, request.copy(deep=True), basic_options(res="json"), "key",
+                                                  candidate_geometries=[])
+        await read_body(response)
+        assert "X-Cache" not in response.headers
+    assert mock_send.call_count == 2
+    await ors_p.close()
+
+
+def test_batch_line():
+    assert json.loads(batch_line(1, 200, b'{"a":1}')) == {"index": 1, "status_code": 200, "body": {"a": 1}}
+    assert json.loads(batch_line(2, 200, b'<gpx/>', "application/gpx+xml")) == \
+        {"index": 2, "status_code": 200, "body": "<gpx/>"}
+    assert json.loads(batch_line(3, 502, b"")) == {"index": 3, "status_code": 502, "body": None}
@@ -0,0 +1,38 @@
+import json
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from app.backend.serialization import dumps, loads, feature_collection_chunks, feature_sequence_chunks
+from app.schemas.disaster_area import BBoxModel
+from app.schemas.ors_request import PortalOptions
+
+
+class TestSerialization:
+    def test_dumps(self):
+        assert dumps({"a": [1, 2.5, None], "b": "ü"}) == '{"a":[1,2.5,null],"b":"ü"}'.encode()
+        assert dumps({"c": np.array([[1.5, 2]]), 1: datetime(2022, 1, 1)}) == \
+               b'{"c":[[1.5,2.0]],"1":"2022-01-01T00:00:00"}'
+
+    def test_dumps_models(self):
+        options = PortalOptions(disaster_area_filter={"bbox": [1, 2, 3, 4]})
+        assert loads(dumps({"portal_options": options})) == {"portal_options": json.loads(options.json())}
+        assert dumps(BBoxModel.parse_obj([1, 2, 3, 4])) == b'[1.0,2.0,3.0,4.0]'
+
+    def test_dumps_unsupported(self):
+        with pytest.raises(TypeError):
+            dumps({"a": object()})
+
+    def test_loads(self):
+        assert loads(b'{"a":[1,2.5]}') == loads('{"a":[1,2.5]}') == {"a": [1, 2.5]}
+
+    @pytest.mark.parametrize("count", [0, 1, 5])
+    def test_feature_chunks(self, count):
+        features = [{"type": "Feature", "id": i, "bbox": [-i, 0, i, 1]} for i in range(count)]
+        collection = loads(b"".join(feature_collection_chunks(iter(features), chunk_features=2)))
+        assert collection == {"type": "FeatureCollection", "features": features,
+                              "bbox": [-count + 1, 0, count - 1, 1] if count else [0, 0, 0, 0]}
+        sequence = b"".join(feature_sequence_chunks(iter(features), chunk_features=2))
+        assert sequence.count(b"\x1e") == count
+        assert [loads(line.lstrip(b"\x1e")) for line in sequence.splitlines()] == features
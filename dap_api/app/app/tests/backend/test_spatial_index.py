@@ -0,0 +1,193 @@
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+from pytest_mock import MockerFixture
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.backend.spatial_index import DisasterAreaIndex
+from app.db.change_tracker import ChangeTracker
+from app.schemas.disaster_area import LookupGeometry
+from app.tests.utils.disaster_areas import create_new_disaster_area, square_around_coordinate_with_padding
+
+
+def fake_row(id: int, c: list, d_type_id: int = 1, created: datetime = datetime(2022, 1, 1)):
+    """Row as returned by CRUDDisasterArea.feature_query"""
+    coordinates = [square_around_coordinate_with_padding(c, 0.1)]
+    bbox = [c[0] - 0.1, c[1] - 0.1, c[0] + 0.1, c[1] + 0.1]
+    properties = dict(id=id, name=f"area {id}", provider_id=1, d_type_id=d_type_id, ds_type_id=None,
+                      description="", created=created, area=1.0)
+    geojson = json.dumps({"type": "MultiPolygon", "bbox": bbox, "coordinates": coordinates})
+    return SimpleNamespace(**properties, geojson=geojson, _mapping={**properties, "geojson": geojson})
+
+
+def mock_feature_query(mocker: MockerFixture, rows: dict):
+    """Mocks the feature query to return the rows by id, returns the mocked id filter"""
+    query = mocker.MagicMock()
+    query.all.side_effect = lambda: list(rows.values())
+    query.filter.side_effect = lambda clause: SimpleNamespace(
+        all=lambda: [rows[i] for i in clause.right.value if i in rows])
+    mocker.patch.object(crud.disaster_area, "feature_query", return_value=query)
+    return query
+
+
+class TestDisasterAreaIndex:
+    def test_lookup(self, mocker: MockerFixture):
+        rows = {1: fake_row(1, [10.5, 10.5]), 2: fake_row(2, [11.5, 11.5], d_type_id=2), 3: fake_row(3, [20, 20])}
+        mock_feature_query(mocker, rows)
+        index = DisasterAreaIndex(tracker=ChangeTracker())
+        collection = index.get_multi_as_feature_collection(None, bbox=[10, 10, 12, 12])
+        assert [f.id for f in collection.features] == [1, 2]
+        assert collection.features[0].geometry.type == "Polygon"
+        assert list(collection.bbox) == [10.4, 10.4, 11.6, 11.6]
+        assert [f.id for f in index.get_multi_as_feature_collection(None, d_type_id=2).features] == [2]
+        assert [f.id for f in index.get_multi_as_feature_collection(None, skip=1, limit=1).features] == [2]
+        assert list(index.get_multi_as_feature_collection(None, bbox=[-10, -10, -9, -9]).bbox) == [0, 0, 0, 0]
+
+    def test_get_multi_geometries(self, mocker: MockerFixture):
+        rows = {1: fake_row(1, [10.5, 10.5]), 2: fake_row(2, [11.5, 11.5]), 3: fake_row(3, [20, 20])}
+        mock_feature_query(mocker, rows)
+        index = DisasterAreaIndex(tracker=ChangeTracker())
+        geometries = index.get_multi_geometries(None, bbox=[10, 10, 12, 12])
+        assert [g.geom_type for g in geometries] == ["MultiPolygon", "MultiPolygon"]
+        assert [g.bounds for g in geometries] == [(10.4, 10.4, 10.6, 10.6), (11.4, 11.4, 11.6, 11.6)]
+
+    def test_get_multi_references(self, mocker: MockerFixture):
+        rows = {1: fake_row(1, [10.5, 10.5]), 2: fake_row(2, [11.5, 11.5]), 3: fake_row(3, [20, 20])}
+        mock_feature_query(mocker, rows)
+        tracker = ChangeTracker()
+        index = DisasterAreaIndex(tracker=tracker)
+        references = index.get_multi_references(None, bbox=[10, 10, 12, 12])
+        assert [r.id for r in references.areas] == [1, 2]
+        assert list(references.areas[1].bbox) == [11.4, 11.4, 11.6, 11.6]
+        assert list(references.bbox) == [10.4, 10.4, 11.6, 11.6]
+        assert index.get_multi_references(None, bbox=[10, 10, 12, 12]).version == references.version
+        # the version changes with the geometry of an area
+        rows[2] = fake_row(2, [11.55, 11.55])
+        tracker.notify("disaster_areas", [2])
+        assert index.get_multi_references(None, bbox=[10, 10, 12, 12]).version != references.version
+        assert index.get_multi_references(None, bbox=[-10, -10, -9, -9]).areas == []
+
+    def test_get_multi_references_with_geometries(self, mocker: MockerFixture):
+        rows = {1: fake_row(1, [10.5, 10.5]), 2: fake_row(2, [11.5, 11.5]), 3: fake_row(3, [20, 20])}
+        mock_feature_query(mocker, rows)
+        index = DisasterAreaIndex(tracker=ChangeTracker())
+        query = mocker.spy(index, "query")
+        references, geometries = index.get_multi_references_with_geometries(None, bbox=[10, 10, 12, 12])
+        assert query.call_count == 1
+        assert references == index.get_multi_references(None, bbox=[10, 10, 12, 12])
+        assert geometries == index.get_multi_geometries(None, bbox=[10, 10, 12, 12])
+
+    def test_lookup_near(self, mocker: MockerFixture):
+        rows = {1: fake_row(1, [10.5, 10.5]), 2: fake_row(2, [15, 15]), 3: fake_row(3, [20.5, 20.5])}
+        mock_feature_query(mocker, rows)
+        index = DisasterAreaIndex(tracker=ChangeTracker())
+        near = [LookupGeometry(coordinates=[[10, 10]], distance=70000),
+                LookupGeometry(coordinates=[[20, 20]], distance=70000)]
+        collection = index.get_multi_as_feature_collection(None, near=near)
+        # the area between the locations is not within the distance
+        assert [f.id for f in collection.features] == [1, 3]
+        collection = index.get_multi_as_feature_collection(None, near=near, bbox=[0, 0, 15, 15])
+        assert [f.id for f in collection.features] == [1]
+        near = [LookupGeometry(coordinates=[[10, 10]], distance=40000)]
+        assert index.get_multi_as_feature_collection(None, near=near).features == []
+
+    def test_lookup_corridor(self, mocker: MockerFixture):
+        rows = {1: fake_row(1, [10.5, 10.5]), 2: fake_row(2, [10.5, 13.5]), 3: fake_row(3, [13.5, 10.5])}
+        mock_feature_query(mocker, rows)
+        index = DisasterAreaIndex(tracker=ChangeTracker())
+        corridor = [LookupGeometry(coordinates=[[10, 10], [14, 14]], distance=20000)]
+        # areas in the corners of the bbox of the route are not within the corridor
+        assert [f.id for f in index.get_multi_as_feature_collection(None, near=corridor).features] == [1]
+
+    def test_lookup_date_time(self, mocker: MockerFixture):
+        rows = {1: fake_row(1, [10.5, 10.5], created=datetime(2022, 1, 1)),
+                2: fake_row(2, [11.5, 11.5], created=datetime(2022, 6, 1))}
+        mock_feature_query(mocker, rows)
+        index = DisasterAreaIndex(tracker=ChangeTracker())
+
+        def ids(date_time):
+            return [f.id for f in index.get_multi_as_feature_collection(None, date_time=date_time).features]
+        assert ids("2022-01-01T00:00:00") == [1]
+        assert ids("2022-03-01T00:00:00/..") == [2]
+        assert ids("/2022-03-01T00:00:00") == [1]
+        assert ids("2021-01-01T00:00:00/2023-01-01T00:00:00") == [1, 2]
+
+    def test_incremental_refresh(self, mocker: MockerFixture):
+        tracker = ChangeTracker()
+        rows = {1: fake_row(1, [10.5, 10.5]), 2: fake_row(2, [11.5, 11.5])}
+        query = mock_feature_query(mocker, rows)
+        index = DisasterAreaIndex(tracker=tracker)
+        index.refresh(None)
+        assert query.all.call_count == 1
+        # no changes, nothing is loaded
+        index.get_multi_as_feature_collection(None)
+        assert query.all.call_count == 1
+        assert query.filter.call_count == 0
+
+        rows[2] = fake_row(2, [30.5, 30.5])
+        rows[3] = fake_row(3, [31.5, 31.5])
+        del rows[1]
+        tracker.notify("disaster_areas", [1, 2, 3])
+        assert index.stats()["pending_changes"] == 3
+        assert index.stats()["stale_for"] >= 0
+        collection = index.get_multi_as_feature_collection(None, bbox=[30, 30, 32, 32])
+        assert [f.id for f in collection.features] == [2, 3]
+        assert query.all.call_count == 1
+        assert query.filter.call_count == 1
+        assert index.stats()["pending_changes"] == 0
+
+        # unknown rows changed
+        tracker.notify("disaster_areas")
+        assert index.stats()["reload_pending"]
+        index.refresh(None)
+        assert query.all.call_count == 2
+
+    def test_reload_after_max_age(self, mocker: MockerFixture):
+        query = mock_feature_query(mocker, {1: fake_row(1, [10.5, 10.5])})
+        index = DisasterAreaIndex(max_age=0, tracker=ChangeTracker())
+        index.refresh(None)
+        index.refresh(None)
+        assert query.all.call_count == 2
+
+    def test_stats(self, mocker: MockerFixture):
+        mock_feature_query(mocker, {1: fake_row(1, [10.5, 10.5]), 2: fake_row(2, [11.5, 11.5])})
+        index = DisasterAreaIndex(tracker=ChangeTracker())
+        assert index.stats()["age"] is None
+        index.refresh(None)
+        stats = index.stats()
+        assert stats["entries"] == 2
+        assert stats["coordinates"] == 10
+        assert stats["memory_bytes"] > 0
+        assert stats["age"] >= 0
+        assert not stats["reload_pending"]
+
+
+def test_index_matches_database(db: Session) -> None:
+    d_area1 = create_new_disaster_area(db, [-150.5, -60.5], f=0.1)
+    d_area2 = create_new_disaster_area(db, [-149.5, -59.5], f=0.1, multi=True)
+    bbox = [-151, -61, -149, -59]
+    index = DisasterAreaIndex()
+    assert index.get_multi_as_feature_collection(db, bbox=bbox) == \
+        crud.disaster_area.get_multi_as_feature_collection(db, bbox=bbox)
+    statements = []
+
+    def count_statements(*args):
+        statements.append(args)
+
+    event.listen(db.get_bind(), "before_cursor_execute", count_statements)
+    collection = index.get_multi_as_feature_collection(db, bbox=bbox)
+    event.remove(db.get_bind(), "before_cursor_execute", count_statements)
+    assert len(statements) == 0
+    assert [f.id for f in collection.features] == [d_area1.id, d_area2.id]
+
+    assert index.get_multi_references(db, bbox=bbox) == crud.disaster_area.get_multi_references(db, bbox=bbox)
+
+    # changes through the CRUD objects are applied
+    crud.disaster_area.remove(db, id=d_area1.id)
+    d_area3 = create_new_disaster_area(db, [-150, -60], f=0.1)
+    collection = index.get_multi_as_feature_collection(db, bbox=bbox)
+    assert [f.id for f in collection.features] == [d_area2.id, d_area3.id]
+    assert collection == crud.disaster_area.get_multi_as_feature_collection(db, bbox=bbox)
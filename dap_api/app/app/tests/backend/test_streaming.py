@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from app.backend.streaming import JSONSplicer
+
+
+def splice(document: bytes, splicer: JSONSplicer, chunk_size: int) -> bytes:
+    chunks = [document[i:i + chunk_size] for i in range(0, len(document), chunk_size)]
+    return b"".join([splicer.feed(c) for c in chunks] + [splicer.close()])
+
+
+class TestJSONSplicer:
+    @pytest.mark.parametrize("chunk_size", [1, 7, 64, 100000])
+    def test_splice(self, chunk_size):
+        document = {"features": [{"properties": {"name": "metadata query"}}] * 50,
+                    "metadata": {"service": "routing", "query": {"profile": "driving-car"}}}
+        splicer = JSONSplicer(b'"portal_options":{"debug":false}', b'"disaster_areas":[]')
+        result = json.loads(splice(json.dumps(document).encode(), splicer, chunk_size))
+        assert result["metadata"]["query"] == {"portal_options": {"debug": False}, "profile": "driving-car"}
+        assert result["disaster_areas"] == []
+        assert result["features"] == document["features"]
+        assert splicer.query_spliced
+
+    @pytest.mark.parametrize("chunk_size", [1, 5, 1000])
+    def test_splice_empty_query(self, chunk_size):
+        document = b'{"routes": [], "metadata": {"query": { }}}'
+        result = json.loads(splice(document, JSONSplicer(b'"a":1'), chunk_size))
+        assert result == {"routes": [], "metadata": {"query": {"a": 1}}}
+
+    def test_no_metadata(self):
+        document = b'{"routes": [], "query": {"b": 2}}'
+        splicer = JSONSplicer(b'"a":1')
+        # a query object outside the metadata is not touched
+        assert splice(document, splicer, 3) == document
+        assert not splicer.query_spliced
+
+    def test_pass_through(self):
+        document = json.dumps({"features": list(range(1000))}).encode()
+        assert splice(document, JSONSplicer(), 10) == document
+
+    @pytest.mark.parametrize("chunk_size", [1, 7, 64, 100000])
+    @pytest.mark.parametrize("query", [
+        {"options": {"avoid_polygons": {"coordinates": [[[[1, 2], [3, 4]]]] * 40, "type": "MultiPolygon"},
+                     "avoid_features": ["ferries"]}},
+        {"options": {"avoid_features": ["ferries"], "avoid_polygons": {"coordinates": [[[[1, 2]]]] * 40}}},
+        {"options": {"avoid_polygons": {"coordinates": [[[[1, 2]]]] * 40}}, "profile": "driving-car"},
+    ])
+    @pytest.mark.parametrize("value", [None, {"coordinates": [], "type": "MultiPolygon"}])
+    def test_replace(self, chunk_size, query, value):
+        document = {"routes": [{"summary": {"distance": 1}}] * 50, "metadata": {"query": query}}
+        replacement = None if value is None else json.dumps(value).encode()
+        splicer = JSONSplicer(b'"a":1', query_replacement=("avoid_polygons", replacement))
+        result = json.loads(splice(json.dumps(document).encode(), splicer, chunk_size))
+        expected = json.loads(json.dumps(query))
+        if value is None:
+            expected["options"].pop("avoid_polygons")
+        else:
+            expected["options"]["avoid_polygons"] = value
+        assert result["metadata"]["query"] == {"a": 1, **expected}
+        assert result["routes"] == document["routes"]
+        assert splicer.query_spliced
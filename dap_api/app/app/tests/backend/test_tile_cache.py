@@ -0,0 +1,107 @@
+import json
+import os
+import time
+
+from pytest_mock import MockerFixture
+
+from app import crud
+from app.backend.tile_cache import TileCache, TILE_OVERHEAD
+from app.db.change_listener import ChangeListener
+from app.db.change_tracker import ChangeTracker
+
+BOUNDS_A = [0, 0, 1, 1]
+BOUNDS_B = [10, 10, 11, 11]
+
+
+class TestTileCache:
+    def test_get_set(self):
+        cache = TileCache(tracker=ChangeTracker())
+        assert cache.get(None, "a") is None
+        cache.set("a", b"tile", BOUNDS_A, [1], stamp={})
+        assert cache.get(None, "a") == b"tile"
+        assert cache.hits == 1
+        assert cache.misses == 1
+        assert cache.memory_size == 4 + TILE_OVERHEAD
+
+    def test_spill_to_disk(self, tmp_path):
+        cache = TileCache(max_bytes=TILE_OVERHEAD + 10, disk_max_bytes=2 * TILE_OVERHEAD + 20,
+                          disk_dir=str(tmp_path), tracker=ChangeTracker())
+        cache.set("a", b"a" * 10, BOUNDS_A, [1], stamp={})
+        cache.set("b", b"b" * 10, BOUNDS_A, [2], stamp={})
+        cache.set("c", b"c" * 10, BOUNDS_A, [3], stamp={})
+        assert cache.stats()["memory_entries"] == 1
+        assert cache.stats()["disk_entries"] == 2
+        # tiles on disk are moved back to memory
+        assert cache.get(None, "a") == b"a" * 10
+        assert cache.get(None, "b") == b"b" * 10
+        assert cache.stats()["disk_entries"] == 2
+        cache.set("d", b"d" * 10, BOUNDS_A, [4], stamp={})
+        # the least recently used tile is evicted from disk
+        assert cache.get(None, "c") is None
+        assert cache.evictions == 1
+        cache.close()
+        assert not os.listdir(tmp_path)
+
+    def test_disk_disabled(self):
+        cache = TileCache(max_bytes=TILE_OVERHEAD + 10, tracker=ChangeTracker())
+        cache.set("a", b"a" * 10, BOUNDS_A, [1], stamp={})
+        cache.set("b", b"b" * 10, BOUNDS_A, [2], stamp={})
+        assert cache.get(None, "a") is None
+        assert cache.get(None, "b") == b"b" * 10
+        assert cache.evictions == 1
+
+    def test_invalidate_by_footprint(self, mocker: MockerFixture, tmp_path):
+        tracker = ChangeTracker()
+        bboxes = mocker.patch.object(crud.disaster_area, "get_bboxes", return_value=[[10.5, 10.5, 12, 12]])
+        cache = TileCache(max_bytes=TILE_OVERHEAD + 10, disk_max_bytes=10 * TILE_OVERHEAD,
+                          disk_dir=str(tmp_path), tracker=tracker)
+        cache.set("a", b"a", BOUNDS_A, [1, 2], stamp={})
+        cache.set("b", b"b", BOUNDS_B, [], stamp={})
+        cache.set("c", b"c", BOUNDS_A, [3], stamp={})
+        # area 2 was in tile a, its new bounds intersect tile b
+        tracker.notify("disaster_areas", [2])
+        assert cache.get(None, "a") is None
+        bboxes.assert_called_once_with(None, {2})
+        assert cache.get(None, "b") is None
+        assert cache.get(None, "c") == b"c"
+        assert cache.invalidations == 2
+        assert not os.listdir(next(tmp_path.iterdir()))
+
+    def test_invalidate_by_listener(self, mocker: MockerFixture):
+        tracker = ChangeTracker()
+        mocker.patch.object(crud.disaster_area, "get_bboxes", return_value=[])
+        cache = TileCache(tracker=tracker)
+        cache.set("a", b"a", BOUNDS_A, [1], stamp={})
+        cache.set("b", b"b", BOUNDS_B, [2], stamp={})
+        # change of area 1 made by another process
+        ChangeListener("", tracker=tracker, origin="self").handle([
+            json.dumps({"table": "disaster_areas", "id": 1, "origin": "other"})
+        ])
+        assert cache.get(None, "a") is None
+        assert cache.get(None, "b") == b"b"
+
+    def test_invalidate_all(self):
+        tracker = ChangeTracker()
+        cache = TileCache(tracker=tracker)
+        cache.set("a", b"a", BOUNDS_A, [1], stamp={})
+        tracker.notify("disaster_areas")
+        assert cache.get(None, "a") is None
+
+    def test_stale_stamp(self):
+        tracker = ChangeTracker()
+        cache = TileCache(tracker=tracker)
+        stamp = tracker.stamp("disaster_areas")
+        tracker.notify("other")
+        cache.set("a", b"a", BOUNDS_A, [1], stamp=stamp)
+        assert cache.get(None, "a") == b"a"
+        tracker.notify("disaster_areas", [])
+        # rendered before the change, not cached
+        cache.set("b", b"b", BOUNDS_A, [1], stamp=stamp)
+        assert cache.get(None, "b") is None
+
+    def test_ttl(self):
+        cache = TileCache(ttl=0.05, tracker=ChangeTracker())
+        cache.set("a", b"a", BOUNDS_A, [1], stamp={})
+        assert cache.get(None, "a") == b"a"
+        time.sleep(0.06)
+        assert cache.get(None, "a") is None
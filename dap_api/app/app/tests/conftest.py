@@ -4,7 +4,7 @@ import pytest
 from fastapi.testclient import TestClient
 
 from app import crud
-from app.api.deps import get_db
+from app.api.deps import get_db, get_session_factory
 from app.config import settings
 from app.db.base import BaseTable
 from app.db.init_db import init_db
@@ -12,11 +12,14 @@ from app.logger import logger
 from app.main import app
 from app.schemas import UserCreateIn
 from app.security import generate_secret
-from app.tests.utils.overrides import override_get_db
+from app.tests.utils.overrides import override_get_db, override_get_session_factory
 from app.tests.utils.test_db import engine, TestSession
 from app.tests.utils.utils import random_email, get_admin_header
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_session_factory] = override_get_session_factory
+# the test database has no change notification triggers, CRUD writes are reported to the caches directly
+settings.DB_CHANGE_LISTENER_ENABLED = False
 
 
 PROVIDER_OWNER_SECRET = generate_secret()
@@ -1,14 +1,17 @@
 import json
 from datetime import datetime as dt
 
-from sqlalchemy import func
+import pytest
+from sqlalchemy import func, event
 from sqlalchemy.orm import Session
 
 from app import crud
-from app.crud.crud_disaster_area import multi_to_single
-from app.schemas import DisasterAreaCreate
-from app.schemas.disaster_area import DisasterAreaPropertiesCreate, DisasterAreaUpdate, Polygon, MultiPolygon
-from app.tests.utils.disaster_areas import create_new_disaster_area, create_new_polygon, create_new_properties
+from app.crud.crud_disaster_area import multi_to_single, InvalidGeometryError
+from app.schemas import DisasterAreaCreate, DisasterArea
+from app.schemas.disaster_area import DisasterAreaPropertiesCreate, DisasterAreaUpdate, Polygon, MultiPolygon, \
+    LookupGeometry
+from app.tests.utils.disaster_areas import create_new_disaster_area, create_new_polygon, create_new_properties, \
+    create_new_multi_polygon
 from app.tests.utils.utils import random_lower_string
 
 
@@ -30,6 +33,48 @@ def test_create_disaster_area(db: Session) -> None:
     assert disaster_area.id
 
 
+def test_create_disaster_area_as_feature(db: Session) -> None:
+    d_area_obj = DisasterAreaCreate(
+        geometry=create_new_polygon([2, 2], 1),
+        properties=create_new_properties()
+    )
+    feature = crud.disaster_area.create_as_feature(db, obj_in=d_area_obj)
+    assert feature == crud.disaster_area.get_as_feature(db, feature.id)
+    assert feature.properties.name == d_area_obj.properties.name
+    assert feature.properties.area > 0
+    assert feature.geometry == d_area_obj.geometry
+
+
+def test_create_disaster_area_invalid_geometry(db: Session) -> None:
+    d_area_obj = DisasterAreaCreate(
+        geometry=Polygon(coordinates=[[[0, 0], [0, 1], [1, 0], [1, 1], [0, 0]]]),
+        properties=create_new_properties()
+    )
+    with pytest.raises(InvalidGeometryError, match=r"Geometry not valid: Self-intersection\[0.5 0.5\]"):
+        crud.disaster_area.create_as_feature(db, obj_in=d_area_obj)
+    assert not crud.disaster_area.get_by_name(db, name=d_area_obj.properties.name)
+
+
+def test_create_disaster_areas_bulk(db: Session) -> None:
+    existing = create_new_disaster_area(db)
+    objs_in = {
+        0: DisasterAreaCreate(geometry=create_new_polygon(), properties=create_new_properties(info="a\tb\nc\\d")),
+        1: DisasterAreaCreate(geometry=Polygon(coordinates=[[[0, 0], [0, 1], [1, 0], [1, 1], [0, 0]]]),
+                              properties=create_new_properties()),
+        2: DisasterAreaCreate(geometry=create_new_polygon(), properties=create_new_properties(name=existing.name)),
+        4: DisasterAreaCreate(geometry=create_new_multi_polygon(), properties=create_new_properties())
+    }
+    created, invalid = crud.disaster_area.create_bulk(db, objs_in=objs_in)
+    assert set(created) == {0, 4}
+    assert invalid == {1: "Self-intersection[0.5 0.5]"}
+    for i, area_id in created.items():
+        feature = crud.disaster_area.get_as_feature(db, area_id)
+        assert feature.properties.name == objs_in[i].properties.name
+        assert feature.properties.description == objs_in[i].properties.description
+        assert feature.properties.area > 0
+    assert crud.disaster_area.get_existing_names(db, [existing.name, objs_in[1].properties.name]) == {existing.name}
+
+
 def test_get_disaster_area_by_id(db: Session) -> None:
     d_area = create_new_disaster_area(db, [2, 2])
     d_area_get = crud.disaster_area.get(db, id=d_area.id)
@@ -135,6 +180,107 @@ def test_get_disaster_areas_by_bbox(db: Session) -> None:
     assert d_area3 in d_areas
 
 
+def test_get_disaster_areas_near(db: Session) -> None:
+    d_area1 = create_new_disaster_area(db, [-100.5, 30.5], f=0.1)
+    d_area2 = create_new_disaster_area(db, [-95, 35], f=0.1)
+    d_area3 = create_new_disaster_area(db, [-89.5, 39.5], f=0.1)
+    near = [LookupGeometry(coordinates=[[-101, 30]], distance=100000),
+            LookupGeometry(coordinates=[[-89, 40]], distance=100000)]
+    collection = crud.disaster_area.get_multi_as_feature_collection(db, near=near)
+    assert [f.id for f in collection.features] == [d_area1.id, d_area3.id]
+    assert d_area2 not in crud.disaster_area.get_multi(db, near=near)
+
+
+def test_get_disaster_areas_as_feature_collection(db: Session) -> None:
+    d_area1 = create_new_disaster_area(db, [120.5, 45.5], f=0.1)
+    d_area2 = create_new_disaster_area(db, [121.5, 46.5], f=0.1, multi=True)
+    statements = []
+
+    def count_statements(*args):
+        statements.append(args)
+
+    event.listen(db.get_bind(), "before_cursor_execute", count_statements)
+    collection = crud.disaster_area.get_multi_as_feature_collection(db, bbox=[120, 45, 122, 47])
+    page = crud.disaster_area.get_multi_as_feature_collection(db, bbox=[120, 45, 122, 47], skip=1, limit=1)
+    event.remove(db.get_bind(), "before_cursor_execute", count_statements)
+    # one statement per collection
+    assert len(statements) == 2
+    assert [f.id for f in collection.features] == [d_area1.id, d_area2.id]
+    assert collection.features[0].properties.name == d_area1.name
+    assert collection.features[0].geometry.type == "Polygon"
+    assert collection.features[1].geometry.type == "MultiPolygon"
+    assert list(collection.bbox) == [120.4, 45.4, 121.9, 46.9]
+    assert [f.id for f in page.features] == [d_area2.id]
+    assert list(page.bbox) == [121.4, 46.4, 121.9, 46.9]
+
+
+def test_get_disaster_areas_after(db: Session) -> None:
+    d_area1 = create_new_disaster_area(db, [130.5, 45.5], f=0.1)
+    d_area2 = create_new_disaster_area(db, [131.5, 46.5], f=0.1, multi=True)
+    d_area3 = create_new_disaster_area(db, [131.5, 45.5], f=0.1)
+    bbox = [130, 45, 132, 47]
+    page = crud.disaster_area.get_multi_as_feature_collection(db, bbox=bbox, limit=1, after=d_area1.id)
+    assert [f.id for f in page.features] == [d_area2.id]
+    features = list(crud.disaster_area.iter_features(db, bbox=bbox, after=d_area1.id, batch_size=1))
+    assert [f["id"] for f in features] == [d_area2.id, d_area3.id]
+    collection = crud.disaster_area.get_multi_as_feature_collection(db, bbox=bbox, after=d_area1.id)
+    # the streamed features match the validated ones
+    assert [DisasterArea.parse_obj(f) for f in features] == collection.features
+
+
+def test_get_disaster_area_tile(db: Session) -> None:
+    d_area1 = create_new_disaster_area(db, [8.5, 49.5], f=0.01, d_id=3)
+    d_area2 = create_new_disaster_area(db, [8.52, 49.52], f=0.01, d_id=4)
+    tile, ids = crud.disaster_area.get_tile(db, 10, 536, 349)
+    assert tile
+    assert {d_area1.id, d_area2.id} <= set(ids)
+    _, ids = crud.disaster_area.get_tile(db, 10, 536, 349, d_type_id=3)
+    assert d_area1.id in ids and d_area2.id not in ids
+    tile, ids = crud.disaster_area.get_tile(db, 10, 0, 0)
+    assert d_area1.id not in ids
+    assert crud.disaster_area.get_bboxes(db, [d_area1.id, -1]) == [
+        pytest.approx([8.49, 49.49, 8.51, 49.51])
+    ]
+
+
+def test_get_disaster_area_geometries(db: Session) -> None:
+    create_new_disaster_area(db, [130.5, 45.5], f=0.1)
+    create_new_disaster_area(db, [131.5, 46.5], f=0.1, multi=True)
+    geometries = crud.disaster_area.get_multi_geometries(db, bbox=[130, 45, 132, 47])
+    # polygons and multi polygons are returned alike
+    assert [g.geom_type for g in geometries] == ["MultiPolygon", "MultiPolygon"]
+    assert [len(g.geoms) for g in geometries] == [1, 2]
+
+
+def test_get_disaster_area_references(db: Session) -> None:
+    d_area1 = create_new_disaster_area(db, [140.5, 45.5], f=0.1)
+    d_area2 = create_new_disaster_area(db, [141.5, 46.5], f=0.1, multi=True)
+    references = crud.disaster_area.get_multi_references(db, bbox=[140, 45, 142, 47])
+    assert [r.id for r in references.areas] == [d_area1.id, d_area2.id]
+    assert list(references.areas[0].bbox) == [140.4, 45.4, 140.6, 45.6]
+    assert list(references.bbox) == [140.4, 45.4, 141.9, 46.9]
+    assert references.version == crud.disaster_area.get_multi_references(db, bbox=[140, 45, 142, 47]).version
+    # the version changes with the geometry of an area
+    crud.disaster_area.update(db, db_obj=d_area1,
+                              obj_in=DisasterAreaUpdate(geometry=create_new_polygon([140.5, 45.5], 0.2)))
+    assert references.version != crud.disaster_area.get_multi_references(db, bbox=[140, 45, 142, 47]).version
+
+
+def test_get_disaster_area_references_with_geometries(db: Session) -> None:
+    create_new_disaster_area(db, [140.5, 45.5], f=0.1)
+    create_new_disaster_area(db, [141.5, 46.5], f=0.1, multi=True)
+    references, geometries = crud.disaster_area.get_multi_references_with_geometries(db, bbox=[140, 45, 142, 47])
+    assert references == crud.disaster_area.get_multi_references(db, bbox=[140, 45, 142, 47])
+    assert [g.wkb for g in geometries] == \
+           [g.wkb for g in crud.disaster_area.get_multi_geometries(db, bbox=[140, 45, 142, 47])]
+
+
+def test_get_disaster_areas_as_empty_feature_collection(db: Session) -> None:
+    collection = crud.disaster_area.get_multi_as_feature_collection(db, bbox=[-170, -80, -169, -79])
+    assert collection.features == []
+    assert list(collection.bbox) == [0, 0, 0, 0]
+
+
 def test_update_disaster_area_properties(db: Session) -> None:
     d_area = create_new_disaster_area(db, [2, 2], f=2)
     d_area_update = dict({"properties": {
@@ -162,6 +308,28 @@ def test_update_disaster_area_geometry(db: Session) -> None:
     assert d_area2.geom == db.execute(func.ST_multi(func.ST_GeomFromGeoJSON(geom.json()))).scalar()
 
 
+def test_update_disaster_area_as_feature(db: Session) -> None:
+    d_area = create_new_disaster_area(db, [2, 2], f=2)
+    geom = create_new_polygon([-1, -1], 1)
+    feature = crud.disaster_area.update_as_feature(db, id=d_area.id, obj_in=DisasterAreaUpdate(
+        geometry=geom,
+        properties={"description": "Updated description"}
+    ))
+    assert feature == crud.disaster_area.get_as_feature(db, d_area.id)
+    assert feature.properties.description == "Updated description"
+    assert feature.geometry == geom
+
+
+def test_update_disaster_area_invalid_geometry(db: Session) -> None:
+    d_area = create_new_disaster_area(db, [2, 2], f=2)
+    d_area_update = DisasterAreaUpdate(
+        geometry=Polygon(coordinates=[[[0, 0], [0, 1], [1, 0], [1, 1], [0, 0]]])
+    )
+    with pytest.raises(InvalidGeometryError):
+        crud.disaster_area.update_as_feature(db, id=d_area.id, obj_in=d_area_update)
+    assert crud.disaster_area.update_as_feature(db, id=-1, obj_in=d_area_update) is None
+
+
 def test_remove_disaster_area(db: Session) -> None:
     d_area = create_new_disaster_area(db, [-1, -4], f=2)
     d_area_2 = crud.disaster_area.remove(db, id=d_area.id)
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.schemas import RoutingJobCreate
+
+
+def create_new_routing_job(db: Session):
+    return crud.routing_job.create(db, obj_in=RoutingJobCreate(
+        portal_mode="avoid_areas",
+        ors_api="directions",
+        ors_profile="driving-car",
+        ors_response_type="json",
+        request='{"coordinates": [[8.68, 49.41], [8.69, 49.42]]}'
+    ))
+
+
+def test_create_routing_job(db: Session) -> None:
+    job = create_new_routing_job(db)
+    assert len(job.id) == 32
+    assert job.status == "pending"
+    assert job.created is not None
+    assert crud.routing_job.get(db, job.id) == job
+
+
+def test_routing_job_lifecycle(db: Session) -> None:
+    job = create_new_routing_job(db)
+    crud.routing_job.start(db, db_obj=job)
+    assert job.status == "running"
+    assert job.started is not None
+    crud.routing_job.finish(db, db_obj=job, status_code=200, result=b'{"routes": []}', media_type="application/json")
+    db.expire(job)
+    job = crud.routing_job.get(db, job.id)
+    assert job.status == "succeeded"
+    assert job.result == b'{"routes": []}'
+    assert job.finished >= job.started
+
+    failed = create_new_routing_job(db)
+    crud.routing_job.fail(db, db_obj=failed, error="broken")
+    assert crud.routing_job.get(db, failed.id).status == "failed"
+
+
+def test_remove_expired_routing_jobs(db: Session) -> None:
+    expired = create_new_routing_job(db)
+    expired.created = datetime.now() - timedelta(hours=2)
+    db.commit()
+    current = create_new_routing_job(db)
+    assert crud.routing_job.remove_expired(db, max_age=3600) >= 1
+    db.expire_all()
+    assert crud.routing_job.get(db, expired.id) is None
+    assert crud.routing_job.get(db, current.id) is not None
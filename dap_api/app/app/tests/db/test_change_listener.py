@@ -0,0 +1,47 @@
+import json
+
+from app.db.change_listener import ChangeListener
+from app.db.change_tracker import ChangeTracker
+
+
+def payload(table: str, id: int = None, origin: str = "other"):
+    return json.dumps({"table": table, "id": id, "origin": origin})
+
+
+class TestChangeListener:
+    def test_handle(self):
+        tracker = ChangeTracker()
+        changes = []
+        tracker.subscribe("disaster_areas", lambda table, ids: changes.append((table, ids)))
+        tracker.subscribe("custom_speeds", lambda table, ids: changes.append((table, ids)))
+        listener = ChangeListener("", tracker=tracker, origin="self")
+        listener.handle([
+            payload("disaster_areas", 1),
+            payload("custom_speeds", 4),
+            payload("disaster_areas", 2),
+            payload("disaster_areas", 3, origin="self")
+        ])
+        # one notification per table, own changes are skipped
+        assert changes == [("disaster_areas", [1, 2]), ("custom_speeds", [4])]
+        assert tracker.version("disaster_areas") == 1
+        assert tracker.version("custom_speeds") == 1
+
+    def test_handle_unknown_rows(self):
+        tracker = ChangeTracker()
+        changes = []
+        tracker.subscribe("disaster_areas", lambda table, ids: changes.append(ids))
+        listener = ChangeListener("", tracker=tracker, origin="self")
+        listener.handle([payload("disaster_areas", 1), payload("disaster_areas"), payload("disaster_areas", 2)])
+        assert changes == [None]
+
+    def test_handle_invalid_payload(self):
+        tracker = ChangeTracker()
+        listener = ChangeListener("", tracker=tracker, origin="self")
+        listener.handle(["no json", json.dumps({"id": 1}), payload("providers", 1)])
+        assert tracker.version("providers") == 1
+
+    def test_own_changes_only(self):
+        tracker = ChangeTracker()
+        listener = ChangeListener("", tracker=tracker, origin="self")
+        listener.handle([payload("providers", 1, origin="self")])
+        assert tracker.version("providers") == 0
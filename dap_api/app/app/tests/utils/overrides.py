@@ -1,6 +1,10 @@
 from .test_db import TestSession
 
 
+def override_get_session_factory():
+    return TestSession
+
+
 def override_get_db():
     db = TestSession()
     try: